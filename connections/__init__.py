@@ -1,5 +1,22 @@
 # connections/__init__.py
-from .tcp import TCPConnection
-from .serial import SerialConnection
+from .registry import open_connection, connection_from_url, register_transport
 
-__all__ = ['TCPConnection', 'SerialConnection']
\ No newline at end of file
+__all__ = [
+    'TCPConnection',
+    'SerialConnection',
+    'open_connection',
+    'connection_from_url',
+    'register_transport',
+]
+
+# transports are imported on first use, pyserial is only needed for serial connections
+_lazy_transports = {
+    'TCPConnection': 'tcp',
+    'SerialConnection': 'serial',
+}
+
+def __getattr__(name):
+    if name in _lazy_transports:
+        from .registry import get_transport
+        return get_transport(_lazy_transports[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -22,6 +22,18 @@ class BaseConnection(ABC):
     def read(self, size: int) -> bytes:
         pass
 
+    @abstractmethod
+    def set_timeout(self, timeout: float):
+        pass
+
+    @classmethod
+    @abstractmethod
+    def from_url(cls, path: str, options: dict):
+        '''
+        create a connection from the path and query options of a connection URL,
+        see connections.registry
+        '''
+
     def __enter__(self):
         self.open()
         return self
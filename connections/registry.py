@@ -0,0 +1,113 @@
+# connections/registry.py
+
+from .base import BaseConnection
+
+# Transports are registered by scheme and imported on first use. Neither socket,
+# pyserial nor urllib are imported before a connection of that scheme is requested,
+# which keeps the start of short-lived interpreters (cron health checks) fast.
+
+# entry point group for third-party transports, e.g. in their pyproject.toml:
+#   [project.entry-points."mrc_beamstab.transports"]
+#   usbtmc = "my_package.transport:USBTMCConnection"
+ENTRY_POINT_GROUP = 'mrc_beamstab.transports'
+
+# scheme -> 'module:attribute' or connection class
+_transports = {
+    'tcp': 'connections.tcp:TCPConnection',
+    'serial': 'connections.serial:SerialConnection',
+}
+
+def register_transport(scheme: str, transport):
+    """Registers a transport for a URL scheme.
+
+    :param scheme: URL scheme, e.g. 'tcp'
+    :param transport: BaseConnection subclass with a from_url(path, options) classmethod,
+                      or its import path as 'module:attribute' to import it lazily
+    """
+    if not isinstance(transport, str) and not (isinstance(transport, type) and issubclass(transport, BaseConnection)):
+        raise ValueError(f'Transport for "{scheme}" must be a BaseConnection subclass or a "module:attribute" path')
+    _transports[scheme.lower()] = transport
+
+def available_transports() -> list:
+    """Registered URL schemes, without loading the transports or entry points."""
+    return sorted(_transports)
+
+def get_transport(scheme: str):
+    """Returns the transport class of a URL scheme, importing it on first use.
+
+    :param scheme: URL scheme, e.g. 'tcp'
+    """
+    scheme = scheme.lower()
+    if scheme not in _transports:
+        _load_entry_point(scheme)
+    transport = _transports[scheme]
+    if isinstance(transport, str):
+        from importlib import import_module
+        module, _, attribute = transport.partition(':')
+        transport = getattr(import_module(module), attribute)
+        if not (isinstance(transport, type) and issubclass(transport, BaseConnection)):
+            raise ValueError(f'Transport "{scheme}" ({_transports[scheme]}) is not a BaseConnection subclass')
+        _transports[scheme] = transport
+    return transport
+
+def _load_entry_point(scheme: str):
+    # importlib.metadata is slow to import, only needed for unknown schemes
+    from importlib.metadata import entry_points
+    try:
+        group = entry_points(group=ENTRY_POINT_GROUP)
+    except TypeError:
+        # Python < 3.10: entry_points() takes no arguments and returns a dict of groups
+        group = entry_points().get(ENTRY_POINT_GROUP, [])
+    for entry_point in group:
+        if entry_point.name.lower() == scheme:
+            _transports[scheme] = entry_point.value
+            return
+    raise ValueError(f'No transport registered for scheme "{scheme}", available: {available_transports()}')
+
+def parse_url(url: str) -> tuple:
+    """Splits a connection URL into scheme, path and options.
+
+    'tcp://192.168.1.106:2000'              -> ('tcp', '192.168.1.106:2000', {})
+    'serial:///dev/ttyUSB0?baud=921600'     -> ('serial', '/dev/ttyUSB0', {'baud': '921600'})
+    'serial://COM5'                         -> ('serial', 'COM5', {})
+
+    :param url: connection URL
+
+    return: tuple of scheme, path and dict of query options (str values)
+    """
+    scheme, separator, rest = url.partition('://')
+    if not separator or not scheme:
+        raise ValueError(f'Connection URL must look like scheme://address, got {url}')
+    path, _, query = rest.partition('?')
+    options = {}
+    for item in query.split('&'):
+        if item:
+            key, _, value = item.partition('=')
+            options[key] = value
+    return scheme.lower(), path, options
+
+def connection_from_url(url: str, **options):
+    """Creates an unopened connection from a URL, e.g. for a with block.
+
+    :param url: connection URL, e.g. 'tcp://192.168.1.106:2000' or 'serial:///dev/ttyUSB0?baud=921600'
+    :param options: options overriding the query options of the URL
+    """
+    scheme, path, query = parse_url(url)
+    query.update(options)
+    return get_transport(scheme).from_url(path, query)
+
+def open_connection(url: str, **options):
+    """Creates and opens a connection from a URL, see connection_from_url().
+
+    :param url: connection URL, e.g. 'tcp://192.168.1.106:2000' or 'serial:///dev/ttyUSB0?baud=921600'
+    :param options: options overriding the query options of the URL
+    """
+    connection = connection_from_url(url, **options)
+    connection.open()
+    return connection
+
+def to_bool(value) -> bool:
+    """Interprets URL option values like 1, true, yes and on."""
+    if isinstance(value, str):
+        return value.lower() in ('1', 'true', 'yes', 'on')
+    return bool(value)
@@ -1,8 +1,11 @@
 import serial
+import time
 from .base import BaseConnection
 
 class SerialConnection(BaseConnection):
-    def __init__(self, port: str, baudrate: int = 115200, timeout: float = 2.0, rtscts: bool = False):
+    def __init__(self, port: str, baudrate: int = 115200, timeout: float = 2.0, rtscts: bool = False,
+                 negotiate_baudrate: int = None, low_latency: bool = False, inter_byte_timeout: float = 0.005,
+                 negotiator=None):
         """Initializes the serial connection for the MRC beam stabilization system.
         
         Default baudrate is 115200 for USB-based systems. 
@@ -14,14 +17,79 @@ class SerialConnection(BaseConnection):
         :param rtscts: Enable hardware handshaking. While the manual specifies 
                        8-N-1-CTS-RTS, many USB-to-serial adapters require 
                        this to be False to function correctly.
+        :param negotiate_baudrate: Opt-in: highest baudrate to negotiate via SBR after 
+                                   opening the port (e.g. 921600). The verified rates 
+                                   are reported in self.baudrate_report.
+        :param negotiator: Callable negotiator(connection, target) returning the list of
+                           verified rates, required with negotiate_baudrate, e.g.
+                           protocol.negotiate_baudrate.
+        :param low_latency: Tuned read mode: drain in_waiting in bulk, end replies after 
+                            inter_byte_timeout and request the Linux low-latency flag 
+                            of the port (ASYNC_LOW_LATENCY) where available.
+        :param inter_byte_timeout: Max. gap between two bytes of a reply in seconds, only
+                                   used with low_latency.
         """
+        if negotiate_baudrate and negotiator is None:
+            raise ValueError('negotiate_baudrate needs a negotiator, e.g. protocol.negotiate_baudrate')
         self.port = port
         self.baudrate = baudrate
         self.timeout = timeout
         self.rtscts = rtscts
+        self.negotiate_baudrate = negotiate_baudrate
+        self.negotiator = negotiator
+        self.baudrate_report = []
+        self.low_latency = low_latency
+        self.inter_byte_timeout = inter_byte_timeout
+        self.low_latency_active = False
         self.connection = None
 
+    @classmethod
+    def from_url(cls, path: str, options: dict):
+        """Creates the connection from a URL, e.g. 'serial:///dev/ttyUSB0?baud=921600' or 'serial://COM5'.
+
+        :param path: The COM port.
+        :param options: query options of the URL (baud, timeout, rtscts, negotiate,
+                        low_latency, inter_byte_timeout) and the negotiator callable.
+        """
+        from .registry import to_bool
+        converters = {
+            'baud': ('baudrate', int),
+            'baudrate': ('baudrate', int),
+            'timeout': ('timeout', float),
+            'rtscts': ('rtscts', to_bool),
+            'negotiate': ('negotiate_baudrate', int),
+            'low_latency': ('low_latency', to_bool),
+            'inter_byte_timeout': ('inter_byte_timeout', float),
+            'negotiator': ('negotiator', lambda negotiator: negotiator),
+        }
+        unknown = set(options) - set(converters)
+        if unknown:
+            raise ValueError(f'Unknown serial option(s) {sorted(unknown)}')
+        if not path:
+            raise ValueError('serial URL needs a port, e.g. serial:///dev/ttyUSB0 or serial://COM5')
+        kwargs = {}
+        for key, value in options.items():
+            name, convert = converters[key]
+            kwargs[name] = convert(value)
+        return cls(path, **kwargs)
+
+    @property
+    def is_open(self) -> bool:
+        """True while the serial port is open."""
+        return bool(self.connection and self.connection.is_open)
+
     def open(self):
+        """Opens the serial port and optionally negotiates a higher baudrate."""
+        self._open_port()
+        if self.negotiate_baudrate:
+            try:
+                self.baudrate_report = self.negotiator(self, self.negotiate_baudrate)
+            except Exception:
+                # do not leave the port open (and locked) after a failed negotiation
+                self.close()
+                raise
+
+    def _open_port(self):
         """Opens the serial port with 8 data bits, no parity, and one stop bit (8-N-1)."""
         self.connection = serial.Serial(
             port=self.port,
@@ -29,9 +97,18 @@ class SerialConnection(BaseConnection):
             bytesize=serial.EIGHTBITS,
             parity=serial.PARITY_NONE,
             stopbits=serial.STOPBITS_ONE,
-            timeout=self.timeout,
+            # in low_latency mode the port timeout bounds the gap between bytes, 
+            # self.timeout is applied by read() instead
+            timeout=self.inter_byte_timeout if self.low_latency else self.timeout,
             rtscts=self.rtscts
         )
+        if self.low_latency:
+            # only supported by Linux serial drivers, pseudo terminals and Windows ignore it
+            try:
+                self.connection.set_low_latency_mode(True)
+                self.low_latency_active = True
+            except (AttributeError, NotImplementedError, ValueError, OSError):
+                self.low_latency_active = False
 
     def close(self):
         """Closes the serial connection if it is open."""
@@ -39,13 +116,60 @@ class SerialConnection(BaseConnection):
             self.connection.close()
             self.connection = None
 
+    def reopen(self, baudrate: int):
+        """Reopens the serial port at another baudrate.
+
+        :param baudrate: New transmission speed (115200, 460800, or 921600).
+        """
+        self.close()
+        self.baudrate = baudrate
+        self._open_port()
+        self.reset_input_buffer()
+
+    def reset_input_buffer(self):
+        """Discards all bytes in the input buffer."""
+        if self.connection:
+            self.connection.reset_input_buffer()
+
+    def set_timeout(self, timeout: float):
+        """Changes the read timeout, also of an open connection.
+
+        :param timeout: Read timeout in seconds.
+        """
+        self.timeout = timeout
+        # in low_latency mode the port timeout stays at inter_byte_timeout
+        if self.connection and not self.low_latency:
+            self.connection.timeout = timeout
+
     def write(self, data: bytes):
         """Sends uppercase ASCII command names and binary-coded parameters[cite: 9, 11]."""
         if self.connection:
             self.connection.write(data)
 
     def read(self, size: int) -> bytes:
-        """Reads binary-coded return values[cite: 12]."""
-        if self.connection:
+        """Reads binary-coded return values[cite: 12].
+
+        In low_latency mode bytes already waiting are drained in bulk without blocking.
+        The read waits up to timeout for the first byte and returns once no further 
+        byte arrived within inter_byte_timeout, i.e. at the end of a reply.
+        """
+        if not self.connection:
+            return b""
+        if not self.low_latency:
             return self.connection.read(size)
-        return b""
\ No newline at end of file
+
+        data = bytearray()
+        deadline = time.perf_counter() + self.timeout
+        while len(data) < size:
+            waiting = self.connection.in_waiting
+            if waiting:
+                data.extend(self.connection.read(min(size - len(data), waiting)))
+                continue
+            if not data and time.perf_counter() >= deadline:
+                break
+            # blocks at most inter_byte_timeout
+            chunk = self.connection.read(size - len(data))
+            if not chunk and data:
+                break
+            data.extend(chunk)
+        return bytes(data)
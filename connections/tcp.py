@@ -17,6 +17,26 @@ class TCPConnection(BaseConnection):
         self.timeout = timeout
         self.sock = None
 
+    @classmethod
+    def from_url(cls, path: str, options: dict):
+        """Creates the connection from a URL, e.g. 'tcp://192.168.1.106:2000?timeout=1.5'.
+
+        :param path: host[:port] part of the URL.
+        :param options: query options of the URL (timeout).
+        """
+        unknown = set(options) - {'timeout'}
+        if unknown:
+            raise ValueError(f'Unknown tcp option(s) {sorted(unknown)}')
+        host, _, port = path.rstrip('/').partition(':')
+        if not host:
+            raise ValueError('tcp URL needs a host, e.g. tcp://192.168.1.106:2000')
+        kwargs = {}
+        if port:
+            kwargs['port'] = int(port)
+        if 'timeout' in options:
+            kwargs['timeout'] = float(options['timeout'])
+        return cls(host, **kwargs)
+
     def open(self):
         """Opens the TCP/IP connection."""
         
@@ -37,8 +57,24 @@ class TCPConnection(BaseConnection):
         if self.sock:
             self.sock.sendall(data)
 
+    def set_timeout(self, timeout: float):
+        """Changes the read timeout, also of an open connection.
+
+        :param timeout: Read timeout in seconds.
+        """
+        self.timeout = timeout
+        if self.sock:
+            self.sock.settimeout(timeout)
+
     def read(self, size: int) -> bytes:
-        """Reads binary-coded return values[cite: 12]."""
+        """Reads binary-coded return values[cite: 12].
+
+        Raises TimeoutError if no byte arrived within the timeout.
+        """
         if self.sock:
-            return self.sock.recv(size)
+            try:
+                return self.sock.recv(size)
+            except socket.timeout as exc:
+                # socket.timeout is an alias of TimeoutError only since Python 3.10
+                raise TimeoutError(str(exc)) from exc
         return b""
\ No newline at end of file
@@ -0,0 +1,3 @@
+# mrc_beamstab/__init__.py
+# command line tools and analysis on top of the connections and protocol packages,
+# submodules are imported on use to keep the start of the command line tool fast
@@ -0,0 +1,5 @@
+# mrc_beamstab/__main__.py
+import sys
+from .cli import main
+
+sys.exit(main())
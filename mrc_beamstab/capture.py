@@ -0,0 +1,312 @@
+# mrc_beamstab/capture.py
+
+from protocol import COMMAND_RESPONSE_MAP, RETURN_VALUE_STRUCT_MAP
+from protocol.defs import COMMAND_PARAMETER_STRUCT_MAP
+from array import array
+import numpy as np
+import struct
+import threading
+import time
+
+# struct format characters of the stream message fields -> numpy (big-endian on the wire)
+NUMPY_TYPE_MAP = {
+    'B': 'u1',
+    'b': 'i1',
+    'H': '>u2',
+    'h': '>i2',
+}
+
+# raw 25 byte SLSmr/S1S message
+MESSAGE_FIELDS = COMMAND_RESPONSE_MAP['SLSmr']
+MESSAGE_DTYPE = np.dtype([(field, NUMPY_TYPE_MAP[RETURN_VALUE_STRUCT_MAP[field]]) for field in MESSAGE_FIELDS])
+
+# measurement fields of a message, without acknowledgement and semicolons
+DATA_FIELDS = [field for field in MESSAGE_FIELDS if field not in ('fe', 'semi_fe', 'semi_end')]
+
+# captured message with its host arrival time, native byte order for analysis
+RECORD_DTYPE = np.dtype(
+    [('arrival', 'f8')] +
+    [(field, MESSAGE_DTYPE[field].newbyteorder('=')) for field in DATA_FIELDS]
+)
+
+def messages_to_records(arrivals, messages) -> np.ndarray:
+    """Convert raw stream messages into a structured record array.
+
+    :param arrivals: host arrival times of the messages
+    :param messages: raw 25 byte stream messages
+
+    return: numpy array of RECORD_DTYPE
+    """
+    raw = np.frombuffer(b''.join(messages), dtype=MESSAGE_DTYPE)
+    records = np.empty(len(raw), dtype=RECORD_DTYPE)
+    records['arrival'] = arrivals
+    for field in DATA_FIELDS:
+        records[field] = raw[field]
+    return records
+
+class NpyWriter:
+    '''
+    appends records to a .npy file with bounded memory
+
+    The header is written with a fixed size and rewritten with the final
+    number of records on close(), so the file can be loaded with numpy.load().
+    '''
+
+    def __init__(self, path: str, dtype: np.dtype = RECORD_DTYPE):
+        """Creates the file.
+
+        :param path: path of the .npy file
+        :param dtype: structured dtype of the records
+        """
+        self.dtype = np.dtype(dtype)
+        self.count = 0
+        # reserve room for the largest count, npy headers are padded to 64 byte
+        self.header_size = 0
+        self.header_size = -(-len(self._header(2 ** 63 - 1)) // 64) * 64
+        self.file = open(path, 'wb')
+        self.file.write(self._header(0))
+
+    def _header(self, count: int) -> bytes:
+        header = repr({
+            'descr': np.lib.format.dtype_to_descr(self.dtype),
+            'fortran_order': False,
+            'shape': (count,),
+        })
+        # npy format 1.0: magic, version, little-endian header length, padded header
+        header = header.ljust(max(self.header_size - 10 - 1, 0)) + '\n'
+        return b'\x93NUMPY\x01\x00' + struct.pack('<H', len(header)) + header.encode('latin1')
+
+    def write(self, records: np.ndarray):
+        """Append records of the writer dtype."""
+        self.file.write(np.ascontiguousarray(records, dtype=self.dtype).tobytes())
+        self.count += len(records)
+
+    def close(self):
+        """Rewrite the header with the number of records and close the file."""
+        if self.file.closed:
+            return
+        self.file.seek(0)
+        self.file.write(self._header(self.count))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+def cross_correlation(a: np.ndarray, b: np.ndarray, max_lag: int) -> tuple:
+    """Normalised cross-correlation of two aligned channels, NaN samples are ignored.
+
+    :param a: samples of the first device
+    :param b: samples of the second device on the same time grid
+    :param max_lag: max. lag in samples
+
+    return: tuple of (lags, correlation), b lags a by the lag with the maximum correlation
+    """
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    a = np.where(np.isnan(a), 0.0, a - np.nanmean(a))
+    b = np.where(np.isnan(b), 0.0, b - np.nanmean(b))
+    norm = np.sqrt((a ** 2).sum() * (b ** 2).sum())
+    lags = np.arange(-max_lag, max_lag + 1)
+    n = len(a)
+    correlation = np.array([
+        (a[max(0, -lag):n - max(0, lag)] * b[max(0, lag):n - max(0, -lag)]).sum() for lag in lags
+    ])
+    return lags, correlation / norm if norm else correlation
+
+class MultiCapture:
+    '''
+    synchronised live stream capture of several controllers
+
+    SLS is pre-encoded for every device. One reader thread per connection waits
+    on an event while a single thread writes the start commands back-to-back,
+    so they leave within a few microseconds of each other without a woken
+    reader competing for the GIL, the readers are released afterwards. Every
+    message is timestamped on arrival with time.perf_counter(), the monotonic
+    clock shared by all threads. The device clock of every stream is
+    reconstructed (protocol.timing), its sample 0 on the host clock gives the
+    start skew of the device. merge() maps all streams onto a common time grid
+    for cross-correlation across devices.
+    '''
+
+    def __init__(self, decoders: list, rate: int = 500, names: list = None, quiet: float = 0.01):
+        """Prepares the capture.
+
+        :param decoders: ProtocolDecoder of every device, each on its own connection
+        :param rate: sampling rate r of all streams (1 - 500 samples/s)
+        :param names: device names, e.g. the device ids, default device0, device1, ...
+        :param quiet: time without received bytes that ends the flush after CLS in seconds
+        """
+        if not (1 <= rate <= 500):
+            raise ValueError(f'rate must be between 1 and 500 samples/s, got {rate}')
+        self.decoders = list(decoders)
+        self.rate = rate
+        self.names = list(names) if names is not None else [f'device{i}' for i in range(len(self.decoders))]
+        self.quiet = quiet
+        param_fmt = '>' + COMMAND_PARAMETER_STRUCT_MAP['m'] + COMMAND_PARAMETER_STRUCT_MAP['r']
+        self._start_chunk = b'SLS' + struct.pack(param_fmt, 0, rate) + b';'
+        self.length = MESSAGE_DTYPE.itemsize
+        for name, decoder in zip(self.names, self.decoders):
+            # the records are stored in the layout of the schema
+            if decoder.reply_length('SLSmr') != self.length:
+                raise ValueError(f'Stream messages of {name} have {decoder.reply_length("SLSmr")} byte, '
+                                 f'the capture needs the {self.length} byte layout of the schema')
+        self.sent = [None] * len(self.decoders)
+        self.arrivals = [array('d') for _ in self.decoders]
+        self.messages = [bytearray() for _ in self.decoders]
+        self._stop = threading.Event()
+        self._started = threading.Event()
+        self._errors = [None] * len(self.decoders)
+
+    def _capture(self, i: int):
+        decoder = self.decoders[i]
+        arrivals, messages = self.arrivals[i], self.messages[i]
+        try:
+            # a reader waking on the first reply would take the GIL from the sending thread
+            self._started.wait()
+            # framing buffer of the reader, bytes after the last message are passed to the flush
+            buffer = bytearray()
+            while not self._stop.is_set():
+                chunk = decoder.read(self.length)
+                if not chunk:
+                    decoder.check_connection()
+                arrival = time.perf_counter()
+                buffer.extend(chunk)
+                for message in decoder.split_stream(buffer, self.length):
+                    arrivals.append(arrival)
+                    messages.extend(message)
+            decoder.connection.write(b'CLS;')
+            trailing, _ = decoder.flush_stream(self.length, self.quiet, buffer=buffer)
+            for arrival, message in trailing:
+                arrivals.append(arrival)
+                messages.extend(message)
+        except Exception as exc:
+            self._errors[i] = exc
+            self._stop.set()
+
+    def run(self, duration: float) -> 'MultiCapture':
+        """Capture all streams for duration seconds (or until stop() is called).
+
+        Raises the first error of a device after all streams were stopped.
+        """
+        threads = [
+            threading.Thread(target=self._capture, args=(i,), daemon=True)
+            for i in range(len(self.decoders))
+        ]
+        self._stop.clear()
+        self._started.clear()
+        for thread in threads:
+            thread.start()
+        # the readers are waiting, the pre-encoded starts leave back-to-back
+        writes = [decoder.connection.write for decoder in self.decoders]
+        try:
+            for i, write in enumerate(writes):
+                self.sent[i] = time.perf_counter()
+                write(self._start_chunk)
+        finally:
+            self._started.set()
+        self._stop.wait(duration)
+        self._stop.set()
+        for thread in threads:
+            thread.join()
+        for exc in self._errors:
+            if exc is not None:
+                raise exc
+        return self
+
+    def stop(self):
+        """Stop a capture running on another thread."""
+        self._stop.set()
+
+    # ========== alignment ========== #
+    def clocks(self) -> list:
+        """Reconstructed device clock of every stream.
+
+        return: list of dict per device
+            index      -- sample index of every message (lost messages leave holes)
+            offset_s   -- host time of sample 0
+            period_s   -- fitted sample period on the host clock
+            lost       -- number of lost messages
+        """
+        from protocol.timing import reconstruct_times
+        clocks = []
+        for arrivals in self.arrivals:
+            times = reconstruct_times(np.frombuffer(arrivals, dtype=np.float64), self.rate)
+            index, host_time = times['index'], times['host_time']
+            if len(index) > 1 and index[-1] > index[0]:
+                period = (host_time[-1] - host_time[0]) / (index[-1] - index[0])
+            else:
+                period = 1.0 / self.rate
+            clocks.append({
+                'index': index,
+                'offset_s': host_time[0] - index[0] * period if len(index) else np.nan,
+                'period_s': period,
+                'lost': int(index[-1] + 1 - len(index)) if len(index) else 0,
+            })
+        return clocks
+
+    def merge(self) -> dict:
+        """Time-aligned dataset of all devices.
+
+        The common grid runs at the nominal period from the latest sample 0 to the
+        earliest last sample of all devices. Every device contributes the sample
+        nearest to each grid time on its reconstructed clock, samples lost on the
+        way are NaN. Raises a ValueError if a device did not send any message.
+
+        return dict of numpy arrays
+            time          -- common grid in host seconds (time.perf_counter())
+            devices       -- device names
+            start_skew_s  -- host time of sample 0 relative to the earliest device
+            send_skew_s   -- send time of SLS relative to the earliest device
+            period_s      -- fitted sample period per device
+            lost          -- lost messages per device
+            <field>       -- float32 array of shape (devices, samples) per DATA_FIELDS entry
+        """
+        clocks = self.clocks()
+        for name, clock in zip(self.names, clocks):
+            if not len(clock['index']):
+                raise ValueError(f'No stream messages received from {name}, the devices cannot be aligned')
+        offsets = np.array([clock['offset_s'] for clock in clocks])
+        periods = np.array([clock['period_s'] for clock in clocks])
+        ends = np.array([clock['offset_s'] + clock['index'][-1] * clock['period_s'] for clock in clocks])
+        step = 1.0 / self.rate
+        start = offsets.max()
+        samples = max(0, int(np.floor((ends.min() - start) / step)) + 1)
+        grid = start + np.arange(samples) * step
+
+        data = {field: np.full((len(clocks), samples), np.nan, dtype=np.float32) for field in DATA_FIELDS}
+        for i, clock in enumerate(clocks):
+            raw = np.frombuffer(bytes(self.messages[i]), dtype=MESSAGE_DTYPE)
+            # position of every sample index in the received messages, -1 for lost ones
+            index = clock['index']
+            position = np.full(index[-1] + 1, -1)
+            position[index] = np.arange(len(index))
+            wanted = np.rint((grid - clock['offset_s']) / clock['period_s']).astype(np.int64)
+            wanted = np.clip(wanted, 0, len(position) - 1)
+            found = position[wanted]
+            valid = found >= 0
+            for field in DATA_FIELDS:
+                data[field][i, valid] = raw[field][found[valid]]
+
+        sent = np.array([np.nan if t is None else t for t in self.sent])
+        dataset = {
+            'time': grid,
+            'devices': np.array(self.names),
+            'start_skew_s': offsets - offsets.min(),
+            'send_skew_s': sent - np.nanmin(sent),
+            'period_s': periods,
+            'lost': np.array([clock['lost'] for clock in clocks]),
+        }
+        dataset.update(data)
+        return dataset
+
+    def save(self, path: str) -> dict:
+        """Write the merged dataset to a .npz file, see merge().
+
+        return: merged dataset
+        """
+        dataset = self.merge()
+        np.savez(path, **dataset)
+        return dataset
@@ -0,0 +1,430 @@
+# mrc_beamstab/cli.py
+
+from connections import connection_from_url
+from connections.registry import parse_url
+from protocol import ProtocolDecoder, COMMAND_RESPONSE_MAP, negotiate_baudrate
+import argparse
+import json
+import os
+import struct
+import sys
+import time
+
+# environment variable holding the default connection URL
+URL_ENV = 'MRC_BEAMSTAB_URL'
+
+# stream commands, handled by the stream subcommand
+STREAM_COMMANDS = {'SLS', 'SPS'}
+
+def connection_options(url: str, timeout: float = None) -> dict:
+    """Options for connection_from_url(), serial URLs negotiate (?negotiate=921600) via the protocol."""
+    options = {'timeout': timeout} if timeout is not None else {}
+    if parse_url(url)[0] == 'serial':
+        options['negotiator'] = negotiate_baudrate
+    return options
+
+def resolve_command(command: str) -> str:
+    """Map a command name onto its COMMAND_RESPONSE_MAP key, e.g. 'GPF' -> 'GPFs'."""
+    if command in COMMAND_RESPONSE_MAP and command != 'StatusFlag':
+        return command
+    name = command[:3].upper()
+    for key in COMMAND_RESPONSE_MAP:
+        if key[:3] == name and key != 'StatusFlag':
+            return key
+    raise ValueError(f'Unknown command {command}')
+
+def encode_params(decoder, key: str, params: list) -> bytes:
+    """Pack command line parameters of a command, e.g. ['2', 'x', '100'] for SAIsao."""
+    # SLAl (listed as SLAI): user defined label in [] brackets
+    if key[:3] == 'SLA':
+        label = ' '.join(params)
+        if not label.startswith('['):
+            label = f'[{label}]'
+        return label.encode('ascii')
+    fields = list(key[3:])
+    if len(params) != len(fields):
+        raise ValueError(f'{key} expects {len(fields)} parameter(s) {fields}, got {len(params)}')
+    values = [ord(value) if field == 'a' else int(value, 0) for field, value in zip(fields, params)]
+    fmt = decoder.get_formatter_str(fields, map=decoder.command_parameter_struct_map)
+    return struct.pack(fmt, *values)
+
+def to_json(value):
+    """Make decoded responses JSON serialisable."""
+    if isinstance(value, dict):
+        return {key: to_json(val) for key, val in value.items()}
+    if isinstance(value, (bytes, bytearray)):
+        return value.hex()
+    return value
+
+def read_error(decoder) -> dict:
+    """Read the last error with GER."""
+    decoder.send_command('GER')
+    raw_reply = decoder.read_once(decoder.reply_length('GER'))
+    if raw_reply[:2] != b'\x00;':
+        return None
+    decoder.reply_end(raw_reply)
+    decoded = decoder.decode_response(raw_reply, 'GER')
+    return dict(decoded['e'], CMD=decoded['CMD'])
+
+def query(decoder, command: str, params: list) -> dict:
+    """Send a command and return the decoded response.
+
+    return dict of
+        command   -- COMMAND_RESPONSE_MAP key
+        ok        -- False if the controller replied with an error
+        response  -- decoded response fields
+        error     -- decoded GER response if ok is False
+    """
+    key = resolve_command(command)
+    if key[:3] in STREAM_COMMANDS:
+        raise ValueError(f'{key[:3]} starts a stream, use the stream subcommand')
+    decoder.send_command(key[:3], encode_params(decoder, key, params))
+    raw_reply = decoder.read_once(decoder.reply_length(key))
+    if raw_reply[:2] == b'\x01;':
+        return {'command': key, 'ok': False, 'error': read_error(decoder)}
+    decoder.reply_end(raw_reply)
+    return {'command': key, 'ok': True, 'response': to_json(decoder.decode_response(raw_reply, key))}
+
+def emit(result: dict):
+    sys.stdout.write(json.dumps(result) + '\n')
+    sys.stdout.flush()
+
+# ========== subcommands ========== #
+def cmd_query(decoder, args) -> int:
+    result = query(decoder, args.command, args.params)
+    emit(result)
+    return 0 if result['ok'] else 1
+
+def cmd_stream(decoder, args) -> int:
+    fields, message_struct = decoder.reply_struct('SLSmr')
+    to_stdout = args.output == '-'
+    if args.format == 'npy' and to_stdout:
+        raise ValueError('npy output needs a file, use --format raw or jsonl for stdout')
+
+    if args.format == 'npy':
+        from .capture import NpyWriter, messages_to_records
+        sink = NpyWriter(args.output)
+        arrivals, messages = [], []
+
+        def write(arrival, message):
+            arrivals.append(arrival)
+            messages.append(message)
+            # bounded memory: convert and write in blocks
+            if len(messages) >= args.block:
+                flush()
+
+        def flush():
+            if messages:
+                sink.write(messages_to_records(arrivals, messages))
+                arrivals.clear()
+                messages.clear()
+    else:
+        sink = sys.stdout.buffer if to_stdout else open(args.output, 'wb')
+
+        if args.format == 'raw':
+            def write(arrival, message):
+                sink.write(message)
+        else:
+            def write(arrival, message):
+                values = dict(zip(fields, message_struct.unpack(message)))
+                record = {'arrival': arrival}
+                record.update((key, values[key]) for key in fields if key not in ('fe', 'semi_fe', 'semi_end'))
+                sink.write((json.dumps(record) + '\n').encode('ascii'))
+
+        def flush():
+            sink.flush()
+
+    count = 0
+    start = time.perf_counter()
+    stream = decoder.start_live_stream_raw(args.count, args.rate)
+    try:
+        for arrival, message in stream:
+            write(arrival, message)
+            count += 1
+            if args.duration is not None and arrival - start >= args.duration:
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stream.close()
+        flush()
+        if args.format == 'npy' or not to_stdout:
+            sink.close()
+    elapsed = time.perf_counter() - start
+    summary = {
+        'messages': count,
+        'duration_s': elapsed,
+        'messages_per_s': count / elapsed if elapsed > 0 else 0.0,
+        'dropped_bytes': decoder.dropped_bytes,
+    }
+    # keep stdout clean for the captured data
+    sys.stderr.write(json.dumps(summary) + '\n')
+    return 0
+
+def cmd_stats(decoder, args) -> int:
+    from protocol.timing import StreamClock
+    clock = StreamClock(args.rate)
+    start = time.perf_counter()
+    next_report = start + args.interval
+    window = []
+    previous = None
+    stream = decoder.start_live_stream_raw(0, args.rate)
+    try:
+        for arrival, _ in stream:
+            clock.add(arrival)
+            if previous is not None:
+                window.append(arrival - previous)
+            previous = arrival
+            if arrival < next_report:
+                continue
+            count = len(window)
+            mean = sum(window) / count if count else 0.0
+            jitter = (sum((x - mean) ** 2 for x in window) / count) ** 0.5 if count else 0.0
+            emit({
+                'time_s': arrival - start,
+                'messages_per_s': count / args.interval,
+                'interval_mean_s': mean,
+                'jitter_s': jitter,
+                'lost': clock.lost,
+                'dropped_bytes': decoder.dropped_bytes,
+                'drift_ppm': clock.drift * 1e6 if clock.drift is not None else None,
+            })
+            window.clear()
+            next_report += args.interval
+            if args.duration is not None and arrival - start >= args.duration:
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stream.close()
+    return 0
+
+def cmd_bench(decoder, args) -> int:
+    failures = 0
+    for _ in range(args.count):
+        try:
+            if not query(decoder, args.command, args.params)['ok']:
+                failures += 1
+        except (TimeoutError, ValueError, struct.error):
+            failures += 1
+    key = resolve_command(args.command)
+    stats = decoder.latency_stats().get(key[:3], {})
+    emit({'command': key, 'count': args.count, 'failures': failures, 'latency_s': stats})
+    return 0 if failures == 0 else 1
+
+def cmd_schema(decoder, args) -> int:
+    from protocol.schema import load_layout
+    start = time.perf_counter()
+    layout = load_layout(decoder, cache_path=args.cache, refresh=args.refresh)
+    emit({
+        'firmware': layout.firmware,
+        'device_id': layout.device_id,
+        'cached': layout.cached,
+        'confirmed': layout.confirmed,
+        'duration_s': time.perf_counter() - start,
+        'mismatches': layout.mismatches,
+    })
+    return 0 if layout.confirmed else 1
+
+def cmd_config(decoder, args) -> int:
+    from protocol.config import ControllerConfig, snapshot, restore
+    if args.action == 'save':
+        config = snapshot(decoder)
+        if args.file == '-':
+            emit(config.to_dict())
+        else:
+            config.save(args.file)
+        # keep stdout clean for the configuration
+        sys.stderr.write(json.dumps(config.timing) + '\n')
+        return 0
+    report = restore(decoder, ControllerConfig.load(args.file), dry_run=args.dry_run, check_device=not args.force)
+    emit(report)
+    return 0
+
+def cmd_step(decoder, args) -> int:
+    from .stepresponse import StepResponse
+    step = StepResponse(
+        decoder, mode=args.mode, step=(args.step_x, args.step_y), trials=args.trials, rate=args.rate,
+        stage=args.stage, pre=args.pre, post=args.post, poll=args.poll,
+    )
+    emit(step.run())
+    return 0
+
+def cmd_sync(decoder, args) -> int:
+    from contextlib import ExitStack
+    from .capture import MultiCapture
+    import numpy as np
+    with ExitStack() as stack:
+        decoders = [
+            ProtocolDecoder(stack.enter_context(connection_from_url(url, **connection_options(url, args.timeout))))
+            for url in args.urls
+        ]
+        dataset = MultiCapture(decoders, rate=args.rate, names=args.urls).run(args.duration).save(args.output)
+    emit({
+        'devices': args.urls,
+        'samples': len(dataset['time']),
+        'start_skew_s': dataset['start_skew_s'].tolist(),
+        'send_skew_s': dataset['send_skew_s'].tolist(),
+        'lost': dataset['lost'].tolist(),
+        'missing': np.isnan(dataset['DX1']).sum(axis=1).tolist(),
+    })
+    return 0
+
+def cmd_soak(decoder, args) -> int:
+    from .soak import SoakTest, compare_reports, load_report
+    mix = {}
+    for item in args.mix.split(','):
+        name, _, weight = item.partition('=')
+        mix[name] = float(weight or 1)
+    if mix.get('setters') and not (args.allow_writes or getattr(args, 'emulated', False)):
+        raise ValueError('the setters operation writes SPF/SAI to the controller, '
+                         'pass --allow-writes or remove setters from --mix')
+    budgets = {
+        'rss_growth_mb': args.max_rss_growth,
+        'rss_slope_mb_per_h': args.max_rss_slope,
+        'traced_growth_mb': args.max_traced_growth,
+        'p99_s': args.max_p99,
+        'p99_drift': args.max_p99_drift,
+    }
+    soak = SoakTest(
+        decoder, duration=args.duration, interval=args.interval, mix=mix, budgets=budgets,
+        stream_rate=args.rate, stream_seconds=args.stream_seconds, trace=not args.no_trace, label=args.label,
+    )
+    # samples as JSON lines on stderr, the report on stdout or in a file
+    report = soak.run(progress=lambda sample: sys.stderr.write(json.dumps(sample) + '\n'))
+    if args.compare:
+        report['comparison'] = compare_reports(load_report(args.compare), report)
+    if args.output == '-':
+        emit(report)
+    else:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=1)
+        emit({key: report[key] for key in ('label', 'summary', 'violations', 'passed')})
+    return 0 if report['passed'] else 1
+
+# ========== entry point ========== #
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog='mrc-beamstab',
+        description='Command line tool for MRC Systems active laser beam stabilization controllers.',
+    )
+    parser.add_argument('--url', default=os.environ.get(URL_ENV),
+                        help=f'connection URL, e.g. tcp://192.168.1.106:2000 or serial:///dev/ttyUSB0?baud=921600 (default ${URL_ENV})')
+    parser.add_argument('--timeout', type=float, help='read timeout in seconds')
+    subparsers = parser.add_subparsers(dest='subcommand', required=True)
+
+    query_parser = subparsers.add_parser('query', help='send a command and print the decoded response as JSON')
+    query_parser.add_argument('command', help='command, e.g. S1S, GPFs or SAIsao')
+    query_parser.add_argument('params', nargs='*', help='command parameters, e.g. 2 x 100 for SAIsao')
+    query_parser.set_defaults(func=cmd_query)
+
+    stream_parser = subparsers.add_parser('stream', help='capture a live stream (SLS)')
+    stream_parser.add_argument('--rate', type=int, default=500, help='samples/s (1 - 500)')
+    stream_parser.add_argument('--count', type=int, default=0, help='number of messages, 0 for endless')
+    stream_parser.add_argument('--duration', type=float, help='capture duration in seconds')
+    stream_parser.add_argument('--output', default='-', help='output file, - for stdout')
+    stream_parser.add_argument('--format', choices=('raw', 'npy', 'jsonl'), default='raw',
+                               help='raw 25 byte messages, npy records with arrival time or JSON lines')
+    stream_parser.add_argument('--block', type=int, default=1000, help='messages per npy write')
+    stream_parser.set_defaults(func=cmd_stream)
+
+    stats_parser = subparsers.add_parser('stats', help='print live stream statistics as JSON lines')
+    stats_parser.add_argument('--rate', type=int, default=500, help='samples/s (1 - 500)')
+    stats_parser.add_argument('--interval', type=float, default=1.0, help='report interval in seconds')
+    stats_parser.add_argument('--duration', type=float, help='run time in seconds')
+    stats_parser.set_defaults(func=cmd_stats)
+
+    bench_parser = subparsers.add_parser('bench', help='measure the round-trip latency of a command')
+    bench_parser.add_argument('command', nargs='?', default='S1S', help='command, default S1S')
+    bench_parser.add_argument('params', nargs='*', help='command parameters')
+    bench_parser.add_argument('--count', type=int, default=100, help='number of round trips')
+    bench_parser.set_defaults(func=cmd_bench)
+
+    schema_parser = subparsers.add_parser('schema', help='validate the reply layout of the firmware, cached per firmware')
+    schema_parser.add_argument('--refresh', action='store_true', help='probe even if the firmware is cached')
+    schema_parser.add_argument('--cache', help='layout cache file (default $MRC_BEAMSTAB_LAYOUT_CACHE or the user cache directory)')
+    schema_parser.set_defaults(func=cmd_schema)
+
+    config_parser = subparsers.add_parser('config', help='save the configuration or restore it with minimal writes')
+    config_parser.add_argument('action', choices=('save', 'restore'))
+    config_parser.add_argument('file', help='JSON configuration file, - for stdout (save only)')
+    config_parser.add_argument('--dry-run', action='store_true', help='print the restore commands without sending them')
+    config_parser.add_argument('--force', action='store_true', help='restore a configuration of another device')
+    config_parser.set_defaults(func=cmd_config)
+
+    step_parser = subparsers.add_parser('step', help='measure actuation delay and step response distributions')
+    step_parser.add_argument('--mode', choices=('offset', 'enable'), default='offset',
+                             help='offset steps (SAI) or enable/disable toggles (SEA/CEA)')
+    step_parser.add_argument('--step-x', type=int, default=500, help='offset step of the x-axis in mV')
+    step_parser.add_argument('--step-y', type=int, default=500, help='offset step of the y-axis in mV')
+    step_parser.add_argument('--trials', type=int, default=20, help='number of steps')
+    step_parser.add_argument('--rate', type=int, default=500, help='samples/s (1 - 500)')
+    step_parser.add_argument('--stage', type=int, default=2, help='stage number')
+    step_parser.add_argument('--pre', type=float, default=0.05, help='recorded time before a step in seconds')
+    step_parser.add_argument('--post', type=float, default=0.3, help='recorded time after a step in seconds')
+    step_parser.add_argument('--poll', action='store_true', help='read the position with S1S instead of SLS')
+    step_parser.set_defaults(func=cmd_step)
+
+    sync_parser = subparsers.add_parser('sync', help='synchronised live stream capture of several controllers')
+    sync_parser.add_argument('urls', nargs='+', help='connection URL of every controller')
+    sync_parser.add_argument('--rate', type=int, default=500, help='samples/s (1 - 500)')
+    sync_parser.add_argument('--duration', type=float, default=10.0, help='capture duration in seconds')
+    sync_parser.add_argument('--output', default='capture.npz', help='merged, time-aligned .npz dataset')
+    sync_parser.set_defaults(func=cmd_sync, multi=True)
+
+    soak_parser = subparsers.add_parser('soak', help='long-duration test of memory growth and latency drift, '
+                                                     'runs against the local emulator without --url')
+    soak_parser.add_argument('--duration', type=float, default=3600.0, help='run time in seconds')
+    soak_parser.add_argument('--interval', type=float, default=60.0, help='sample interval in seconds')
+    soak_parser.add_argument('--mix', default='S1S=50,GDA=20,setters=20,stream=10',
+                             help='relative weights of the operations S1S, GDA, setters and stream')
+    soak_parser.add_argument('--rate', type=int, default=500, help='samples/s of the live streams (1 - 500)')
+    soak_parser.add_argument('--stream-seconds', type=float, default=5.0, help='duration of a single live stream')
+    soak_parser.add_argument('--max-rss-growth', type=float, default=20.0, help='RSS growth budget in MB')
+    soak_parser.add_argument('--max-rss-slope', type=float, default=5.0, help='RSS growth rate budget in MB/h')
+    soak_parser.add_argument('--max-traced-growth', type=float, default=10.0, help='tracemalloc growth budget in MB')
+    soak_parser.add_argument('--max-p99', type=float, default=0.05, help='p99 latency budget in seconds')
+    soak_parser.add_argument('--max-p99-drift', type=float, default=2.0, help='p99 latency budget, last / first sample')
+    soak_parser.add_argument('--no-trace', action='store_true', help='do not run tracemalloc')
+    soak_parser.add_argument('--allow-writes', action='store_true',
+                             help='allow the setters operation with --url, the settings are restored afterwards')
+    soak_parser.add_argument('--label', help='label of the report, e.g. the version under test')
+    soak_parser.add_argument('--output', default='-', help='report file, - for stdout')
+    soak_parser.add_argument('--compare', help='report of a previous run to compare with')
+    soak_parser.set_defaults(func=cmd_soak)
+    return parser
+
+def run(func, decoder, args) -> int:
+    """Run a subcommand, errors are written as JSON to stderr."""
+    try:
+        return func(decoder, args)
+    except (ValueError, ConnectionError, TimeoutError, OSError) as exc:
+        sys.stderr.write(json.dumps({'error': type(exc).__name__, 'message': str(exc)}) + '\n')
+        return 2
+
+def main(argv=None) -> int:
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if getattr(args, 'multi', False):
+        # multi-device subcommands open their own connections
+        return run(args.func, None, args)
+    emulator = None
+    if not args.url:
+        if args.subcommand != 'soak':
+            parser.error(f'no connection URL, use --url or set ${URL_ENV}')
+        # soak tests run against the local stand-in controller by default, in its own
+        # process so the budgets only cover the allocations of the client
+        from protocol.emulator import serve_process
+        emulator, (host, port) = serve_process(ethernet=True)
+        args.url = f'tcp://{host}:{port}'
+        args.emulated = True
+
+    def connected(_, args):
+        with connection_from_url(args.url, **connection_options(args.url, args.timeout)) as connection:
+            return args.func(ProtocolDecoder(connection), args)
+    try:
+        return run(connected, None, args)
+    finally:
+        if emulator is not None:
+            emulator.terminate()
+            emulator.join()
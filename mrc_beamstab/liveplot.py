@@ -0,0 +1,202 @@
+# mrc_beamstab/liveplot.py
+
+from protocol import COMMAND_RESPONSE_MAP, RETURN_VALUE_STRUCT_MAP
+import numpy as np
+import struct
+import threading
+import time
+
+# plotted channels of a stream message
+CHANNELS = ['DX1', 'DY1', 'DI1', 'DX2', 'DY2', 'DI2']
+
+class RingBuffer:
+    '''
+    fixed-size ring of stream samples per channel
+
+    Memory is allocated once, old samples are overwritten no matter how long
+    the acquisition runs.
+    '''
+
+    def __init__(self, size: int, channels: list = CHANNELS):
+        """Allocates the ring.
+
+        :param size: number of samples kept per channel
+        :param channels: message fields to keep
+        """
+        self.size = size
+        self.channels = list(channels)
+        self.time = np.zeros(size)
+        self.data = np.zeros((len(self.channels), size))
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def append(self, arrival: float, values):
+        """Store one sample, values in the order of self.channels."""
+        with self._lock:
+            i = self.count % self.size
+            self.time[i] = arrival
+            self.data[:, i] = values
+            self.count += 1
+
+    def snapshot(self) -> tuple:
+        """Copy of the stored samples in chronological order.
+
+        return: tuple of (time, data) with data of shape (channels, samples)
+        """
+        with self._lock:
+            if self.count <= self.size:
+                return self.time[:self.count].copy(), self.data[:, :self.count].copy()
+            i = self.count % self.size
+            return (
+                np.concatenate((self.time[i:], self.time[:i])),
+                np.concatenate((self.data[:, i:], self.data[:, :i]), axis=1),
+            )
+
+def minmax_decimate(x: np.ndarray, y: np.ndarray, columns: int) -> tuple:
+    """Decimate samples to the min and max of every pixel column.
+
+    Keeps every peak visible while the number of drawn points only depends on
+    the plot width.
+
+    :param x: sample times, increasing
+    :param y: samples of shape (samples,) or (channels, samples)
+    :param columns: number of pixel columns
+
+    return: tuple of (x, y) with 2 points per column (min, max)
+    """
+    n = x.shape[-1]
+    if n <= 2 * columns:
+        return x, y
+    bucket = -(-n // columns)
+    used = (n // bucket) * bucket
+    # the oldest samples not filling a whole bucket are dropped
+    x = x[n - used:].reshape(-1, bucket)
+    y = y[..., n - used:].reshape(y.shape[:-1] + (-1, bucket))
+    x_out = np.repeat(x[:, [0, -1]].mean(axis=1), 2)
+    y_out = np.stack((y.min(axis=-1), y.max(axis=-1)), axis=-1).reshape(y.shape[:-2] + (-1,))
+    return x_out, y_out
+
+class LivePlot:
+    '''
+    decimated live view of the stream for Jupyter (%matplotlib widget) or Qt
+
+    The acquisition runs on a background thread and fills a RingBuffer of
+    span seconds. A canvas timer redraws at most fps times per second,
+    independent of the acquisition rate: the samples are min/max decimated to
+    the pixel width of the axes and drawn with blitting, so CPU and memory
+    stay bounded for arbitrarily long sessions.
+    '''
+
+    def __init__(self, decoder=None, rate: int = 500, span: float = 10.0, fps: float = 10.0,
+                 position_ylim: tuple = (-5000, 5000), intensity_ylim: tuple = (0, 8000)):
+        """Creates the figure.
+
+        :param decoder: ProtocolDecoder streaming the data, None to feed() messages yourself
+        :param rate: sampling rate r of the live stream (1 - 500 samples/s)
+        :param span: plotted time span in seconds
+        :param fps: max. redraws per second
+        :param position_ylim: y-limits of the DX/DY axes in mV
+        :param intensity_ylim: y-limits of the DI axes in mV
+        """
+        import matplotlib.pyplot as plt
+
+        self.decoder = decoder
+        self.rate = rate
+        self.span = span
+        self.fps = fps
+        self.ring = RingBuffer(int(span * rate) + 1)
+        fields = COMMAND_RESPONSE_MAP['SLSmr']
+        self._fmt = '>' + ''.join(RETURN_VALUE_STRUCT_MAP[field] for field in fields)
+        self._positions = [fields.index(channel) for channel in CHANNELS]
+        self._thread = None
+        self._stop = threading.Event()
+        self._timer = None
+        self._background = None
+        self.frames = 0
+
+        self.figure, axes = plt.subplots(2, 2, sharex=True, figsize=(10, 6))
+        self.lines = []
+        for row, detector in enumerate(('1', '2')):
+            position, intensity = axes[row]
+            position.set_title(f'Detector{detector} position')
+            position.set_ylim(*position_ylim)
+            position.set_ylabel('mV')
+            intensity.set_title(f'Detector{detector} intensity')
+            intensity.set_ylim(*intensity_ylim)
+            for axis, channel in ((position, 'DX'), (position, 'DY'), (intensity, 'DI')):
+                line, = axis.plot([], [], label=channel + detector, linewidth=0.8, animated=True)
+                self.lines.append(line)
+            position.legend(loc='upper left')
+        for axis in axes.flat:
+            axis.set_xlim(-span, 0)
+        for axis in axes[1]:
+            axis.set_xlabel('time [s]')
+        self.axes = [line.axes for line in self.lines]
+        self.figure.canvas.mpl_connect('draw_event', self._on_draw)
+
+    # ========== acquisition ========== #
+    def feed(self, arrival: float, message: bytes):
+        """Add a raw stream message, e.g. from a capture loop."""
+        values = struct.unpack(self._fmt, message)
+        self.ring.append(arrival, [values[i] for i in self._positions])
+
+    def _acquire(self):
+        stream = self.decoder.start_live_stream_raw(0, self.rate)
+        try:
+            for arrival, message in stream:
+                self.feed(arrival, message)
+                if self._stop.is_set():
+                    break
+        finally:
+            stream.close()
+
+    # ========== drawing ========== #
+    def _on_draw(self, event):
+        # background without the animated lines, captured after every full redraw
+        self._background = self.figure.canvas.copy_from_bbox(self.figure.bbox)
+        for line in self.lines:
+            line.axes.draw_artist(line)
+
+    def update(self):
+        """Redraw the lines with the decimated ring content."""
+        t, data = self.ring.snapshot()
+        if len(t):
+            x = t - time.perf_counter()
+            visible = x >= -self.span
+            x, data = x[visible], data[:, visible]
+            # one decimation for all channels, the axes share the pixel width
+            columns = max(1, int(self.axes[0].get_window_extent().width))
+            x, data = minmax_decimate(x, data, columns)
+            for line, y in zip(self.lines, data):
+                line.set_data(x, y)
+
+        canvas = self.figure.canvas
+        if self._background is None or not getattr(canvas, 'supports_blit', True):
+            canvas.draw_idle()
+        else:
+            canvas.restore_region(self._background)
+            for line in self.lines:
+                line.axes.draw_artist(line)
+            canvas.blit(self.figure.bbox)
+        canvas.flush_events()
+        self.frames += 1
+
+    def start(self):
+        """Start the acquisition thread and the redraw timer, returns immediately."""
+        if self.decoder is not None and self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._acquire, daemon=True)
+            self._thread.start()
+        self._timer = self.figure.canvas.new_timer(interval=int(1000 / self.fps))
+        self._timer.add_callback(self.update)
+        self._timer.start()
+
+    def stop(self):
+        """Stop the redraw timer and the acquisition, the stream is cleared."""
+        if self._timer is not None:
+            self._timer.stop()
+            self._timer = None
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
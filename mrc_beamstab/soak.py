@@ -0,0 +1,334 @@
+# mrc_beamstab/soak.py
+
+import json
+import os
+import random
+import struct
+import time
+import tracemalloc
+from protocol.config import restore, snapshot
+
+# default operation mix, relative weights
+DEFAULT_MIX = {
+    'S1S': 50,
+    'GDA': 20,
+    'setters': 20,
+    'stream': 10,
+}
+
+# default budgets, None disables a check
+DEFAULT_BUDGETS = {
+    'rss_growth_mb': 20.0,          # RSS growth from the first to the last sample
+    'rss_slope_mb_per_h': 5.0,      # fitted RSS growth rate
+    'traced_growth_mb': 10.0,       # growth of the memory traced by tracemalloc
+    'p99_s': 0.05,                  # p99 latency of every operation in every sample
+    'p99_drift': 2.0,               # p99 latency of the last / first third of the samples
+}
+
+# minimum sampled time span of the RSS slope, shorter runs only check the growth
+SLOPE_MIN_SPAN = 600.0
+
+def rss_mb() -> float:
+    """Resident set size of this process in MB, peak RSS where /proc is not available."""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        import sys
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on Linux, bytes on macOS
+        return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+    except ImportError:
+        return None
+
+def percentiles(values: list) -> dict:
+    """count, p50, p90, p99 and max of a list of latencies."""
+    ordered = sorted(values)
+    if not ordered:
+        return {'count': 0, 'p50': None, 'p90': None, 'p99': None, 'max': None}
+    pick = lambda q: ordered[int(q * (len(ordered) - 1))]
+    return {'count': len(ordered), 'p50': pick(0.50), 'p90': pick(0.90), 'p99': pick(0.99), 'max': ordered[-1]}
+
+def slope(x: list, y: list) -> float:
+    """Least squares slope of y over x."""
+    n = len(x)
+    if n < 2:
+        return 0.0
+    mean_x = sum(x) / n
+    mean_y = sum(y) / n
+    var = sum((xi - mean_x) ** 2 for xi in x)
+    if var == 0:
+        return 0.0
+    return sum((xi - mean_x) * (yi - mean_y) for xi, yi in zip(x, y)) / var
+
+class SoakTest:
+    '''
+    long-duration soak test of a controller connection
+
+    Runs a weighted random mix of S1S, GDA, setters (SPF, SAI) and live streams
+    (SLS, closed after stream_seconds, timed to the first message) for duration
+    seconds. Every interval the RSS, the memory traced by tracemalloc and
+    latency percentiles per operation are sampled, together with the top
+    allocators grown during the interval. The report also lists the top
+    allocators grown since the first sample and fails if a budget is exceeded.
+    Settings changed by the setters are restored after the run. Reports have
+    stable keys to compare versions with compare_reports().
+    '''
+
+    def __init__(self, decoder, duration: float = 3600.0, interval: float = 60.0, mix: dict = None,
+                 budgets: dict = None, stream_rate: int = 500, stream_seconds: float = 5.0,
+                 trace: bool = True, top: int = 10, seed: int = 0, label: str = None,
+                 restore_config: bool = True):
+        """Configures the soak test.
+
+        :param decoder: ProtocolDecoder of the controller or stand-in
+        :param duration: run time in seconds
+        :param interval: sample interval in seconds
+        :param mix: relative weights of the operations S1S, GDA, setters and stream
+        :param budgets: budgets overriding DEFAULT_BUDGETS, None values disable a check
+        :param stream_rate: sampling rate r of the live streams
+        :param stream_seconds: duration of a single live stream in seconds
+        :param trace: sample tracemalloc (slows down allocations)
+        :param top: number of top allocators per sample and in the report
+        :param seed: seed of the operation sequence
+        :param label: label of the report, e.g. the version under test
+        :param restore_config: snapshot the controller settings before a run with setters
+                               and restore them afterwards
+        """
+        self.decoder = decoder
+        self.duration = duration
+        self.interval = interval
+        self.mix = dict(mix if mix is not None else DEFAULT_MIX)
+        unknown = set(self.mix) - set(DEFAULT_MIX)
+        if unknown:
+            raise ValueError(f'Unknown operation(s) {sorted(unknown)}, available: {sorted(DEFAULT_MIX)}')
+        self.budgets = dict(DEFAULT_BUDGETS)
+        self.budgets.update(budgets or {})
+        self.stream_rate = stream_rate
+        self.stream_seconds = stream_seconds
+        self.trace = trace
+        self.top = top
+        self.random = random.Random(seed)
+        self.label = label
+        self.restore_config = restore_config
+
+        self.operations = {
+            'S1S': self._one_shot,
+            'GDA': self._drive_actuator,
+            'setters': self._setters,
+            'stream': self._stream,
+        }
+        self.samples = []
+        self._latencies = {}
+        self._errors = 0
+        self._messages = 0
+        # tracemalloc snapshots of the first and the previous sample
+        self._base = None
+        self._snapshot = None
+        # commands that restored the settings after the run
+        self._restored = None
+
+    # ========== operations ========== #
+    def _one_shot(self):
+        if self.decoder.start_one_shot() is None:
+            raise ValueError('S1S not acknowledged')
+
+    def _drive_actuator(self):
+        if self.decoder.get_drive_actuator() is None:
+            raise ValueError('GDA not acknowledged')
+
+    def _setters(self):
+        stage = self.random.choice((1, 2))
+        self.decoder.set_p_factor(stage, self.random.randint(0, 5000))
+        self.decoder.set_reference_position(self.random.randint(-500, 500), self.random.randint(-500, 500), stage=stage)
+
+    def _stream(self) -> float:
+        # latency of a stream is the time to its first message
+        start = time.perf_counter()
+        end = start + self.stream_seconds
+        first = None
+        stream = self.decoder.start_live_stream_raw(0, self.stream_rate)
+        try:
+            for arrival, _ in stream:
+                self._messages += 1
+                if first is None:
+                    first = arrival - start
+                if arrival >= end:
+                    break
+        finally:
+            stream.close()
+        return first
+
+    # ========== sampling ========== #
+    def _sample(self, elapsed: float):
+        sample = {
+            't_s': elapsed,
+            'rss_mb': rss_mb(),
+            'traced_mb': tracemalloc.get_traced_memory()[0] / 2 ** 20 if self.trace else None,
+            'errors': self._errors,
+            'messages': self._messages,
+            'dropped_bytes': self.decoder.dropped_bytes,
+            'ops': {name: percentiles(values) for name, values in sorted(self._latencies.items())},
+        }
+        self._latencies = {}
+        if self.trace:
+            # allocators grown since the previous sample
+            snapshot = tracemalloc.take_snapshot()
+            sample['top_allocators'] = self._top_allocators(snapshot, self._snapshot) if self._snapshot else []
+            self._snapshot = snapshot
+            if self._base is None:
+                self._base = snapshot
+        self.samples.append(sample)
+        return sample
+
+    def _top_allocators(self, snapshot, base) -> list:
+        stats = snapshot.compare_to(base, 'lineno')
+        return [
+            {
+                'location': f'{stat.traceback[0].filename}:{stat.traceback[0].lineno}',
+                'size_kb': stat.size / 1024,
+                'size_diff_kb': stat.size_diff / 1024,
+                'count_diff': stat.count_diff,
+            }
+            for stat in stats[:self.top]
+        ]
+
+    def run(self, progress=None) -> dict:
+        """Run the soak test.
+
+        :param progress: callable receiving every sample, e.g. to print it
+
+        return: report dict, see summary()
+        """
+        # the setters change SPF/SAI of the controller
+        original = snapshot(self.decoder) if self.restore_config and self.mix.get('setters') else None
+        # a trace started by the caller keeps running after the test
+        started = self.trace and not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        names = list(self.mix)
+        weights = [self.mix[name] for name in names]
+        start = time.perf_counter()
+        next_sample = start + self.interval
+        self._base = self._snapshot = None
+        try:
+            self._sample(0.0)
+            while True:
+                now = time.perf_counter()
+                if now >= next_sample:
+                    sample = self._sample(now - start)
+                    if progress is not None:
+                        progress(sample)
+                    next_sample += self.interval
+                if now - start >= self.duration:
+                    break
+                name = self.random.choices(names, weights)[0]
+                t0 = time.perf_counter()
+                try:
+                    latency = self.operations[name]()
+                except (TimeoutError, ValueError, struct.error):
+                    # a closed connection (ConnectionError) ends the test
+                    self._errors += 1
+                    continue
+                if latency is None:
+                    latency = time.perf_counter() - t0
+                self._latencies.setdefault(name, []).append(latency)
+            allocators = self._top_allocators(tracemalloc.take_snapshot(), self._base) if self.trace else []
+        finally:
+            if started:
+                tracemalloc.stop()
+            if original is not None:
+                self._restored = restore(self.decoder, original)['commands']
+        return self.summary(allocators)
+
+    # ========== report ========== #
+    def summary(self, allocators: list = None) -> dict:
+        """Report of the samples with budget checks."""
+        # the first sample is the baseline before any operation
+        samples = self.samples[1:] or self.samples
+        t = [sample['t_s'] for sample in samples]
+        rss = [sample['rss_mb'] for sample in samples if sample['rss_mb'] is not None]
+        traced = [sample['traced_mb'] for sample in samples if sample['traced_mb'] is not None]
+
+        latency = {}
+        for name in self.mix:
+            p99 = [sample['ops'][name]['p99'] for sample in samples if name in sample['ops']]
+            if p99:
+                # medians of the first and last third damp single slow samples
+                third = max(1, len(p99) // 3)
+                first = sorted(p99[:third])[third // 2]
+                last = sorted(p99[-third:])[third // 2]
+                latency[name] = {
+                    'p99_first': first,
+                    'p99_last': last,
+                    'p99_max': max(p99),
+                    'p99_drift': last / first if first else None,
+                }
+        span = t[len(rss) - 1] - t[0] if len(rss) > 1 else 0.0
+        summary = {
+            'rss_growth_mb': rss[-1] - rss[0] if len(rss) > 1 else 0.0,
+            'rss_slope_mb_per_h': slope(t[:len(rss)], rss) * 3600 if span >= SLOPE_MIN_SPAN else None,
+            'traced_growth_mb': traced[-1] - traced[0] if len(traced) > 1 else 0.0,
+            'latency': latency,
+            'operations': sum(op['count'] for sample in self.samples for op in sample['ops'].values()),
+            'errors': self._errors,
+            'messages': self._messages,
+            'restored_commands': len(self._restored) if self._restored is not None else None,
+        }
+
+        violations = []
+        for key in ('rss_growth_mb', 'rss_slope_mb_per_h', 'traced_growth_mb'):
+            budget = self.budgets.get(key)
+            if budget is not None and summary[key] is not None and summary[key] > budget:
+                violations.append(f'{key} {summary[key]:.3f} > {budget}')
+        for name, values in latency.items():
+            budget = self.budgets.get('p99_s')
+            if budget is not None and values['p99_max'] > budget:
+                violations.append(f'{name} p99_max {values["p99_max"]:.6f} s > {budget} s')
+            budget = self.budgets.get('p99_drift')
+            if budget is not None and values['p99_drift'] is not None and values['p99_drift'] > budget:
+                violations.append(f'{name} p99_drift {values["p99_drift"]:.3f} > {budget}')
+
+        return {
+            'label': self.label,
+            'config': {
+                'duration_s': self.duration,
+                'interval_s': self.interval,
+                'mix': self.mix,
+                'stream_rate': self.stream_rate,
+                'stream_seconds': self.stream_seconds,
+                'trace': self.trace,
+            },
+            'budgets': self.budgets,
+            'summary': summary,
+            'violations': violations,
+            'passed': not violations,
+            'top_allocators': allocators or [],
+            'samples': self.samples,
+        }
+
+def compare_reports(old: dict, new: dict) -> dict:
+    """Differences of the summaries of two soak reports (new - old).
+
+    :param old: report of the reference version
+    :param new: report of the version under test
+    """
+    a, b = old['summary'], new['summary']
+    delta = {
+        key: b[key] - a[key] if a[key] is not None and b[key] is not None else None
+        for key in ('rss_growth_mb', 'rss_slope_mb_per_h', 'traced_growth_mb', 'errors')
+    }
+    delta['latency'] = {}
+    for name in sorted(set(a['latency']) & set(b['latency'])):
+        delta['latency'][name] = {
+            'p99_last_s': b['latency'][name]['p99_last'] - a['latency'][name]['p99_last'],
+            'p99_max_s': b['latency'][name]['p99_max'] - a['latency'][name]['p99_max'],
+        }
+    return {'old': old.get('label'), 'new': new.get('label'), 'delta': delta, 'passed': new['passed']}
+
+def load_report(path: str) -> dict:
+    with open(path) as report:
+        return json.load(report)
@@ -0,0 +1,288 @@
+# mrc_beamstab/stepresponse.py
+
+from protocol.scheduler import StreamScheduler
+from .capture import messages_to_records
+import numpy as np
+import time
+import warnings
+
+# metrics of a trial, see analyse()
+METRICS = ['delay_s', 'rise_s', 'overshoot_pct', 'settling_s']
+
+def distribution(values: np.ndarray) -> dict:
+    """Summary of a metric over all valid (non-NaN) trials."""
+    values = np.asarray(values, dtype=float)
+    values = values[~np.isnan(values)]
+    if not len(values):
+        return {'n': 0, 'mean': None, 'std': None, 'p5': None, 'p50': None, 'p95': None}
+    p5, p50, p95 = np.percentile(values, [5, 50, 95])
+    return {
+        'n': int(len(values)),
+        'mean': float(values.mean()),
+        'std': float(values.std()),
+        'p5': float(p5),
+        'p50': float(p50),
+        'p95': float(p95),
+    }
+
+def resample(times: list, values: list, grid: np.ndarray, max_gap: float) -> np.ndarray:
+    """Interpolate every trial onto a common time grid relative to its command.
+
+    Grid points further than max_gap from the nearest sample (e.g. inside the
+    stream gap of the step command) are NaN.
+
+    :param times: per trial, sample times relative to the command
+    :param values: per trial, sample values
+    :param grid: common time grid
+    :param max_gap: max. distance to the nearest sample in seconds
+
+    return: array of shape (trials, len(grid))
+    """
+    out = np.full((len(times), len(grid)), np.nan)
+    for row, (t, y) in enumerate(zip(times, values)):
+        if len(t) < 2:
+            continue
+        out[row] = np.interp(grid, t, y, left=np.nan, right=np.nan)
+        right = np.clip(np.searchsorted(t, grid), 1, len(t) - 1)
+        nearest = np.minimum(np.abs(grid - t[right - 1]), np.abs(t[right] - grid))
+        out[row, nearest > max_gap] = np.nan
+    return out
+
+def analyse(grid: np.ndarray, y: np.ndarray, low: float = 0.1, high: float = 0.9, band: float = 0.05,
+            tail: float = 0.2, min_amplitude: float = 3.0) -> dict:
+    """Step-response metrics of all trials at once.
+
+    Every trial is normalised to 0 before (mean of grid < 0) and 1 after the
+    step (mean of the last `tail` fraction of the grid).
+
+    :param grid: time relative to the command in seconds, shape (samples,)
+    :param y: responses of shape (trials, samples)
+    :param low: level of the response delay and start of the rise time
+    :param high: end of the rise time
+    :param band: settling band around the final value
+    :param tail: fraction of the grid used for the final value
+    :param min_amplitude: min. step amplitude in multiples of the noise before the step
+
+    return dict of numpy arrays per trial
+        amplitude       -- final - initial value
+        delay_s         -- command to first crossing of `low`
+        rise_s          -- time from `low` to `high`
+        overshoot_pct   -- peak beyond the final value in percent of the amplitude
+        settling_s      -- command to the last sample outside the settling band
+    """
+    before = grid < 0
+    after = grid >= 0
+    final_part = grid >= grid[-1] - tail * grid[-1]
+    # trials without a step (NaN after normalising) are expected, see valid
+    with np.errstate(invalid='ignore', divide='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        initial = np.nanmean(y[:, before], axis=1)
+        noise = np.nanstd(y[:, before], axis=1)
+        final = np.nanmean(y[:, final_part], axis=1)
+        amplitude = final - initial
+        valid = np.abs(amplitude) > np.maximum(min_amplitude * noise, 1.0)
+        norm = (y - initial[:, None]) / amplitude[:, None]
+
+        def crossing(level):
+            reached = (norm >= level) & after
+            index = reached.argmax(axis=1)
+            return np.where(reached.any(axis=1), grid[index], np.nan)
+
+        t_low = crossing(low)
+        t_high = crossing(high)
+        peak = np.nanmax(np.where(after, norm, np.nan), axis=1)
+        outside = (np.abs(norm - 1) > band) & after
+        last = len(grid) - 1 - outside[:, ::-1].argmax(axis=1)
+        settled = ~outside[:, -1]
+        settling = np.where(outside.any(axis=1), grid[np.minimum(last + 1, len(grid) - 1)], 0.0)
+
+    nan = np.full(len(y), np.nan)
+    return {
+        'amplitude': amplitude,
+        'delay_s': np.where(valid, t_low, nan),
+        'rise_s': np.where(valid, t_high - t_low, nan),
+        'overshoot_pct': np.where(valid, np.maximum(peak - 1, 0) * 100, nan),
+        'settling_s': np.where(valid & settled, settling, nan),
+    }
+
+class StepResponse:
+    '''
+    end-to-end actuation latency and step-response characterisation
+
+    Repeats a step of the stage: either an offset step via set_reference_position
+    (alternating between the current offsets and the offsets + step) or
+    toggling enable/disable_stabilization, and records the detector position of
+    the stage around every step. All trials are resampled onto a common grid
+    relative to the host time of the command and analysed at once, the report
+    lists the distributions of delay, rise time, overshoot and settling time per
+    axis.
+
+    The controller rejects commands during a live stream (0xFC), so in stream
+    mode (SLS, default) every step is sent in a pause of the stream by the
+    StreamScheduler and the beginning of the response can fall into the gap of
+    the restart (see gap_s in the report, the measured delay is then an upper
+    bound). In poll mode the position is read with back-to-back S1S without a
+    gap, at the round-trip rate of the connection. Times are host times, i.e.
+    include the transport latency.
+    '''
+
+    def __init__(self, decoder, mode: str = 'offset', step: tuple = (500, 500), trials: int = 20,
+                 rate: int = 500, stage: int = 2, pre: float = 0.05, post: float = 0.3, poll: bool = False):
+        """Configures the characterisation.
+
+        :param decoder: ProtocolDecoder of the controller
+        :param mode: 'offset' for offset steps, 'enable' for enable/disable toggles
+        :param step: offset step (x, y) in mV
+        :param trials: number of steps
+        :param rate: SLS samples/s, also the resolution of the analysis grid
+        :param stage: stage number (1 or 2)
+        :param pre: recorded time before every step in seconds
+        :param post: recorded time after every step in seconds
+        :param poll: read the position with S1S instead of a live stream
+        """
+        if mode not in ('offset', 'enable'):
+            raise ValueError(f'mode must be offset or enable, got {mode}')
+        if stage not in (1, 2):
+            raise ValueError(f'stage must be 1 or 2, got {stage}')
+        self.decoder = decoder
+        self.mode = mode
+        self.step = step
+        self.trials = trials
+        self.rate = rate
+        self.stage = stage
+        self.pre = pre
+        self.post = post
+        self.poll = poll
+        self.channels = (f'DX{stage}', f'DY{stage}')
+        self.grid = np.arange(-pre, post, 1.0 / rate)
+        self.commands = []
+        self.gaps = []
+        self.responses = None
+
+    # ========== steps ========== #
+    def _step_calls(self, base: dict, enabled: bool) -> list:
+        """Alternating step commands, every entry a callable receiving the decoder."""
+        stage = self.stage
+        if self.mode == 'offset':
+            stepped = (base['x'] + self.step[0], base['y'] + self.step[1])
+            targets = [stepped, (base['x'], base['y'])]
+            return [
+                (lambda decoder, target=target: decoder.set_reference_position(*target, stage=stage))
+                for target in targets
+            ]
+        toggles = ['disable_stabilization', 'enable_stabilization']
+        if not enabled:
+            toggles.reverse()
+        return [(lambda decoder, name=name: getattr(decoder, name)(stage)) for name in toggles]
+
+    def _timed(self, call):
+        def run(decoder):
+            self.commands.append(time.perf_counter())
+            return call(decoder)
+        return run
+
+    # ========== acquisition ========== #
+    def _record_stream(self, calls: list) -> tuple:
+        scheduler = StreamScheduler(self.decoder)
+        arrivals, messages = [], []
+        next_step = time.perf_counter() + self.pre
+        submitted = 0
+        stream = scheduler.stream(0, self.rate)
+        try:
+            for arrival, message in stream:
+                arrivals.append(arrival)
+                messages.append(message)
+                if arrival < next_step:
+                    continue
+                if submitted == self.trials:
+                    break
+                scheduler.submit(self._timed(calls[submitted % len(calls)]))
+                submitted += 1
+                next_step = arrival + self.pre + self.post
+        finally:
+            stream.close()
+        self.gaps = [gap['duration_s'] for gap in scheduler.gaps]
+        return arrivals, messages
+
+    def _record_poll(self, calls: list) -> tuple:
+        decoder = self.decoder
+        arrivals, messages = [], []
+        length = decoder.reply_length('S1S')
+        for trial in range(self.trials):
+            for phase in ('pre', 'post'):
+                end = time.perf_counter() + (self.pre if phase == 'pre' else self.post)
+                while time.perf_counter() < end:
+                    decoder.connection.write(b'S1S;')
+                    message = decoder.read_once(length)
+                    if len(message) == length and message[:2] == b'\x00;':
+                        arrivals.append(time.perf_counter())
+                        messages.append(message)
+                if phase == 'pre':
+                    self._timed(calls[trial % len(calls)])(decoder)
+        return arrivals, messages
+
+    def run(self) -> dict:
+        """Run all trials and restore the offsets and the enable state afterwards.
+
+        return: report(), the resampled responses are kept in self.responses
+        """
+        decoder = self.decoder
+        base = decoder.get_reference_position(self.stage)
+        state = decoder.get_stabilization_state()
+        if None in base.values() or state is None:
+            raise ValueError('GAI/GEA has not been acknowledged')
+        enabled = bool(state[f'OnOff{self.stage}'])
+        if self.mode == 'offset' and not enabled:
+            raise ValueError(f'stabilization of stage {self.stage} is disabled, offset steps have no effect')
+        calls = self._step_calls(base, enabled)
+
+        self.commands = []
+        try:
+            if self.poll:
+                arrivals, messages = self._record_poll(calls)
+            else:
+                arrivals, messages = self._record_stream(calls)
+        finally:
+            decoder.set_reference_position(base['x'], base['y'], stage=self.stage)
+            if enabled:
+                decoder.enable_stabilization(self.stage)
+            else:
+                decoder.disable_stabilization(self.stage)
+
+        records = messages_to_records(arrivals, messages)
+        self.responses = {}
+        commands = np.array(self.commands)
+        # every trial spans from pre before to post after its command
+        start = np.searchsorted(records['arrival'], commands - self.pre)
+        stop = np.searchsorted(records['arrival'], commands + self.post)
+        max_gap = 1.5 / self.rate if not self.poll else max(1.5 / self.rate, 0.01)
+        for channel in self.channels:
+            times = [records['arrival'][a:b] - command for a, b, command in zip(start, stop, commands)]
+            values = [records[channel][a:b].astype(float) for a, b in zip(start, stop)]
+            self.responses[channel] = resample(times, values, self.grid, max_gap)
+        return self.report()
+
+    # ========== report ========== #
+    def report(self) -> dict:
+        """Distributions of the step-response metrics per axis.
+
+        return dict of
+            mode, stage, trials, rate, poll  -- configuration
+            gap_s          -- distribution of the stream gaps of the step commands
+            axes           -- per channel (e.g. DX2) |amplitude| and METRICS distributions
+        """
+        axes = {}
+        for channel, y in self.responses.items():
+            metrics = analyse(self.grid, y)
+            # steps alternate in direction
+            metrics['amplitude'] = np.abs(metrics['amplitude'])
+            axes[channel] = {key: distribution(values) for key, values in metrics.items()}
+        return {
+            'mode': self.mode,
+            'stage': self.stage,
+            'trials': len(self.commands),
+            'rate': self.rate,
+            'poll': self.poll,
+            'gap_s': distribution(self.gaps),
+            'axes': axes,
+        }
@@ -1,12 +1,14 @@
 # protocol/__init__.py
-from .protocol import ProtocolDecoder
+from .protocol import ProtocolDecoder, negotiate_baudrate
 from .defs import *
 
 __all__ = [
     'ProtocolDecoder',
+    'negotiate_baudrate',
     'COMMAND_RESPONSE_MAP',
     'RETURN_VALUE_STRUCT_MAP',
     'ASCII_KEYS',
     'ERROR_CODE_MAP',
     'ERROR_DESCRIPTION_MAP',
+    'BAUDRATE_CODE_MAP',
 ]
\ No newline at end of file
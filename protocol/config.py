@@ -0,0 +1,196 @@
+# protocol/config.py
+
+import json
+import time
+
+STAGES = (1, 2)
+AXES = ('x', 'y')
+
+class ControllerConfig:
+    '''
+    serialisable controller configuration
+
+    P-factors (GPF), target offsets (GAI), detector sensitivities (GDS) and
+    enable states (GEA) of both stages, the label (GLA) and the device id (GID)
+    the configuration was read from. Use to_dict()/from_dict() or save()/load()
+    to store it as JSON.
+    '''
+
+    def __init__(self, p_factor: dict, offset: dict, sensitivity: dict, enabled: dict,
+                 label: str, device_id: str = None):
+        """
+        :param p_factor: {stage: P-factor in mV}
+        :param offset: {stage: {'x': offset in mV, 'y': offset in mV}}
+        :param sensitivity: {stage: detector sensitivity in mV}
+        :param enabled: {stage: True if the stabilization is enabled}
+        :param label: user defined label with the [] brackets
+        :param device_id: device id the configuration was read from
+        """
+        self.p_factor = {int(stage): int(value) for stage, value in p_factor.items()}
+        self.offset = {int(stage): {axis: int(value) for axis, value in axes.items()} for stage, axes in offset.items()}
+        self.sensitivity = {int(stage): int(value) for stage, value in sensitivity.items()}
+        self.enabled = {int(stage): bool(value) for stage, value in enabled.items()}
+        self.label = label
+        self.device_id = device_id
+        # timing of the snapshot, not part of the configuration
+        self.timing = None
+
+    def to_dict(self) -> dict:
+        return {
+            'device_id': self.device_id,
+            'label': self.label,
+            'p_factor': {str(stage): value for stage, value in self.p_factor.items()},
+            'offset': {str(stage): dict(axes) for stage, axes in self.offset.items()},
+            'sensitivity': {str(stage): value for stage, value in self.sensitivity.items()},
+            'enabled': {str(stage): value for stage, value in self.enabled.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'ControllerConfig':
+        return cls(
+            p_factor=data['p_factor'],
+            offset=data['offset'],
+            sensitivity=data['sensitivity'],
+            enabled=data['enabled'],
+            label=data['label'],
+            device_id=data.get('device_id'),
+        )
+
+    def save(self, path: str):
+        with open(path, 'w') as file:
+            json.dump(self.to_dict(), file, indent=1)
+
+    @classmethod
+    def load(cls, path: str) -> 'ControllerConfig':
+        with open(path) as file:
+            return cls.from_dict(json.load(file))
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, ControllerConfig):
+            return NotImplemented
+        # the device id identifies the source, not the configuration
+        first, second = self.to_dict(), other.to_dict()
+        first.pop('device_id')
+        second.pop('device_id')
+        return first == second
+
+    def __repr__(self) -> str:
+        return f'ControllerConfig({self.to_dict()})'
+
+def _settings(config: ControllerConfig) -> dict:
+    settings = {'label': config.label}
+    for stage in STAGES:
+        settings[('p_factor', stage)] = config.p_factor[stage]
+        settings[('sensitivity', stage)] = config.sensitivity[stage]
+        settings[('enabled', stage)] = config.enabled[stage]
+        for axis in AXES:
+            settings[('offset', stage, axis)] = config.offset[stage][axis]
+    return settings
+
+def _checked(decoded: dict, command: str) -> dict:
+    if decoded is None:
+        raise ValueError(f'{command} has not been acknowledged')
+    return decoded
+
+def snapshot(decoder) -> ControllerConfig:
+    """Read the full configuration with GID, GLA, GEA, GPF, GAI and GDS.
+
+    :param decoder: ProtocolDecoder of the controller, no stream may be running
+
+    return: ControllerConfig, its timing attribute holds the read time and number of commands
+    """
+    start = time.perf_counter()
+    device_id = _checked(decoder.get_device_id(), 'GID')['Device_id']
+    label = _checked(decoder.get_label(), 'GLA')['l']
+    state = _checked(decoder.get_stabilization_state(), 'GEA')
+    p_factor, offset, sensitivity = {}, {}, {}
+    for stage in STAGES:
+        p_factor[stage] = _checked(decoder.get_p_factor(stage), 'GPF')['p']
+        offset[stage] = decoder.get_reference_position(stage)
+        if None in offset[stage].values():
+            raise ValueError('GAI has not been acknowledged')
+        sensitivity[stage] = _checked(decoder.get_detector_sensitivity(stage), 'GDS')['i']
+    config = ControllerConfig(
+        p_factor=p_factor,
+        offset=offset,
+        sensitivity=sensitivity,
+        enabled={stage: state[f'OnOff{stage}'] for stage in STAGES},
+        label=label,
+        device_id=device_id,
+    )
+    # GID, GLA, GEA and per stage GPF, 2x GAI, GDS
+    config.timing = {'read_s': time.perf_counter() - start, 'commands': 3 + 4 * len(STAGES)}
+    return config
+
+def plan_restore(current: ControllerConfig, target: ControllerConfig) -> list:
+    """Commands changing current into target, in a safe order.
+
+    Stages with changing offsets are disabled first, then P-factors,
+    sensitivities, offsets and the label are written and the stages are
+    enabled last. Settings that already match are skipped.
+
+    return: list of (ProtocolDecoder method name, args) tuples
+    """
+    steps = []
+    disabled = set()
+    for stage in STAGES:
+        offsets_change = current.offset[stage] != target.offset[stage]
+        if current.enabled[stage] and (not target.enabled[stage] or offsets_change):
+            steps.append(('disable_stabilization', (stage,)))
+            disabled.add(stage)
+    for stage in STAGES:
+        if current.p_factor[stage] != target.p_factor[stage]:
+            steps.append(('set_p_factor', (stage, target.p_factor[stage])))
+    for stage in STAGES:
+        if current.sensitivity[stage] != target.sensitivity[stage]:
+            steps.append(('set_detector_sensitivity', (stage, target.sensitivity[stage])))
+    for stage in STAGES:
+        for axis in AXES:
+            if current.offset[stage][axis] != target.offset[stage][axis]:
+                steps.append(('set_reference_axis', (stage, axis, target.offset[stage][axis])))
+    if current.label != target.label:
+        steps.append(('set_label', (target.label,)))
+    for stage in STAGES:
+        if target.enabled[stage] and (not current.enabled[stage] or stage in disabled):
+            steps.append(('enable_stabilization', (stage,)))
+    return steps
+
+def restore(decoder, target: ControllerConfig, dry_run: bool = False, check_device: bool = True) -> dict:
+    """Restore a configuration, sending only the commands that change something.
+
+    If a command is not acknowledged the restore stops with a ValueError, stages
+    disabled for an offset change stay disabled.
+
+    :param decoder: ProtocolDecoder of the controller, no stream may be running
+    :param target: ControllerConfig to restore, e.g. from snapshot() or ControllerConfig.load()
+    :param dry_run: only read the current configuration and plan the commands
+    :param check_device: refuse to restore a configuration read from another device
+
+    return dict of
+        commands    -- list of sent (method, args), planned commands for a dry run
+        unchanged   -- number of settings that already matched
+        read_s      -- time to read the current configuration
+        write_s     -- time to send the commands
+        total_s     -- read_s + write_s
+    """
+    current = snapshot(decoder)
+    if check_device and target.device_id is not None and target.device_id != current.device_id:
+        raise ValueError(f'Configuration of {target.device_id} does not match device {current.device_id}')
+    steps = plan_restore(current, target)
+
+    start = time.perf_counter()
+    if not dry_run:
+        for method, args in steps:
+            if getattr(decoder, method)(*args) is None:
+                raise ValueError(f'{method}{args} has not been acknowledged')
+    write_s = time.perf_counter() - start
+
+    # P-factor, sensitivity, both offsets and enable state per stage and the label
+    first, second = _settings(current), _settings(target)
+    return {
+        'commands': [(method, list(args)) for method, args in steps],
+        'unchanged': sum(first[key] == second[key] for key in first),
+        'read_s': current.timing['read_s'],
+        'write_s': write_s,
+        'total_s': current.timing['read_s'] + write_s,
+    }
@@ -16,6 +16,13 @@ COMMAND_PARAMETER_STRUCT_MAP = {
     'i': 'H'             # Detector sensitivity (0 – 5000mV)
 }
 
+# baudrates selectable via SBRb and the respective parameter codes
+BAUDRATE_CODE_MAP = {
+    115200: 1,
+    460800: 4,
+    921600: 9,
+}
+
 # dict of possible return values and respective dtypes for struct
 RETURN_VALUE_STRUCT_MAP = {
     'A1': 'B',           # unsigned char    # Stabilization of stage1 active or not active, 1 = active, 0 = not active
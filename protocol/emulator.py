@@ -0,0 +1,423 @@
+# protocol/emulator.py
+
+from .defs import (
+    COMMAND_PARAMETER_STRUCT_MAP,
+    COMMAND_RESPONSE_MAP,
+    BAUDRATE_CODE_MAP
+)
+import math
+import os
+import random
+import socket
+import struct
+import threading
+import time
+
+class ControllerEmulator:
+    '''
+    stand-in for an MRC beam stabilization controller speaking the binary protocol
+
+    Serves the protocol over a pseudo terminal (serve_pty) for SerialConnection or a
+    local TCP/IP socket (serve_tcp) for TCPConnection. Stage-2 beam positions follow
+    the reference offsets with first-order dynamics while stabilization is enabled.
+    '''
+    # command name -> parameter fields, e.g. 'SPF' -> ['s', 'p']
+    command_params = {
+        command[:3]: list(command[3:]) for command in COMMAND_RESPONSE_MAP if command != 'StatusFlag'
+    }
+    # SLAl is listed as SLAI in COMMAND_RESPONSE_MAP, the label has a variable length
+    command_params['SLA'] = []
+
+    def __init__(self, device_id: str = 'MRC DIG-AD-DA D0941BA1281 E2-Digital-V031-10256',
+                 ethernet: bool = False, reply_delay: float = 0.0, tau: float = 0.005,
+                 noise: float = 5.0):
+        """Initializes the controller state.
+
+        :param device_id: Device_id returned by GID (max. 47 ASCII characters).
+        :param ethernet: Emulate an Ethernet module, SBR is rejected with 0xF6.
+        :param reply_delay: Processing delay of the controller per command in seconds.
+        :param tau: Time constant of the stage-2 closed loop in seconds.
+        :param noise: Standard deviation of the detector position noise in mV.
+        """
+        self.device_id = device_id
+        self.ethernet = ethernet
+        self.reply_delay = reply_delay
+        self.tau = tau
+        self.noise = noise
+
+        self.p_factor = {1: 1000, 2: 1000}
+        self.offset = {(1, 'x'): 0, (1, 'y'): 0, (2, 'x'): 0, (2, 'y'): 0}
+        self.drive = {(1, 'x'): 0, (1, 'y'): 0, (2, 'x'): 0, (2, 'y'): 0}
+        self.sensitivity = {1: 2500, 2: 2500}
+        self.enabled = {1: 0, 2: 0}
+        self.label = ''
+        self.baudrate = 115200
+        self.error = ('   ', 0x00)
+
+        # free running beam position on detector2 while stage 2 is disabled
+        self.drift = (120.0, -80.0)
+        self.position = list(self.drift)
+        self._last_update = time.perf_counter()
+
+        self._buffer = bytearray()
+        self._lock = threading.Lock()
+        self._write = None
+        self._stream = None
+        self._stop = threading.Event()
+        self._threads = []
+        self._fds = []
+        self._sockets = []
+
+    # ========== transports ========== #
+    def serve_pty(self) -> str:
+        """Serves the emulator on a pseudo terminal.
+
+        return: device path of the pseudo terminal to open with SerialConnection
+        """
+        import tty
+        master, slave = os.openpty()
+        tty.setraw(slave)
+        self._fds.extend([master, slave])
+        self._write = lambda data: os.write(master, data)
+
+        def serve():
+            while not self._stop.is_set():
+                try:
+                    data = os.read(master, 1024)
+                except OSError:
+                    break
+                if data:
+                    self.receive(data)
+
+        self._start_thread(serve)
+        return os.ttyname(slave)
+
+    def serve_tcp(self, host: str = '127.0.0.1', port: int = 0) -> tuple:
+        """Serves the emulator on a TCP/IP socket, one client at a time.
+
+        :param host: IP-address to listen on.
+        :param port: The port, 0 selects a free port.
+
+        return: (host, port) to connect to with TCPConnection
+        """
+        server = socket.create_server((host, port))
+        server.settimeout(0.1)
+        self._sockets.append(server)
+
+        def serve():
+            while not self._stop.is_set():
+                try:
+                    client, _ = server.accept()
+                except (socket.timeout, OSError):
+                    continue
+                client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                client.settimeout(0.1)
+                self._sockets.append(client)
+                self._write = client.sendall
+                while not self._stop.is_set():
+                    try:
+                        data = client.recv(1024)
+                    except socket.timeout:
+                        continue
+                    except OSError:
+                        break
+                    if not data:
+                        break
+                    self.receive(data)
+                self._stop_stream()
+                client.close()
+
+        self._start_thread(serve)
+        return server.getsockname()[:2]
+
+    def stop(self):
+        """Stops the stream and all transports."""
+        self._stop.set()
+        self._stop_stream()
+        for sock in self._sockets:
+            sock.close()
+        for fd in self._fds:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        for thread in self._threads:
+            thread.join(timeout=1.0)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def _start_thread(self, target):
+        thread = threading.Thread(target=target, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def _send(self, data: bytes):
+        with self._lock:
+            try:
+                self._write(data)
+            except OSError:
+                pass
+
+    # ========== command parsing ========== #
+    def receive(self, data: bytes):
+        """Buffers received bytes and replies to every complete command."""
+        self._buffer.extend(data)
+        while True:
+            command, params = self._next_command()
+            if command is None:
+                return
+            if self.reply_delay:
+                time.sleep(self.reply_delay)
+            reply = self.handle(command, params)
+            if reply:
+                self._send(reply)
+
+    def _next_command(self):
+        """Splits the next command off the receive buffer, (None, None) if incomplete."""
+        if len(self._buffer) < 4:
+            return None, None
+        command = self._buffer[:3].decode('ascii', errors='replace')
+        if command == 'SLA':
+            end = self._buffer.find(b'];')
+            if end == -1:
+                return None, None
+            length = end + 2
+        elif command in self.command_params:
+            fmt = '>' + ''.join(COMMAND_PARAMETER_STRUCT_MAP[field] for field in self.command_params[command])
+            length = 3 + struct.calcsize(fmt) + 1
+            if len(self._buffer) < length:
+                return None, None
+        else:
+            # unknown command, skip up to the next semicolon
+            length = self._buffer.find(b';') + 1
+            if length == 0:
+                return None, None
+        chunk = bytes(self._buffer[:length])
+        del self._buffer[:length]
+        if chunk[-1:] != b';':
+            self.error = (command, 0xFD)
+            return 'ERR', b''
+        return command, chunk[3:-1]
+
+    def _fail(self, command: str, code: int) -> bytes:
+        self.error = (command, code)
+        return b'\x01;'
+
+    def handle(self, command: str, params: bytes) -> bytes:
+        """Applies a command to the controller state.
+
+        :param command: three letter command name
+        :param params: binary-coded parameters
+
+        return: reply bytes
+        """
+        if command == 'ERR':
+            return b'\x01;'
+        if command not in self.command_params and command != 'SLA':
+            return self._fail(command, 0xFF)
+        if self._stream is not None and command != 'CLS':
+            return self._fail(command, 0xFC)
+
+        fields = self.command_params[command]
+        values = {}
+        if fields:
+            fmt = '>' + ''.join(COMMAND_PARAMETER_STRUCT_MAP[field] for field in fields)
+            values = dict(zip(fields, struct.unpack(fmt, params)))
+        stage = values.get('s')
+        if stage is not None and stage not in (1, 2):
+            return self._fail(command, 0xFE)
+        axis = chr(values['a']) if 'a' in values else None
+        if axis is not None and axis not in ('x', 'y'):
+            return self._fail(command, 0xFE)
+
+        if command == 'S1S':
+            return self.frame()
+        if command == 'SLS':
+            if not 1 <= values['r'] <= 500 or values['m'] > 65500:
+                return self._fail(command, 0xFE)
+            self._start_stream(values['m'], values['r'])
+            return b''
+        if command == 'CLS':
+            if self._stream is None:
+                return self._fail(command, 0xF9)
+            self._stop_stream()
+            return b'\x00;'
+        if command == 'SPF':
+            if values['p'] > 5000:
+                return self._fail(command, 0xFE)
+            self.p_factor[stage] = values['p']
+            return b'\x00;'
+        if command == 'GPF':
+            return b'\x00;' + struct.pack('>H', self.p_factor[stage]) + b';'
+        if command == 'SAI':
+            if not -5000 <= values['o'] <= 5000:
+                return self._fail(command, 0xFE)
+            self._update_position()
+            self.offset[(stage, axis)] = values['o']
+            return b'\x00;'
+        if command == 'GAI':
+            return b'\x00;' + struct.pack('>h', self.offset[(stage, axis)]) + b';'
+        if command == 'SDA':
+            if self.enabled[stage]:
+                return self._fail(command, 0xFB)
+            if not -5000 <= values['d'] <= 5000:
+                return self._fail(command, 0xFE)
+            self.drive[(stage, axis)] = values['d']
+            return b'\x00;'
+        if command == 'GDA':
+            return b'\x00;' + struct.pack(
+                '>hhhh', self.drive[(1, 'x')], self.drive[(1, 'y')], self.drive[(2, 'x')], self.drive[(2, 'y')]
+            ) + b';'
+        if command == 'SDS':
+            if values['i'] > 5000:
+                return self._fail(command, 0xFE)
+            self.sensitivity[stage] = values['i']
+            return b'\x00;'
+        if command == 'GDS':
+            return b'\x00;' + struct.pack('>H', self.sensitivity[stage]) + b';'
+        if command == 'SEA':
+            self._update_position()
+            self.enabled[stage] = 1
+            return b'\x00;'
+        if command == 'CEA':
+            self._update_position()
+            self.enabled[stage] = 0
+            return b'\x00;'
+        if command == 'GEA':
+            return b'\x00;' + bytes([self.enabled[1], self.enabled[2]]) + b';'
+        if command == 'SBR':
+            if self.ethernet:
+                return self._fail(command, 0xF6)
+            rates = {code: baudrate for baudrate, code in BAUDRATE_CODE_MAP.items()}
+            if values['b'] not in rates:
+                return self._fail(command, 0xFE)
+            self.baudrate = rates[values['b']]
+            return b'\x00;'
+        if command == 'GSF':
+            return b'\x00;' + bytes([self.status_flag()]) + b';'
+        if command == 'GID':
+            return b'\x00;' + self.device_id.encode('ascii').ljust(47, b'\x00')[:47] + b';'
+        if command == 'SLA':
+            if not (params.startswith(b'[') and params.endswith(b']')) or len(params) > 27:
+                return self._fail(command, 0xFE)
+            self.label = params[1:-1].decode('ascii', errors='replace')
+            return b'\x00;'
+        if command == 'GLA':
+            return b'\x00;' + f'[{self.label}]'.encode('ascii').ljust(25, b'\x00')[:25] + b';'
+        if command == 'GER':
+            cmd, code = self.error
+            return b'\x00;' + cmd.encode('ascii')[:3].ljust(3) + bytes([code]) + b';'
+        # trigger and hold commands need the optional ADDA module state, acknowledge only
+        return b'\x00;'
+
+    # ========== measurement ========== #
+    def status_flag(self, end_of_stream: bool = False) -> int:
+        """Encodes the StatusFlag byte (EF, A2, A1, OnOff2, OnOff1, Adj2, Adj1, PF)."""
+        return (
+            (end_of_stream << 7) |
+            (self.enabled[2] << 6) |
+            (self.enabled[1] << 5) |
+            (self.enabled[2] << 4) |
+            (self.enabled[1] << 3) |
+            0b111
+        )
+
+    def _update_position(self):
+        """Advances the stage-2 beam position to the current time."""
+        now = time.perf_counter()
+        dt = now - self._last_update
+        self._last_update = now
+        if self.enabled[2]:
+            target = (self.offset[(2, 'x')], self.offset[(2, 'y')])
+        else:
+            target = self.drift
+        alpha = 1.0 - math.exp(-dt / self.tau) if self.tau > 0 else 1.0
+        for i in (0, 1):
+            self.position[i] += (target[i] - self.position[i]) * alpha
+
+    def frame(self, end_of_stream: bool = False) -> bytes:
+        """Builds a 25 byte S1S/SLS measurement frame of the current state."""
+        self._update_position()
+
+        def clip(value, low=-5000, high=5000):
+            return int(max(low, min(high, round(value))))
+
+        noise = lambda: random.gauss(0.0, self.noise)
+        values = (
+            clip(noise()), clip(noise()), 6000,
+            clip(self.position[0] + noise()), clip(self.position[1] + noise()), 6000,
+            10000 - abs(self.drive[(1, 'x')]), 10000 - abs(self.drive[(1, 'y')]),
+            10000 - abs(self.drive[(2, 'x')]), 10000 - abs(self.drive[(2, 'y')]),
+        )
+        return b'\x00;' + struct.pack('>BBhhHhhHHHHH', self.status_flag(end_of_stream), 0, *values) + b';'
+
+    # ========== stream ========== #
+    def _start_stream(self, m: int, r: int):
+        stop = threading.Event()
+
+        def stream():
+            period = 1.0 / r
+            start = time.perf_counter()
+            n = 0
+            while not stop.is_set() and not self._stop.is_set():
+                n += 1
+                last = m != 0 and n >= m
+                self._send(self.frame(end_of_stream=last))
+                if last:
+                    break
+                delay = start + n * period - time.perf_counter()
+                if delay > 0:
+                    stop.wait(delay)
+            if self._stream is not None and self._stream[0] is stop:
+                self._stream = None
+
+        thread = threading.Thread(target=stream, daemon=True)
+        self._stream = (stop, thread)
+        thread.start()
+
+    def _stop_stream(self):
+        stream = self._stream
+        if stream is not None:
+            stream[0].set()
+            if stream[1] is not threading.current_thread():
+                stream[1].join(timeout=1.0)
+            self._stream = None
+
+def serve_process(host: str = '127.0.0.1', port: int = 0, timeout: float = 10.0, **kwargs) -> tuple:
+    """Serves a ControllerEmulator on a TCP/IP socket in a separate process, e.g. to
+    keep its allocations and CPU time out of measurements of the client process.
+
+    :param host: IP-address to listen on.
+    :param port: The port, 0 selects a free port.
+    :param timeout: Max. time in seconds to wait for the process to listen.
+    :param kwargs: Arguments of ControllerEmulator, e.g. ethernet=True.
+
+    return: (process, (host, port)), stop the emulator with process.terminate()
+    """
+    import multiprocessing
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=_serve_process, args=(sender, host, port, kwargs), daemon=True)
+    process.start()
+    sender.close()
+    try:
+        if not receiver.poll(timeout):
+            raise TimeoutError(f'Emulator process did not listen within {timeout} s')
+        address = receiver.recv()
+    except (TimeoutError, EOFError):
+        process.terminate()
+        process.join()
+        raise
+    finally:
+        receiver.close()
+    return process, tuple(address)
+
+def _serve_process(sender, host: str, port: int, kwargs: dict):
+    with ControllerEmulator(**kwargs) as emulator:
+        sender.send(emulator.serve_tcp(host, port))
+        sender.close()
+        # serves until the parent terminates the process
+        emulator._stop.wait()
@@ -0,0 +1,164 @@
+# protocol/executor.py
+
+from concurrent.futures import Future
+import itertools
+import queue
+import threading
+
+# lower values are executed first
+PRIORITY_SAFETY = 0
+PRIORITY_NORMAL = 10
+PRIORITY_POLL   = 20
+
+class CommandExecutor:
+    '''
+    thread-safe command executor owning a ProtocolDecoder
+
+    ProtocolDecoder is not thread-safe, concurrent commands interleave their bytes
+    on the wire. The executor runs all commands on a single I/O thread and accepts
+    requests from any thread, returning concurrent.futures.Future objects.
+    Queued requests are executed by priority, e.g. a safety CEA jumps ahead of
+    polling. Identical read requests (start_one_shot, get_*) that are queued or
+    in flight share one device round trip and one Future, a queued read runs at
+    the highest priority it was requested with.
+    '''
+    # default priorities of decoder methods, PRIORITY_NORMAL otherwise
+    priorities = {
+        'disable_stabilization': PRIORITY_SAFETY,
+        'start_one_shot': PRIORITY_POLL,
+        'get_drive_actuator': PRIORITY_POLL,
+    }
+
+    def __init__(self, decoder, name: str = 'mrc-executor'):
+        """Starts the I/O thread.
+
+        :param decoder: ProtocolDecoder of the controller, only used by the I/O thread afterwards
+        :param name: name of the I/O thread
+        """
+        self.decoder = decoder
+        self.coalesced = 0
+        self._queue = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._in_flight = {}
+        # key -> (priority, queue slot) of coalescable reads not yet executed
+        self._queued = {}
+        self._lock = threading.Lock()
+        self._shutdown = False
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def is_read(command) -> bool:
+        """True for decoder methods that only read the controller state."""
+        return isinstance(command, str) and (command == 'start_one_shot' or command.startswith('get_'))
+
+    def submit(self, command, *args, priority: int = None, **kwargs) -> Future:
+        """Queue a command for the I/O thread.
+
+        :param command: name of a ProtocolDecoder method (e.g. 'get_p_factor') or
+                        a callable receiving the decoder as first argument
+        :param args: arguments of the command
+        :param priority: PRIORITY_SAFETY, PRIORITY_NORMAL, PRIORITY_POLL or any int,
+                         default from self.priorities
+
+        return: Future of the command result
+        """
+        if isinstance(command, str) and not callable(getattr(self.decoder, command, None)):
+            raise ValueError(f'Unknown command {command}')
+        if priority is None:
+            priority = self.priorities.get(command, PRIORITY_NORMAL) if isinstance(command, str) else PRIORITY_NORMAL
+        key = (command, args, tuple(sorted(kwargs.items()))) if self.is_read(command) else None
+        if key is not None:
+            try:
+                hash(key)
+            except TypeError:
+                # reads with unhashable arguments are not coalesced
+                key = None
+
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError('Executor has been shut down')
+            if key is not None and key in self._in_flight:
+                self.coalesced += 1
+                future = self._in_flight[key]
+                queued = self._queued.get(key)
+                if queued is not None and priority < queued[0]:
+                    # requeue the waiting read at the higher priority, the old entry is skipped
+                    queued[1][0] = None
+                    self._put(priority, future, command, args, kwargs, key)
+                return future
+            future = Future()
+            if key is not None:
+                self._in_flight[key] = future
+            self._put(priority, future, command, args, kwargs, key)
+        return future
+
+    def _put(self, priority: int, future: Future, command, args: tuple, kwargs: dict, key):
+        # the slot is emptied when the entry is superseded, called with the lock held
+        slot = [future]
+        if key is not None:
+            self._queued[key] = (priority, slot)
+        self._queue.put((priority, next(self._sequence), slot, command, args, kwargs, key))
+
+    def _run(self):
+        while True:
+            _, _, slot, command, args, kwargs, key = self._queue.get()
+            if slot is None:
+                return
+            with self._lock:
+                future = slot[0]
+                if future is not None and key is not None:
+                    self._queued.pop(key, None)
+            if future is None:
+                continue
+            if not future.set_running_or_notify_cancel():
+                self._release(key)
+                continue
+            try:
+                if isinstance(command, str):
+                    result = getattr(self.decoder, command)(*args, **kwargs)
+                else:
+                    result = command(self.decoder, *args, **kwargs)
+            except Exception as exc:
+                self._release(key)
+                future.set_exception(exc)
+            else:
+                # later identical requests need a new round trip
+                self._release(key)
+                future.set_result(result)
+
+    def _release(self, key):
+        if key is not None:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+    def shutdown(self, wait: bool = True, cancel_pending: bool = False):
+        """Stop the I/O thread after the queued commands.
+
+        :param wait: wait for the I/O thread to finish
+        :param cancel_pending: cancel queued commands instead of executing them
+        """
+        with self._lock:
+            if self._shutdown:
+                return
+            self._shutdown = True
+            if cancel_pending:
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item[2] is not None and item[2][0] is not None:
+                        item[2][0].cancel()
+                self._in_flight.clear()
+                self._queued.clear()
+            # the sentinel sorts behind every queued command
+            self._queue.put((float('inf'), next(self._sequence), None, None, None, None, None))
+        if wait:
+            self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
@@ -0,0 +1,186 @@
+# protocol/feedback.py
+
+from .scheduler import StreamScheduler
+from collections import deque
+import time
+
+class OuterLoopController:
+    '''
+    host-side outer feedback loop driving the SAIsao reference offsets
+
+    Reads the live stream and passes the latest message to error_fn, which
+    returns the error of an external reference (e.g. a downstream camera
+    centroid) in mV. A PI controller turns the error into x/y reference offsets
+    of the stage, written with set_reference_position through a StreamScheduler
+    (the stream pauses for every write). Offsets are clamped to +-5000 mV and
+    rate limited in update rate and step size.
+
+    Loop latency (message arrival to acknowledged write) and update jitter are
+    recorded per iteration. When stream messages are late the offset is frozen,
+    the integrator is held and no command is written.
+    '''
+    limit = 5000
+
+    def __init__(self, decoder, error_fn, kp: float = 0.5, ki: float = 0.0, rate: float = 10.0,
+                 max_step: int = 100, stream_rate: int = 500, latency_budget: float = 0.05,
+                 frame_timeout: float = None, stage: int = 2, initial: tuple = (0, 0), history: int = 10000):
+        """Initializes the controller.
+
+        :param decoder: ProtocolDecoder of the controller
+        :param error_fn: callable receiving the decoded stream message (dict), returns
+                         the (x, y) error in mV, None skips the iteration
+        :param kp: proportional gain
+        :param ki: integral gain in 1/s
+        :param rate: max. number of offset updates per second
+        :param max_step: max. change of an offset per update in mV
+        :param stream_rate: sampling rate r of the live stream (1 - 500 samples/s)
+        :param latency_budget: max. loop latency in seconds, exceeding it is counted as violation
+        :param frame_timeout: max. time between two stream messages in seconds before the
+                              offset is frozen, default 5 sample periods
+        :param stage: stage of the reference offsets (1 or 2)
+        :param initial: (x, y) reference offsets in mV at the start
+        :param history: number of iterations kept for the statistics
+        """
+        if stage not in (1, 2):
+            raise ValueError(f'stage must be 1 or 2, got {stage}')
+        self.decoder = decoder
+        self.scheduler = StreamScheduler(decoder)
+        self.error_fn = error_fn
+        self.kp = kp
+        self.ki = ki
+        self.period = 1.0 / rate
+        self.max_step = max_step
+        self.stream_rate = stream_rate
+        self.latency_budget = latency_budget
+        self.frame_timeout = frame_timeout if frame_timeout is not None else 5.0 / stream_rate
+        self.stage = stage
+
+        self.offset = [int(initial[0]), int(initial[1])]
+        self.integral = [0.0, 0.0]
+        self.iterations = 0
+        self.frozen = 0
+        self.violations = 0
+        self.latencies = deque(maxlen=history)
+        self.intervals = deque(maxlen=history)
+        self._stop = False
+
+    def stop(self):
+        """Stop the loop at the next stream message."""
+        self._stop = True
+        self.scheduler.stop()
+
+    def _clamp(self, value: float) -> float:
+        return max(-self.limit, min(self.limit, value))
+
+    def update(self, error: tuple, dt: float) -> bool:
+        """Compute the next offsets from the error.
+
+        :param error: (x, y) error in mV
+        :param dt: time since the last update in seconds
+
+        return: True if an offset changed
+        """
+        changed = False
+        for i in (0, 1):
+            output = self.kp * error[i] + self.integral[i] + self.ki * error[i] * dt
+            # conditional integration as anti-windup: hold the integrator while saturated
+            if abs(output) < self.limit:
+                self.integral[i] += self.ki * error[i] * dt
+            target = self._clamp(output)
+            step = max(-self.max_step, min(self.max_step, target - self.offset[i]))
+            value = int(round(self.offset[i] + step))
+            if value != self.offset[i]:
+                self.offset[i] = value
+                changed = True
+        return changed
+
+    def run(self, duration: float = None, iterations: int = None):
+        """Run the loop until stop(), duration or number of updates is reached.
+
+        :param duration: run time in seconds
+        :param iterations: number of offset updates
+        """
+        self._stop = False
+        start = time.perf_counter()
+        next_update = start
+        last_update = None
+        previous_arrival = None
+        pending = None
+
+        for arrival, message in self.scheduler.stream(0, self.stream_rate):
+            now = time.perf_counter()
+            late = previous_arrival is not None and arrival - previous_arrival > self.frame_timeout
+            previous_arrival = arrival
+            if pending is not None:
+                if not pending.done():
+                    continue
+                # the pause for the write delays the following messages
+                late = False
+                pending = None
+
+            if (duration is not None and now - start >= duration) or \
+               (iterations is not None and self.iterations >= iterations):
+                self.stop()
+                continue
+            if now < next_update:
+                continue
+            next_update += self.period
+            if next_update < now:
+                # skip missed updates instead of bursting
+                next_update = now + self.period
+
+            if late:
+                self.frozen += 1
+                last_update = now
+                continue
+            error = self.error_fn(self.decoder.decode_response(message, 'SLSmr'))
+            if error is None:
+                continue
+
+            dt = now - last_update if last_update is not None else self.period
+            if last_update is not None:
+                self.intervals.append(dt)
+            last_update = now
+            self.iterations += 1
+            if not self.update(error, dt):
+                continue
+
+            pending = self.scheduler.submit(
+                'set_reference_position', self.offset[0], self.offset[1], stage=self.stage
+            )
+            pending.add_done_callback(lambda _, arrival=arrival: self._record(arrival))
+
+    def _record(self, arrival: float):
+        latency = time.perf_counter() - arrival
+        self.latencies.append(latency)
+        if latency > self.latency_budget:
+            self.violations += 1
+
+    def stats(self) -> dict:
+        """Loop statistics in seconds.
+
+        return dict of
+            iterations          -- number of computed updates
+            frozen              -- number of updates skipped because of late messages
+            violations          -- number of writes exceeding the latency budget
+            latency_p50, latency_p99, latency_max  -- message arrival to acknowledged write
+            interval_mean       -- mean time between updates
+            jitter              -- standard deviation of the time between updates
+        """
+        latencies = sorted(self.latencies)
+        intervals = list(self.intervals)
+        stats = {
+            'iterations': self.iterations,
+            'frozen': self.frozen,
+            'violations': self.violations,
+            'latency_p50': latencies[int(0.50 * (len(latencies) - 1))] if latencies else None,
+            'latency_p99': latencies[int(0.99 * (len(latencies) - 1))] if latencies else None,
+            'latency_max': latencies[-1] if latencies else None,
+            'interval_mean': None,
+            'jitter': None,
+        }
+        if intervals:
+            mean = sum(intervals) / len(intervals)
+            stats['interval_mean'] = mean
+            stats['jitter'] = (sum((x - mean) ** 2 for x in intervals) / len(intervals)) ** 0.5
+        return stats
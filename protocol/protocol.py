@@ -5,8 +5,10 @@ from .defs import (
     COMMAND_RESPONSE_MAP,
     RETURN_VALUE_STRUCT_MAP,
     ASCII_KEYS,ERROR_CODE_MAP,
-    ERROR_DESCRIPTION_MAP
+    ERROR_DESCRIPTION_MAP,
+    BAUDRATE_CODE_MAP
 )
+from collections import deque
 import struct
 import time
 
@@ -18,9 +20,18 @@ class ProtocolDecoder:
     command_response_map         = COMMAND_RESPONSE_MAP
     error_code_map               = ERROR_CODE_MAP
     error_description_map        = ERROR_DESCRIPTION_MAP
+    baudrate_code_map            = BAUDRATE_CODE_MAP
+
+    # number of round-trip latencies kept per command
+    latency_history = 1000
 
     def __init__(self, connection):
         self.connection = connection
+        self.latencies = {}
+        self.dropped_bytes = 0
+        self._sent = None
+        # compiled response layout of the firmware, see protocol.schema.load_layout()
+        self.layout = None
 
     # ========== communication ========== #
     def send_command(self, command: str, params=None):
@@ -42,6 +53,8 @@ class ProtocolDecoder:
             params +
             b';'
         )
+        # timestamp before writing, the reply can arrive before write() returns
+        self._sent = (command, time.perf_counter())
         self.connection.write(chunk)
 
     def read(self, size: int) -> bytes:
@@ -63,64 +76,194 @@ class ProtocolDecoder:
         while True:
             chunk = self.read(size)
             if not chunk:
-                # serial connection lost
-                if hasattr(self.connection, 'is_open') and not self.connection.is_open:
-                    raise ConnectionError('Serial connection lost')
-            
-                # serial connection timeout
-                if hasattr(self.connection, 'is_open'):
-                    continue
-                
-                # tcp/ip connection closed
-                raise ConnectionError('Server closed the tcp/ip connection')
-            
+                self.check_connection()
             yield chunk
 
+    def check_connection(self):
+        """Raise the matching exception after a read returned no data."""
+        # serial connection lost
+        if hasattr(self.connection, 'is_open') and not self.connection.is_open:
+            raise ConnectionError('Serial connection lost')
+
+        # serial connection timeout, the reply is missing
+        if hasattr(self.connection, 'is_open'):
+            raise TimeoutError('Serial read timed out')
+
+        # tcp/ip connection closed
+        raise ConnectionError('Server closed the tcp/ip connection')
+
     def read_once(self, length: int) -> bytes:
-        """Unpack chunks received by self.receive()
+        """Read a single response of known length
 
-        :param size: Expected lenth of received response
+        Error replies (1;) are returned as soon as they are complete instead of
+        waiting for the read timeout. The round-trip latency since the last
+        send_command() is recorded in self.latencies.
+
+        :param length: Expected length of received response
         """
         buffer = bytearray()
-        for chunk in self.receive(length):
+        while len(buffer) < length:
+            # only request the missing bytes to not consume the following response
+            chunk = self.read(length - len(buffer))
+            if not chunk:
+                self.check_connection()
             buffer.extend(chunk)
-            # reads from generator function self.receive() until the expected length of the response is reached
-            if len(buffer) >= length:
+            if buffer[:2] == b'\x01;':
                 break
+        self.record_latency()
         return bytes(buffer[:length])
 
-    # to be worked on
-    def read_continuesly(self, length: int):
-        
+    def record_latency(self):
+        """Record the time since the last send_command() for its command."""
+        if self._sent is None:
+            return
+        command, sent_at = self._sent
+        self._sent = None
+        if command not in self.latencies:
+            self.latencies[command] = deque(maxlen=self.latency_history)
+        self.latencies[command].append(time.perf_counter() - sent_at)
+
+    def latency_stats(self) -> dict:
+        """Round-trip latency statistics per command in seconds.
+
+        return: dict of command -> dict of count, mean, p50, p99, max
+        """
+        stats = {}
+        for command, samples in self.latencies.items():
+            ordered = sorted(samples)
+            if not ordered:
+                continue
+            stats[command] = {
+                'count': len(ordered),
+                'mean': sum(ordered) / len(ordered),
+                'p50': ordered[int(0.50 * (len(ordered) - 1))],
+                'p99': ordered[int(0.99 * (len(ordered) - 1))],
+                'max': ordered[-1],
+            }
+        return stats
+
+    def read_stream(self, length: int):
+        """Yield complete stream messages together with their host arrival time
+
+        Messages start with the acknowledgement marker (0;) and end on (;) after
+        length bytes, see split_stream().
+
+        :param length: Length of a single stream message
+
+        yield tuple of
+            arrival  -- time.perf_counter() when the chunk containing the message was read
+            message  -- raw stream message in bytes
+        """
         buffer = bytearray()
-        while True:
-            chunk = self.read_once(length)
+        for chunk in self.receive(length):
+            arrival = time.perf_counter()
             buffer.extend(chunk)
+            for message in self.split_stream(buffer, length):
+                yield arrival, message
 
-            print(buffer)
+    def split_stream(self, buffer: bytearray, length: int) -> list:
+        """Split complete stream messages off the front of buffer
+
+        Bytes in front of a valid message are dropped to resynchronize on the stream
+        and counted in self.dropped_bytes. An incomplete message is kept in buffer.
+
+        :param buffer: received bytes, processed bytes are removed in place
+        :param length: Length of a single stream message
+
+        return: list of raw stream messages
+        """
+        messages = []
+        while len(buffer) >= length:
             # find message start marker
             start = buffer.find(b'\x00;')
             if start == -1:
-                start = buffer.find(b'\x01;')
-                if start == -1:
-                    # raise ValueError('No response start marker found')
-                    print('No response start marker found yet')
-            
-            # find message end marker
-            end = buffer.find(b';', start + 3)
-            if end == -1:
-                # raise ValueError('Incomplete response') 
-                print('Incomplete response, waiting for more data')
+                # keep a trailing 0 which might start the next message
+                self.dropped_bytes += len(buffer) - 1
+                del buffer[:-1]
+                break
+            if len(buffer) - start < length:
+                self.dropped_bytes += start
+                del buffer[:start]
+                break
+            # check message end marker, otherwise search the next start marker
+            if buffer[start + length - 1] != 59:
+                self.dropped_bytes += start + 1
+                del buffer[:start + 1]
+                continue
+            messages.append(bytes(buffer[start:start + length]))
+            self.dropped_bytes += start
+            # remove processed bytes from buffer
+            del buffer[:start + length]
+        return messages
 
-            # extract full message
-            message = bytes(buffer[start:end + 1])
+    def flush_stream(self, length: int = 25, quiet: float = 0.01, timeout: float = 2.0, buffer: bytearray = None):
+        """Read the trailing stream messages and the reply after CLS was sent
 
-            # remove processed bytes from buffer
-            del buffer[:end + 1]
+        Reads until the remaining bytes are the CLS reply (0; or 1;) and no further
+        byte arrived within quiet seconds.
+
+        :param length: Length of a single stream message
+        :param quiet: Time without received bytes that ends the flush in seconds
+        :param timeout: Max. duration of the flush in seconds
+        :param buffer: Bytes received before CLS and not yet split into messages,
+                       e.g. the framing buffer of a stream reader, consumed in place
+
+        return tuple of
+            messages -- list of (arrival, message) received after CLS was sent
+            reply    -- remaining bytes, the CLS reply
+        """
+        messages = []
+        if buffer is None:
+            buffer = bytearray()
+        raw_end = bytes(buffer[-2:])
+        arrival = time.perf_counter()
+        messages.extend((arrival, message) for message in self.split_stream(buffer, length))
+        previous_timeout = self.connection.timeout
+        self.connection.set_timeout(quiet)
+        deadline = time.perf_counter() + timeout
+        try:
+            while time.perf_counter() < deadline:
+                try:
+                    chunk = self.read(4096)
+                    if not chunk:
+                        self.check_connection()
+                except TimeoutError:
+                    chunk = b''
+                if chunk:
+                    arrival = time.perf_counter()
+                    raw_end = (raw_end + chunk)[-2:]
+                    buffer.extend(chunk)
+                    messages.extend((arrival, message) for message in self.split_stream(buffer, length))
+                    continue
+                # quiet: done once only the reply is left
+                if bytes(buffer[-2:]) in (b'\x00;', b'\x01;') or raw_end == b'\x01;':
+                    break
+        finally:
+            self.connection.set_timeout(previous_timeout)
+        return messages, raw_end if raw_end == b'\x01;' else bytes(buffer[-2:])
+
+    def read_continuesly(self, length: int):
+        """Yield complete stream messages of the given length, see read_stream()
 
+        :param length: Length of a single stream message
+        """
+        for _, message in self.read_stream(length):
             yield message
  
     # ========== cross checks ========== #
+    def reply_length(self, command: str) -> int:
+        """Expected reply length of a COMMAND_RESPONSE_MAP key, from the compiled layout if available."""
+        if self.layout is not None and command in self.layout.lengths:
+            return self.layout.lengths[command]
+        return struct.calcsize(self.get_formatter_str(self.command_response_map[command]))
+
+    def reply_struct(self, command: str) -> tuple:
+        """Reply fields and compiled struct of a COMMAND_RESPONSE_MAP key, from the compiled layout if available."""
+        if self.layout is not None and command in self.layout.structs:
+            return self.layout.fields[command], self.layout.structs[command]
+        fields = self.command_response_map[command]
+        return fields, struct.Struct(self.get_formatter_str(fields))
+
     def get_formatter_str(self, fields: str, map=None) -> str:
         """Builder for struct formatter string to pack and unpack bytes
 
@@ -182,15 +325,13 @@ class ProtocolDecoder:
         # check command validity
         if command not in self.command_response_map:
             raise ValueError(f'Unknown command {command}')
-        # extracts expected fields for the command
-        fields = self.command_response_map[command]
-        # build struct formatter string for unpacking the response
-        fmt = self.get_formatter_str(fields)
+        # fields and precompiled struct of the probed layout, otherwise of the schema
+        fields, compiled = self.reply_struct(command)
         # check reply length with expected length
-        if struct.calcsize(fmt) != len(reply):
-            raise ValueError(f'Length of reply {len(reply)} byte does not match length of expected "{command}" length of {struct.calcsize(fmt)} byte.')
+        if compiled.size != len(reply):
+            raise ValueError(f'Length of reply {len(reply)} byte does not match length of expected "{command}" length of {compiled.size} byte.')
         # unpack
-        unpacked = struct.unpack(fmt, reply)
+        unpacked = compiled.unpack(reply)
         response = dict(zip(fields, unpacked))
         # handle special cases of keys
         for key, val in response.items():
@@ -257,14 +398,11 @@ class ProtocolDecoder:
         """
         command = 'S1S'
         self.send_command(command)
-        fields = self.command_response_map[command]
-        fmt = self.get_formatter_str(fields)
-        length = struct.calcsize(fmt)
+        length = self.reply_length(command)
         raw_reply = self.read_once(length)
         if (self.acknowledge(raw_reply)) and (self.reply_end(raw_reply)):
             return self.decode_response(raw_reply, command) 
         
-    # to be worked on
     def start_live_stream(self, m, r):
         """Start Live Stream
 
@@ -278,6 +416,7 @@ class ProtocolDecoder:
                   1 <= r <= 500 samples/s
         
         stream dict of
+            StatusFlag,
             Res. Byte,
             DX1, DY1,   -- Stage-1 actuator drive values (-5000mV - +5000mV)
             DI1,        -- Detector1, intensity (0 - 8000mV)
@@ -286,35 +425,67 @@ class ProtocolDecoder:
             RX1, RY1,   -- Piezo range of stage1 (0 - 10000mV)
             RX2, RY2    -- Piezo range of stage2 (0 - 10000mV)
         """
+        command = 'SLSmr'
+        for _, message in self.start_live_stream_raw(m, r):
+            yield self.decode_response(message, command)
+
+    def start_live_stream_raw(self, m, r):
+        """Start Live Stream without decoding the messages
+
+        Same as start_live_stream() but yields the raw 25 byte messages together with
+        their host arrival time, see read_stream(). The generator ends after the
+        message carrying the End of Stream Flag (m > 0). Closing the generator
+        before stops the stream with clear_live_stream().
+
+        :param m: number of transmitted data measurement blocks (0: continues measurement)
+        :param r: time interval (1 <= r <= 500 samples/s)
+
+        yield tuple of (arrival, message)
+        """
+        if not (0 <= m <= 65500):
+            raise ValueError(f'm must be between 0 and 65500, got {m}')
+        if not (1 <= r <= 500):
+            raise ValueError(f'r must be between 1 and 500 samples/s, got {r}')
+
         command = 'SLSmr'
         fields = ['m', 'r']
         fmt = self.get_formatter_str(fields, map=self.command_parameter_struct_map)
-        length = struct.calcsize(fmt)
         params = struct.pack(fmt, m, r)
-        self.send_command('SLS', params)  
-
-        for message in self.read_continuesly(length):
-            print(message)
-            if (self.acknowledge(message)) and (self.reply_end(message)):
-                decoded = self.decode_response(message, command)
-                print(decoded)
-                yield decoded
+        length = self.reply_length(command)
+        self.send_command('SLS', params)
+        self._sent = None
+
+        ended = False
+        try:
+            for arrival, message in self.read_stream(length):
+                # End of Stream Flag is the most significant bit of the StatusFlag
+                ended = bool(m and message[2] & 0x80)
+                yield arrival, message
+                if ended:
+                    return
+        except GeneratorExit:
+            # the stream is still running, the controller only accepts CLS
+            if not ended:
+                self.clear_live_stream()
+            raise
             
-    def clear_live_stream(self):
-        
-        command = 'CLS'
-        self.send_command(command)
-        #fields = self.command_response_map[command]
-        #fmt = self.get_formatter_str(fields)
-        length = 1000
-        
-        #raw_reply = self.read_once(length)
-        #print(raw_reply)
-        #if (self.acknowledge(raw_reply)) and (self.reply_end(raw_reply)):
-        #    return self.decode_response(raw_reply, command)
-        
+    def clear_live_stream(self, quiet: float = 0.01) -> dict:
+        """Clear Live Stream
+
+        Send the CLS command to stop a running live stream and discard the trailing
+        stream messages, see flush_stream().
 
+        :param quiet: Time without received bytes that ends the flush in seconds
 
+        return: dict of decoded CLS response, None if no stream was running
+        """
+        command = 'CLS'
+        self.send_command(command)
+        length = self.reply_length('SLSmr')
+        _, raw_reply = self.flush_stream(length, quiet)
+        self.record_latency()
+        if self.acknowledge(raw_reply) and self.reply_end(raw_reply):
+            return self.decode_response(raw_reply, command)
 
     ##### Stage 2 reference positioning and stabilization #####
         
@@ -330,9 +501,7 @@ class ProtocolDecoder:
         """
         command = 'GDA'
         self.send_command(command)
-        fields = self.command_response_map[command]
-        fmt = self.get_formatter_str(fields)
-        length = struct.calcsize(fmt)
+        length = self.reply_length(command)
         raw_reply = self.read_once(length)
         if (self.acknowledge(raw_reply)) and (self.reply_end(raw_reply)):
             return self.decode_response(raw_reply, command)
@@ -348,9 +517,7 @@ class ProtocolDecoder:
         """
         command = 'GER'
         self.send_command(command)
-        fields = self.command_response_map[command]
-        fmt = self.get_formatter_str(fields)
-        length = struct.calcsize(fmt)
+        length = self.reply_length(command)
         raw_reply = self.read_once(length)
         print(raw_reply)
         if (self.acknowledge(raw_reply)) and (self.reply_end(raw_reply)):
@@ -407,10 +574,8 @@ class ProtocolDecoder:
             params = struct.pack(fmt, stage, axis_byte, offset)
             self.send_command('SAI', params)
 
-            response_fields = self.command_response_map[command]
-            response_fmt    = self.get_formatter_str(response_fields)
-            length          = struct.calcsize(response_fmt)
-            raw_reply       = self.receive(length)
+            length          = self.reply_length(command)
+            raw_reply       = self.read_once(length)
 
             if self.acknowledge(raw_reply) and self.reply_end(raw_reply):
                 results[axis_char] = self.decode_response(raw_reply, command)
@@ -436,10 +601,8 @@ class ProtocolDecoder:
         params = struct.pack(fmt, stage)
         self.send_command('SEA', params)
 
-        response_fields = self.command_response_map[command]
-        response_fmt    = self.get_formatter_str(response_fields)
-        length          = struct.calcsize(response_fmt)
-        raw_reply       = self.receive(length)
+        length          = self.reply_length(command)
+        raw_reply       = self.read_once(length)
 
         if self.acknowledge(raw_reply) and self.reply_end(raw_reply):
             return self.decode_response(raw_reply, command)
@@ -463,10 +626,8 @@ class ProtocolDecoder:
         params = struct.pack(fmt, stage)
         self.send_command('CEA', params)
 
-        response_fields = self.command_response_map[command]
-        response_fmt    = self.get_formatter_str(response_fields)
-        length          = struct.calcsize(response_fmt)
-        raw_reply       = self.receive(length)
+        length          = self.reply_length(command)
+        raw_reply       = self.read_once(length)
 
         if self.acknowledge(raw_reply) and self.reply_end(raw_reply):
             return self.decode_response(raw_reply, command)
@@ -502,10 +663,8 @@ class ProtocolDecoder:
         params = struct.pack(fmt, stage, p)
         self.send_command('SPF', params)
 
-        response_fields = self.command_response_map[command]
-        response_fmt    = self.get_formatter_str(response_fields)
-        length          = struct.calcsize(response_fmt)
-        raw_reply       = self.receive(length)
+        length          = self.reply_length(command)
+        raw_reply       = self.read_once(length)
 
         if self.acknowledge(raw_reply) and self.reply_end(raw_reply):
             return self.decode_response(raw_reply, command)
@@ -537,10 +696,362 @@ class ProtocolDecoder:
         params = struct.pack(fmt, stage)
         self.send_command('GPF', params)
 
-        response_fields = self.command_response_map[command]
-        response_fmt    = self.get_formatter_str(response_fields)
-        length          = struct.calcsize(response_fmt)
-        raw_reply       = self.receive(length)
+        length          = self.reply_length(command)
+        raw_reply       = self.read_once(length)
+
+        if self.acknowledge(raw_reply) and self.reply_end(raw_reply):
+            return self.decode_response(raw_reply, command)
+
+    ##### Configuration #####
+
+    def _query(self, command: str, values: tuple = ()) -> dict:
+        """Send a command with its parameters packed after the COMMAND_RESPONSE_MAP key
+        (e.g. 'GAIsa') and return the decoded response, None if not acknowledged."""
+        params = None
+        if values:
+            fmt    = self.get_formatter_str(list(command[3:]), map=self.command_parameter_struct_map)
+            params = struct.pack(fmt, *values)
+        self.send_command(command[:3], params)
+        raw_reply = self.read_once(self.reply_length(command))
 
         if self.acknowledge(raw_reply) and self.reply_end(raw_reply):
             return self.decode_response(raw_reply, command)
+
+    def set_reference_axis(self, stage: int, axis: str, offset: int) -> dict:
+        """Set the target offset of a single axis via SAIsao.
+
+        Parameters
+        ----------
+        stage : int
+            Stage number (1 or 2).
+        axis : str
+            'x' or 'y'.
+        offset : int
+            Target offset in mV (-5000 – +5000).
+
+        Returns
+        -------
+        dict
+            Decoded SAIsao response.
+
+        Raises
+        ------
+        ValueError
+            If stage, axis or offset are out of range.
+        """
+        if stage not in (1, 2):
+            raise ValueError(f'stage must be 1 or 2, got {stage}')
+        if axis not in ('x', 'y'):
+            raise ValueError(f'axis must be x or y, got {axis}')
+        if not (-5000 <= offset <= 5000):
+            raise ValueError(f'offset must be between -5000 and +5000 mV, got {offset}')
+        return self._query('SAIsao', (stage, ord(axis), offset))
+
+    def get_reference_position(self, stage: int = 2) -> dict:
+        """Read the target offsets of both axes via GAIsa.
+
+        Parameters
+        ----------
+        stage : int
+            Stage number (1 or 2, default 2).
+
+        Returns
+        -------
+        dict
+            {'x': offset, 'y': offset} in mV, None for an axis that was not acknowledged.
+        """
+        if stage not in (1, 2):
+            raise ValueError(f'stage must be 1 or 2, got {stage}')
+        results = {}
+        for axis in ('x', 'y'):
+            decoded = self._query('GAIsa', (stage, ord(axis)))
+            results[axis] = decoded['o'] if decoded else None
+        return results
+
+    def set_detector_sensitivity(self, stage: int, i: int) -> dict:
+        """Set the detector sensitivity via SDSsi.
+
+        Parameters
+        ----------
+        stage : int
+            Stage number (1 or 2).
+        i : int
+            Detector sensitivity in mV (0 - 5000).
+
+        Returns
+        -------
+        dict
+            Decoded SDSsi response.
+        """
+        if stage not in (1, 2):
+            raise ValueError(f'stage must be 1 or 2, got {stage}')
+        if not (0 <= i <= 5000):
+            raise ValueError(f'i must be between 0 and 5000 mV, got {i}')
+        return self._query('SDSsi', (stage, i))
+
+    def get_detector_sensitivity(self, stage: int) -> dict:
+        """Read the detector sensitivity via GDSs.
+
+        Returns
+        -------
+        dict
+            Decoded GDSs response, including 'i' (0 - 5000 mV).
+        """
+        if stage not in (1, 2):
+            raise ValueError(f'stage must be 1 or 2, got {stage}')
+        return self._query('GDSs', (stage,))
+
+    def get_stabilization_state(self) -> dict:
+        """Read whether the stabilization of both stages is enabled via GEA.
+
+        Returns
+        -------
+        dict
+            Decoded GEA response, including 'OnOff1' and 'OnOff2' (1 = enabled).
+        """
+        return self._query('GEA')
+
+    def set_label(self, label: str) -> dict:
+        """Set the user defined label via SLAl (listed as 'SLAI' in COMMAND_RESPONSE_MAP).
+
+        Parameters
+        ----------
+        label : str
+            Label of max. 25 ASCII characters including the [] brackets,
+            the brackets are added if missing.
+
+        Returns
+        -------
+        dict
+            Decoded SLAl response.
+        """
+        if not label.startswith('['):
+            label = f'[{label}]'
+        if len(label) > 25:
+            raise ValueError(f'label must be at most 25 characters including [], got {len(label)}')
+        self.send_command('SLA', label.encode('ascii'))
+
+        length          = self.reply_length('SLAI')
+        raw_reply       = self.read_once(length)
+
+        if self.acknowledge(raw_reply) and self.reply_end(raw_reply):
+            return self.decode_response(raw_reply, 'SLAI')
+
+    def get_label(self) -> dict:
+        """Read the user defined label via GLA.
+
+        Returns
+        -------
+        dict
+            Decoded GLA response, including 'l' with the [] brackets.
+        """
+        return self._query('GLA')
+
+    def get_device_id(self) -> dict:
+        """Read the unique device id via GID.
+
+        Returns
+        -------
+        dict
+            Decoded GID response, including 'Device_id', e.g. 'MRC DIG-AD-DA D0941BA1281 E2-Digital-V031-10256'.
+        """
+        return self._query('GID')
+
+    ##### Serial baudrate negotiation #####
+
+    def set_baudrate(self, baudrate: int) -> dict:
+        """Change the baudrate of the serial interface via SBRb.
+
+        The controller acknowledges at the old baudrate and switches afterwards,
+        the connection has to be reopened at the new baudrate by the caller.
+
+        Parameters
+        ----------
+        baudrate : int
+            New baudrate in bit/s (115200, 460800 or 921600).
+
+        Returns
+        -------
+        dict
+            Decoded SBRb response, None if the controller reported an error.
+
+        Raises
+        ------
+        ValueError
+            If baudrate is not one of the selectable baudrates.
+        """
+        if baudrate not in self.baudrate_code_map:
+            raise ValueError(f'baudrate must be one of {sorted(self.baudrate_code_map)}, got {baudrate}')
+
+        command = 'SBRb'
+        param_fields = ['b']
+        fmt    = self.get_formatter_str(param_fields, map=self.command_parameter_struct_map)
+        params = struct.pack(fmt, self.baudrate_code_map[baudrate])
+        self.send_command('SBR', params)
+
+        length          = self.reply_length(command)
+        raw_reply       = self.read_once(length)
+
+        if self.acknowledge(raw_reply) and self.reply_end(raw_reply):
+            return self.decode_response(raw_reply, command)
+
+    def verify_link(self, n: int = 20, stop_on_failure: bool = False) -> dict:
+        """Verify the link with a burst of S1S round trips.
+
+        Parameters
+        ----------
+        n : int
+            Number of S1S round trips in the burst.
+        stop_on_failure : bool
+            End the burst at the first failed round trip, e.g. while probing a
+            baudrate the controller might not answer at.
+
+        Returns
+        -------
+        dict
+            baudrate        -- baudrate of the connection (None for tcp/ip)
+            ok              -- True if all round trips returned a valid reply
+            round_trips     -- number of round trips sent (< n after an early stop)
+            failures        -- number of failed round trips
+            bytes_per_s     -- effective transferred bytes/s (command + reply)
+            latency_mean_s  -- mean round-trip latency of the successful replies
+            latency_max_s   -- max round-trip latency of the successful replies
+        """
+        length = self.reply_length('S1S')
+        # S1S; command + 25 byte reply
+        bytes_per_trip = len('S1S;') + length
+        latencies = []
+        failures = 0
+        sent = 0
+        start = time.perf_counter()
+        for _ in range(n):
+            sent += 1
+            t0 = time.perf_counter()
+            try:
+                reply = self.start_one_shot()
+            except (ConnectionError, TimeoutError, ValueError, struct.error):
+                reply = None
+            if reply is None:
+                failures += 1
+                # drop partial replies so the next round trip starts clean
+                if hasattr(self.connection, 'reset_input_buffer'):
+                    self.connection.reset_input_buffer()
+                if stop_on_failure:
+                    break
+                continue
+            latencies.append(time.perf_counter() - t0)
+        elapsed = time.perf_counter() - start
+
+        return {
+            'baudrate': getattr(self.connection, 'baudrate', None),
+            'ok': failures == 0,
+            'round_trips': sent,
+            'failures': failures,
+            'bytes_per_s': len(latencies) * bytes_per_trip / elapsed if elapsed > 0 else 0.0,
+            'latency_mean_s': sum(latencies) / len(latencies) if latencies else None,
+            'latency_max_s': max(latencies) if latencies else None,
+        }
+
+    def negotiate_baudrate(self, target: int = 921600, n_verify: int = 20) -> list:
+        """Raise the serial baudrate up to target and verify the link at each rate.
+
+        Starting from the highest selectable baudrate <= target, SBR is sent at the
+        current rate, the port is reopened at the new rate and the link verified
+        with verify_link(). An unreliable link falls back to the previous rate and
+        the next lower baudrate is tried. Controllers with an Ethernet module
+        reject SBR with 0xF6 (Baudrate not changeable), which stops the negotiation.
+        If the link fails at the starting baudrate, e.g. the controller kept the rate
+        of a previous session, the other selectable baudrates <= target are probed
+        first. Every verification stops at the first failed round trip, so a silent
+        controller costs a single read timeout per baudrate.
+
+        Parameters
+        ----------
+        target : int
+            Highest baudrate to negotiate (115200, 460800 or 921600).
+        n_verify : int
+            Number of S1S round trips used to verify each baudrate.
+
+        Returns
+        -------
+        list
+            verify_link() reports of every tested baudrate, the first entry is the
+            starting baudrate. The last report with ok=True is the active baudrate.
+
+        Raises
+        ------
+        TypeError
+            If the connection cannot be reopened at another baudrate.
+        ValueError
+            If target is not one of the selectable baudrates.
+        ConnectionError
+            If the link is unreliable at every selectable baudrate.
+        """
+        if not hasattr(self.connection, 'reopen'):
+            raise TypeError('Baudrate negotiation requires a serial connection')
+        if target not in self.baudrate_code_map:
+            raise ValueError(f'target must be one of {sorted(self.baudrate_code_map)}, got {target}')
+
+        current = self.connection.baudrate
+        report = [self.verify_link(n_verify, stop_on_failure=True)]
+        if not report[0]['ok']:
+            # the controller might still run at the rate of a previous negotiation
+            for baudrate in sorted(self.baudrate_code_map, reverse=True):
+                if baudrate == current or baudrate > target:
+                    continue
+                self.connection.reopen(baudrate)
+                # a single round trip tells whether the controller answers at this rate
+                if not self.verify_link(1)['ok']:
+                    continue
+                result = self.verify_link(n_verify, stop_on_failure=True)
+                result['note'] = f'Controller found at {baudrate} bit/s'
+                report.append(result)
+                if result['ok']:
+                    current = baudrate
+                    break
+            else:
+                self.connection.reopen(current)
+                tried = [b for b in sorted(self.baudrate_code_map) if b <= target or b == current]
+                raise ConnectionError(f'Link unreliable at all baudrates {tried} bit/s')
+
+        candidates = [b for b in sorted(self.baudrate_code_map, reverse=True) if current < b <= target]
+        for baudrate in candidates:
+            if self.set_baudrate(baudrate) is None:
+                # Ethernet modules do not support changing the baudrate
+                error = self._query('GER')
+                if error and error['e']['ErrorName'] == self.error_code_map[0xF6]:
+                    note = report[-1].get('note')
+                    report[-1]['note'] = f"{note}; {self.error_code_map[0xF6]}" if note else self.error_code_map[0xF6]
+                    break
+                continue
+
+            self.connection.reopen(baudrate)
+            result = self.verify_link(n_verify, stop_on_failure=True)
+            report.append(result)
+            if result['ok']:
+                return report
+
+            # fall back to the last verified baudrate, the request might not get through
+            try:
+                self.set_baudrate(current)
+            except (ConnectionError, TimeoutError, ValueError, struct.error):
+                pass
+            self.connection.reopen(current)
+            fallback = self.verify_link(n_verify, stop_on_failure=True)
+            report.append(fallback)
+            if not fallback['ok']:
+                raise ConnectionError(f'Link lost after falling back to {current} bit/s')
+
+        return report
+
+def negotiate_baudrate(connection, target: int = 921600, n_verify: int = 20) -> list:
+    """Negotiator for SerialConnection(negotiate_baudrate=...), see
+    ProtocolDecoder.negotiate_baudrate().
+
+    :param connection: open serial connection with a reopen(baudrate) method
+    :param target: highest baudrate to negotiate (115200, 460800 or 921600)
+    :param n_verify: number of S1S round trips used to verify each baudrate
+
+    return: verify_link() reports of every tested baudrate
+    """
+    return ProtocolDecoder(connection).negotiate_baudrate(target, n_verify)
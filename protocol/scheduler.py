@@ -0,0 +1,165 @@
+# protocol/scheduler.py
+
+from concurrent.futures import Future
+import queue
+import struct
+import time
+
+class StreamScheduler:
+    '''
+    stream-aware command scheduler layered on ProtocolDecoder
+
+    While a live stream (SLS) is running the controller rejects every command
+    except CLS (0xFC Stream is running). Commands submitted during a stream are
+    queued and executed as one batch at the next stream message: CLS is sent,
+    the trailing messages are flushed (and still yielded as data), the queued
+    commands are executed and SLS is restarted with the same rate. The size of
+    every resulting data gap is recorded in self.gaps.
+    '''
+
+    def __init__(self, decoder, quiet: float = 0.01):
+        """Initializes the scheduler.
+
+        :param decoder: ProtocolDecoder of the controller
+        :param quiet: Time without received bytes that ends the flush after CLS in seconds
+        """
+        self.decoder = decoder
+        self.quiet = quiet
+        self.gaps = []
+        self._queue = queue.Queue()
+        self._stop = False
+
+    def submit(self, command, *args, **kwargs) -> Future:
+        """Queue a command for the next pause of the stream.
+
+        Can be called from any thread, the command is executed by the thread
+        iterating stream() or calling run_pending().
+
+        :param command: name of a ProtocolDecoder method (e.g. 'set_p_factor') or
+                        a callable receiving the decoder as first argument
+        :param args: arguments of the command
+
+        return: Future of the command result
+        """
+        if isinstance(command, str):
+            method = getattr(self.decoder, command)
+            call = lambda: method(*args, **kwargs)
+        else:
+            call = lambda: command(self.decoder, *args, **kwargs)
+        future = Future()
+        self._queue.put((future, call))
+        return future
+
+    def stop(self):
+        """Stop the running stream at the next message."""
+        self._stop = True
+
+    def run_pending(self) -> int:
+        """Execute all queued commands.
+
+        return: number of executed commands
+        """
+        count = 0
+        while True:
+            try:
+                future, call = self._queue.get_nowait()
+            except queue.Empty:
+                return count
+            count += 1
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(call())
+            except Exception as exc:
+                future.set_exception(exc)
+
+    def stream(self, m: int, r: int):
+        """Start a live stream that pauses for queued commands.
+
+        :param m: number of transmitted data measurement blocks (0: continues measurement)
+        :param r: time interval (1 <= r <= 500 samples/s)
+
+        yield tuple of (arrival, message), see ProtocolDecoder.start_live_stream_raw()
+        """
+        if not (0 <= m <= 65500):
+            raise ValueError(f'm must be between 0 and 65500, got {m}')
+        if not (1 <= r <= 500):
+            raise ValueError(f'r must be between 1 and 500 samples/s, got {r}')
+
+        decoder = self.decoder
+        length = decoder.reply_length('SLSmr')
+        param_fmt = decoder.get_formatter_str(['m', 'r'], map=decoder.command_parameter_struct_map)
+        # pre-encoded commands keep the interruption short
+        stop_chunk = b'CLS;'
+        start_chunk = lambda blocks: b'SLS' + struct.pack(param_fmt, blocks, r) + b';'
+
+        self._stop = False
+        self.run_pending()
+        received = 0
+        last_arrival = None
+        gap = None
+        # framing buffer owned by the scheduler, the bytes of a chunk following the
+        # message that triggers a pause are still split and yielded
+        buffer = bytearray()
+        decoder.connection.write(start_chunk(m))
+        running = True
+        try:
+            while True:
+                chunk = decoder.read(length)
+                if not chunk:
+                    decoder.check_connection()
+                arrival = time.perf_counter()
+                buffer.extend(chunk)
+                for message in decoder.split_stream(buffer, length):
+                    received += 1
+                    if gap is not None:
+                        # first message after the restart closes the gap
+                        gap['duration_s'] = arrival - last_arrival
+                        gap['missed_samples'] = max(0, round(gap['duration_s'] * r) - 1)
+                        self.gaps.append(gap)
+                        gap = None
+                    last_arrival = arrival
+                    yield arrival, message
+                    # End of Stream Flag is the most significant bit of the StatusFlag
+                    if m and message[2] & 0x80:
+                        running = False
+                        # commands submitted on the last message run after the stream
+                        self.run_pending()
+                        return
+                if not self._stop and self._queue.empty():
+                    continue
+
+                # pause: stop the stream and keep the trailing messages
+                t_pause = time.perf_counter()
+                decoder.connection.write(stop_chunk)
+                trailing, _ = decoder.flush_stream(length, self.quiet, buffer=buffer)
+                buffer.clear()
+                running = False
+                ended = False
+                for arrival, message in trailing:
+                    received += 1
+                    last_arrival = arrival
+                    yield arrival, message
+                    if m and message[2] & 0x80:
+                        ended = True
+                if self._stop or ended or (m and received >= m):
+                    self.run_pending()
+                    return
+
+                t_execute = time.perf_counter()
+                commands = self.run_pending()
+                t_restart = time.perf_counter()
+                decoder.connection.write(start_chunk(m - received if m else 0))
+                running = True
+                gap = {
+                    'commands': commands,
+                    'pause_s': t_execute - t_pause,
+                    'execute_s': t_restart - t_execute,
+                    'duration_s': None,
+                    'missed_samples': None,
+                }
+        finally:
+            # a stream abandoned by the consumer is stopped to accept commands again
+            if running:
+                decoder.connection.write(stop_chunk)
+                decoder.flush_stream(length, self.quiet, buffer=buffer)
@@ -0,0 +1,280 @@
+# protocol/schema.py
+
+import json
+import os
+import re
+import struct
+import time
+
+# read-only commands sent by the startup probe: COMMAND_RESPONSE_MAP key -> parameters
+PROBE_COMMANDS = {
+    'GID': (),
+    'GLA': (),
+    'GEA': (),
+    'GSF': (),
+    'GER': (),
+    'GDA': (),
+    'GPFs': (1,),
+    'GAIsa': (1, ord('x')),
+    'GDSs': (1,),
+    'S1S': (),
+}
+
+# replies per probed command, a layout differing from the schema is only used if
+# all of them agree (the controller sometimes truncates single S1S replies)
+PROBE_REPEATS = 5
+
+# format of the cached layouts, entries of another version are probed again
+CACHE_VERSION = 2
+
+# firmware part of the device id, e.g. 'E2-Digital-V031' of 'MRC DIG-AD-DA D0941BA1281 E2-Digital-V031-10256'
+FIRMWARE_PATTERN = re.compile(r'(\S+-V\d+)')
+
+# environment variable overriding the layout cache file
+CACHE_ENV = 'MRC_BEAMSTAB_LAYOUT_CACHE'
+
+def default_cache_path() -> str:
+    """Layout cache file, $MRC_BEAMSTAB_LAYOUT_CACHE or <user cache dir>/mrc_beamstab/layouts.json."""
+    if os.environ.get(CACHE_ENV):
+        return os.environ[CACHE_ENV]
+    base = os.environ.get('XDG_CACHE_HOME') or os.environ.get('LOCALAPPDATA') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'mrc_beamstab', 'layouts.json')
+
+def firmware_key(device_id: str) -> str:
+    """Key of the layout cache, the firmware version of the device id or the whole id."""
+    match = FIRMWARE_PATTERN.search(device_id)
+    return match.group(1) if match else device_id.strip()
+
+def observed_fields(decoder, fields: list, length: int) -> tuple:
+    """Fields of an acknowledged reply of length bytes.
+
+    The leading fields of the schema are kept as long as they fit, the
+    terminating semicolon stays the last field. Bytes that do not fill a whole
+    field are skipped as padding in front of it.
+
+    :param decoder: ProtocolDecoder of the controller
+    :param fields: fields of the command in COMMAND_RESPONSE_MAP
+    :param length: observed reply length in bytes
+
+    return: tuple of (fields, struct formatter string)
+    """
+    formats = [decoder.return_value_struct_map[field] for field in fields]
+    terminated = fields[-1] == 'semi_end'
+    body = len(fields) - 1 if terminated else len(fields)
+    available = length - (struct.calcsize('>' + formats[-1]) if terminated else 0)
+    kept = []
+    fmt = '>'
+    for field, field_fmt in zip(fields[:body], formats[:body]):
+        if struct.calcsize(fmt + field_fmt) > available:
+            break
+        kept.append(field)
+        fmt += field_fmt
+    padding = available - struct.calcsize(fmt)
+    if padding > 0:
+        fmt += f'{padding}x'
+    if terminated:
+        kept.append(fields[-1])
+        fmt += formats[-1]
+    return kept, fmt
+
+class ResponseLayout:
+    '''
+    compiled response layout of a firmware
+
+    Reply fields, lengths and precompiled struct.Struct objects of every command
+    of COMMAND_RESPONSE_MAP. A probed command whose replies consistently differ
+    from the schema uses the observed layout (see observed_fields()), all others
+    the schema. Stream messages (SLSmr, SPSm) always use the schema. Assigned to
+    ProtocolDecoder.layout, reply_length() and decode_response() use the
+    lengths and the compiled structs.
+    '''
+
+    def __init__(self, firmware: str, device_id: str, checks: dict = None, probed: float = None):
+        """
+        :param firmware: firmware key, see firmware_key()
+        :param device_id: device id the layout was probed on
+        :param checks: probe results per command, see probe()
+        :param probed: time.time() of the probe
+        """
+        self.firmware = firmware
+        self.device_id = device_id
+        self.checks = checks or {}
+        self.probed = probed
+        # set if the layout was loaded from the cache instead of probed
+        self.cached = False
+        self.fields = {}
+        self.structs = {}
+        self.lengths = {}
+
+    @property
+    def mismatches(self) -> dict:
+        """Probe results of the commands not matching the schema."""
+        return {key: check for key, check in self.checks.items() if not check['ok']}
+
+    @property
+    def confirmed(self) -> bool:
+        return bool(self.checks) and not self.mismatches
+
+    @property
+    def consistent(self) -> bool:
+        """True if all replies of every probed command were acknowledged, terminated and of one length."""
+        return bool(self.checks) and all(check['consistent'] for check in self.checks.values())
+
+    def compile(self, decoder) -> 'ResponseLayout':
+        """Precompile the reply structs of all commands, consistently observed layouts replace the schema."""
+        for key, fields in decoder.command_response_map.items():
+            if key == 'StatusFlag':
+                continue
+            check = self.checks.get(key)
+            if check is not None and check['consistent'] and check.get('fields'):
+                fields, fmt = check['fields'], check['format']
+            else:
+                fmt = decoder.get_formatter_str(fields)
+            compiled = struct.Struct(fmt)
+            self.fields[key] = list(fields)
+            self.structs[key] = compiled
+            self.lengths[key] = compiled.size
+        return self
+
+    def to_dict(self) -> dict:
+        return {'version': CACHE_VERSION, 'device_id': self.device_id, 'probed': self.probed, 'checks': self.checks}
+
+    @classmethod
+    def from_dict(cls, firmware: str, data: dict) -> 'ResponseLayout':
+        return cls(firmware, data['device_id'], data['checks'], data['probed'])
+
+def _read_reply(decoder, timeout: float, quiet: float) -> bytes:
+    """Read a reply of unknown length: the first bytes within timeout, the rest until quiet."""
+    connection = decoder.connection
+    previous_timeout = connection.timeout
+    buffer = bytearray()
+    try:
+        connection.set_timeout(timeout)
+        while True:
+            try:
+                chunk = decoder.read(4096)
+                if not chunk:
+                    decoder.check_connection()
+            except TimeoutError:
+                chunk = b''
+            if not chunk:
+                break
+            buffer.extend(chunk)
+            connection.set_timeout(quiet)
+    finally:
+        connection.set_timeout(previous_timeout)
+    decoder.record_latency()
+    return bytes(buffer)
+
+def probe(decoder, timeout: float = 1.0, quiet: float = 0.05, repeats: int = PROBE_REPEATS) -> dict:
+    """Send every read command of PROBE_COMMANDS repeats times and check the replies against the schema.
+
+    Replies are read until no byte arrived for quiet seconds, so shorter and
+    longer replies than expected are both detected. No stream may be running.
+
+    :param decoder: ProtocolDecoder of the controller
+    :param timeout: max. wait for the first byte of a reply in seconds
+    :param quiet: time without received bytes that ends a reply in seconds
+    :param repeats: replies per command
+
+    return: dict of COMMAND_RESPONSE_MAP key -> dict of
+        expected    -- reply length of the schema
+        observed    -- received number of bytes of every reply
+        ack         -- all replies start with 0;
+        terminated  -- all replies end on ;
+        consistent  -- all of the above and every reply has the same length
+        ok          -- consistent and the length of the schema
+        reply       -- hex of the first reply not matching the schema
+        fields      -- fields of a consistent layout differing from the schema, see observed_fields()
+        format      -- struct formatter string of that layout
+    """
+    checks = {}
+    for key, values in PROBE_COMMANDS.items():
+        params = None
+        if values:
+            fmt = decoder.get_formatter_str(list(key[3:]), map=decoder.command_parameter_struct_map)
+            params = struct.pack(fmt, *values)
+        fields = decoder.command_response_map[key]
+        expected = struct.calcsize(decoder.get_formatter_str(fields))
+        replies = []
+        for _ in range(repeats):
+            decoder.send_command(key[:3], params)
+            replies.append(_read_reply(decoder, timeout, quiet))
+        lengths = [len(reply) for reply in replies]
+        check = {
+            'expected': expected,
+            'observed': lengths,
+            'ack': all(reply[:2] == b'\x00;' for reply in replies),
+            'terminated': all(reply[-1:] == b';' for reply in replies),
+        }
+        check['consistent'] = check['ack'] and check['terminated'] and len(set(lengths)) == 1
+        check['ok'] = check['consistent'] and lengths[0] == expected
+        if not check['ok']:
+            check['reply'] = next(reply for reply in replies if len(reply) != expected or reply[:2] != b'\x00;'
+                                  or reply[-1:] != b';').hex()
+            if check['consistent']:
+                check['fields'], check['format'] = observed_fields(decoder, fields, lengths[0])
+        checks[key] = check
+    return checks
+
+def read_cache(path: str) -> dict:
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+def write_cache(path: str, cache: dict):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # write to a temporary file first, a concurrent session never reads a partial cache
+    temporary = f'{path}.{os.getpid()}.tmp'
+    with open(temporary, 'w') as file:
+        json.dump(cache, file, indent=1)
+    os.replace(temporary, path)
+
+def load_layout(decoder, cache_path: str = None, refresh: bool = False, strict: bool = False) -> ResponseLayout:
+    """Validate the response schema of the connected firmware and assign the compiled layout.
+
+    The device id is read with GID. A layout of its firmware in the cache is
+    used without probing, otherwise probe() checks every read command. A reply
+    layout differing from the schema is only used and cached if all replies of
+    the probe agree on it, e.g. a firmware with consistently shorter S1S
+    replies is probed once. A probe with replies of varying length, without
+    acknowledgement or terminator is not cached, the commands concerned keep
+    the schema and the next session probes again.
+
+    :param decoder: ProtocolDecoder of the controller, no stream may be running
+    :param cache_path: layout cache file, default default_cache_path()
+    :param refresh: probe even if the firmware is cached
+    :param strict: raise a ValueError if a reply does not match the schema
+
+    return: ResponseLayout, also assigned to decoder.layout
+    """
+    if cache_path is None:
+        cache_path = default_cache_path()
+    device_id = decoder.get_device_id()
+    if device_id is None:
+        raise ValueError('GID has not been acknowledged')
+    device_id = device_id['Device_id']
+    firmware = firmware_key(device_id)
+
+    cache = read_cache(cache_path)
+    if not refresh and cache.get(firmware, {}).get('version') == CACHE_VERSION:
+        layout = ResponseLayout.from_dict(firmware, cache[firmware])
+        layout.cached = True
+    else:
+        layout = ResponseLayout(firmware, device_id, probe(decoder), time.time())
+        if layout.consistent:
+            cache[firmware] = layout.to_dict()
+            write_cache(cache_path, cache)
+
+    if strict and layout.mismatches:
+        details = ', '.join(
+            f'{key} {"/".join(map(str, check["observed"]))} instead of {check["expected"]} byte'
+            for key, check in layout.mismatches.items()
+        )
+        raise ValueError(f'Replies of firmware {firmware} do not match the schema: {details}')
+    decoder.layout = layout.compile(decoder)
+    return layout
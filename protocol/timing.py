@@ -0,0 +1,221 @@
+# protocol/timing.py
+
+from array import array
+from collections import deque
+import numpy as np
+
+# the drift fit needs this many latency floor points spanning this many seconds
+# of device time, before the nominal period is used (the floor jitters by tens of
+# microseconds, a fit over a few windows reports drifts of hundreds of ppm)
+FIT_MIN_POINTS = 8
+FIT_MIN_SPAN = 10.0
+
+class StreamClock:
+    '''
+    device clock reconstruction for SLSmr stream messages
+
+    Stream messages carry no timestamps. The controller samples at the requested
+    rate r, so message n was sampled at n / r on the device clock. Arrival times
+    only jitter late (OS scheduling, tcp/ip batching), so the earliest arrival of
+    every window of messages lies on the latency floor. These floor points are
+    fitted online against their index (host = offset + index * period) to estimate
+    the clock offset and the drift of the device clock against the host clock.
+    Until the floor points cover FIT_MIN_SPAN seconds the nominal period is used.
+
+    Lost messages shift all following arrivals by whole sample periods against
+    their index, which is detected by comparing the latency floor of the newest
+    messages with the floor of the already finalized ones. Messages are therefore
+    finalized with a delay of `window` messages. Transport batching locked to the
+    sample rate can move the latency floor by up to a sample period and cause false
+    gaps, a larger window averages over more batches.
+    '''
+
+    def __init__(self, rate: int, window: int = None):
+        """Initializes the clock for a stream started with SLSmr.
+
+        :param rate: Sampling rate r of the stream in samples/s (1 - 500).
+        :param window: Number of messages to look ahead before finalizing,
+                       default half a second of messages (min. 8).
+        """
+        if not (1 <= rate <= 500):
+            raise ValueError(f'rate must be between 1 and 500 samples/s, got {rate}')
+        self.rate = rate
+        self.nominal_period = 1.0 / rate
+        self.window = window if window is not None else max(8, rate // 2)
+
+        # arrival times are kept relative to the first arrival for numerical stability
+        self._t0 = None
+        self._next_index = 0
+        self._pending = deque()
+        self._floor = None
+
+        # online least squares fit (Welford) of the latency floor points
+        self._n = 0
+        self._mean_index = 0.0
+        self._mean_arrival = 0.0
+        self._m2_index = 0.0
+        self._c_index_arrival = 0.0
+        self._first_floor_index = None
+        self._last_floor_index = None
+
+        # finalized messages
+        self._index = array('q')
+        self._arrival = array('d')
+        self.gaps = []
+
+    # ========== fit ========== #
+    @property
+    def fitted(self) -> bool:
+        """True once enough latency floor points over a long enough span were fitted."""
+        if self._n < FIT_MIN_POINTS or self._m2_index == 0:
+            return False
+        return (self._last_floor_index - self._first_floor_index) / self.rate >= FIT_MIN_SPAN
+
+    @property
+    def period(self) -> float:
+        """Fitted sample period of the device clock in host seconds, the nominal period until fitted."""
+        if not self.fitted:
+            return self.nominal_period
+        return self._c_index_arrival / self._m2_index
+
+    @property
+    def offset(self) -> float:
+        """Host time of the sample with index 0, includes the minimum transport latency."""
+        if self._t0 is None:
+            return None
+        if self._n == 0:
+            return self._t0
+        return self._t0 + self._mean_arrival - self.period * self._mean_index
+
+    @property
+    def drift(self) -> float:
+        """Relative drift of the device clock, e.g. 1e-6 for a 1 ppm slower device clock, None until fitted."""
+        if not self.fitted:
+            return None
+        return self.period / self.nominal_period - 1.0
+
+    @property
+    def lost(self) -> int:
+        """Total number of messages detected as lost."""
+        return sum(missing for _, missing in self.gaps)
+
+    def _predict(self, index: np.ndarray) -> np.ndarray:
+        """Fitted arrival times relative to the first arrival."""
+        if self._n == 0:
+            return index * self.nominal_period
+        return self._mean_arrival + self.period * (index - self._mean_index)
+
+    def _update_fit(self, index: float, arrival: float):
+        if self._first_floor_index is None:
+            self._first_floor_index = index
+        self._last_floor_index = index
+        self._n += 1
+        d_index = index - self._mean_index
+        self._mean_index += d_index / self._n
+        self._mean_arrival += (arrival - self._mean_arrival) / self._n
+        self._m2_index += d_index * (index - self._mean_index)
+        self._c_index_arrival += d_index * (arrival - self._mean_arrival)
+
+    # ========== messages ========== #
+    def add(self, arrival: float) -> int:
+        """Add the host arrival time of the next stream message.
+
+        :param arrival: Host arrival time in seconds (time.perf_counter()).
+
+        return: number of messages finalized by this call
+        """
+        if self._t0 is None:
+            self._t0 = arrival
+        self._pending.append([self._next_index, arrival - self._t0])
+        self._next_index += 1
+        if len(self._pending) < 2 * self.window:
+            return 0
+        self._detect_gap()
+        return self._finalize(self.window)
+
+    def flush(self) -> int:
+        """Finalize all pending messages, e.g. at the end of a stream.
+
+        return: number of messages finalized by this call
+        """
+        if len(self._pending) > self.window:
+            self._detect_gap()
+        return self._finalize(len(self._pending))
+
+    def _detect_gap(self):
+        index = np.array([item[0] for item in self._pending], dtype=np.float64)
+        arrival = np.array([item[1] for item in self._pending])
+        # the nominal period is exact enough over two windows (100 ppm drift over 1 s
+        # is 0.1 ms) and not biased by a fit over few windows
+        period = self.nominal_period
+        residual = arrival - index * period
+        floor = self._floor if self._floor is not None else residual[:self.window].min()
+
+        # latency floors of two windows differ by less than a sample period, a shift
+        # of at least 3/4 period is taken as lost messages
+        missing = int(np.floor((residual[self.window:].min() - floor) / period + 0.25))
+        if missing < 1:
+            return
+        # the gap follows the last message that would arrive before its sample time
+        # (below the latency floor) when shifted by the missing messages
+        early = np.nonzero(residual - missing * period < floor - 0.25 * period)[0]
+        first = int(early[-1]) + 1 if len(early) else 0
+        for item in list(self._pending)[first:]:
+            item[0] += missing
+        self._next_index += missing
+        self.gaps.append((self._pending[first][0], missing))
+
+    def _finalize(self, count: int) -> int:
+        if count == 0:
+            return 0
+        block = [self._pending.popleft() for _ in range(count)]
+        index, arrival = np.array(block, dtype=np.float64).T
+        self._index.extend(int(i) for i in index)
+        self._arrival.extend(arrival)
+
+        residual = arrival - index * self.nominal_period
+        lowest = int(residual.argmin())
+        self._floor = float(residual[lowest])
+        self._update_fit(index[lowest], arrival[lowest])
+        return count
+
+    # ========== output ========== #
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def times(self) -> dict:
+        """Time columns of all finalized messages in arrival order.
+
+        return dict of numpy arrays
+            index        -- reconstructed sample index (lost messages leave holes)
+            sample_time  -- device time index / r in seconds since the first sample
+            host_time    -- sample time mapped onto the host clock with the current fit
+            arrival      -- host arrival time
+            gap          -- True for messages preceded by lost messages
+        """
+        index = np.frombuffer(self._index, dtype=np.int64) if len(self._index) else np.empty(0, dtype=np.int64)
+        arrival = np.frombuffer(self._arrival, dtype=np.float64) if len(self._arrival) else np.empty(0)
+        gap = np.zeros(len(index), dtype=bool)
+        if len(index) > 1:
+            gap[1:] = np.diff(index) > 1
+        t0 = self._t0 if self._t0 is not None else 0.0
+        return {
+            'index': index.copy(),
+            'sample_time': index / self.rate,
+            'host_time': t0 + self._predict(index.astype(np.float64)),
+            'arrival': t0 + arrival,
+            'gap': gap,
+        }
+
+def reconstruct_times(arrivals, rate: int, window: int = None) -> dict:
+    """Reconstruct the time columns of a recorded stream, see StreamClock.times().
+
+    :param arrivals: host arrival times of the stream messages in seconds
+    :param rate: Sampling rate r of the stream in samples/s
+    :param window: look ahead of the gap detection in messages
+    """
+    clock = StreamClock(rate, window)
+    for arrival in np.asarray(arrivals, dtype=np.float64):
+        clock.add(float(arrival))
+    clock.flush()
+    return clock.times()
@@ -0,0 +1,179 @@
+# protocol/waveform.py
+
+import threading
+import time
+import numpy as np
+
+# one pre-encoded SDAsad command: name, stage, axis, drive value (big-endian), semicolon
+SDA_DTYPE = np.dtype([('command', 'S3'), ('s', 'u1'), ('a', 'u1'), ('d', '>i2'), ('end', 'S1')])
+
+class WaveformPlayer:
+    '''
+    deadline-scheduled piezo waveform playback via direct drive (SDAsad)
+
+    All commands are encoded before the playback starts. Sample n is sent at
+    the absolute deadline start + n / rate on the perf_counter clock, so a late
+    send does not delay the following ones. The waiting sleeps until `spin`
+    seconds before a deadline and busy-waits the rest, OS sleeps are too coarse
+    for sub-millisecond periods (~1 ms on Linux under load, up to 15 ms on
+    Windows). The actual send times are logged to measure rate and jitter.
+
+    SDA is only accepted while the stabilization of the stage is disabled
+    (error 0xFB), this is checked with GEA before the playback.
+    '''
+
+    def __init__(self, decoder, waveform, rate: float, stage: int = 2, axis: str = 'x', spin: float = 0.002):
+        """Encodes the waveform.
+
+        :param decoder: ProtocolDecoder of the controller
+        :param waveform: drive values in mV (-5000 - +5000), shape (samples,) for a single
+                         axis or (samples, 2) for the x and y axis
+        :param rate: samples/s
+        :param stage: stage number (1 or 2)
+        :param axis: axis of a single axis waveform, 'x' or 'y'
+        :param spin: seconds busy-waited before every deadline
+        """
+        if stage not in (1, 2):
+            raise ValueError(f'stage must be 1 or 2, got {stage}')
+        if rate <= 0:
+            raise ValueError(f'rate must be positive, got {rate}')
+        waveform = np.asarray(waveform)
+        if waveform.ndim == 1:
+            if axis not in ('x', 'y'):
+                raise ValueError(f'axis must be x or y, got {axis}')
+            waveform = waveform[:, None]
+            self.axes = (axis,)
+        elif waveform.ndim == 2 and waveform.shape[1] == 2:
+            self.axes = ('x', 'y')
+        else:
+            raise ValueError(f'waveform must have the shape (samples,) or (samples, 2), got {waveform.shape}')
+        values = np.rint(waveform)
+        if values.size and (values.min() < -5000 or values.max() > 5000):
+            raise ValueError('drive values must be between -5000 and +5000 mV')
+
+        self.decoder = decoder
+        self.stage = stage
+        self.rate = rate
+        self.spin = spin
+        self.waveform = values.astype(np.int16)
+        self.chunks = self.encode(self.waveform, stage, self.axes)
+        self.reply_length = decoder.reply_length('SDAsad')
+
+        self.targets = None
+        self.send_times = None
+        self.errors = 0
+        self.played = 0
+        self._stop = threading.Event()
+
+    @staticmethod
+    def encode(waveform: np.ndarray, stage: int, axes: tuple) -> list:
+        """Encode all samples at once.
+
+        :param waveform: int16 drive values of shape (samples, len(axes))
+        :param stage: stage number
+        :param axes: axis of every column
+
+        return: list of bytes, the SDA commands of all axes of a sample
+        """
+        samples = len(waveform)
+        commands = np.empty((samples, len(axes)), dtype=SDA_DTYPE)
+        commands['command'] = b'SDA'
+        commands['s'] = stage
+        commands['a'] = [ord(axis) for axis in axes]
+        commands['d'] = waveform
+        commands['end'] = b';'
+        raw = commands.tobytes()
+        size = SDA_DTYPE.itemsize * len(axes)
+        return [raw[i:i + size] for i in range(0, len(raw), size)]
+
+    def check_disabled(self):
+        """Raise a ValueError if the stabilization of the stage is enabled (SDA would fail with 0xFB)."""
+        state = self.decoder.get_stabilization_state()
+        if state is None:
+            raise ValueError('GEA has not been acknowledged')
+        if state[f'OnOff{self.stage}']:
+            raise ValueError(f'stabilization of stage {self.stage} is enabled, SDA needs a disabled stage (0xFB)')
+
+    def wait_until(self, deadline: float):
+        """Sleep until spin seconds before the deadline, busy-wait the rest."""
+        remaining = deadline - time.perf_counter()
+        if remaining > self.spin:
+            time.sleep(remaining - self.spin)
+        while time.perf_counter() < deadline:
+            pass
+
+    def play(self, check: bool = True) -> dict:
+        """Play the waveform, blocks until all samples are sent or stop() is called.
+
+        Every reply is read before waiting for the next deadline, an error reply
+        (0xFE out of range, 0xFB stage enabled) is counted and the playback continues.
+
+        :param check: check with GEA that the stage is disabled
+
+        return: report(), the send times are kept in self.send_times
+        """
+        if check:
+            self.check_disabled()
+        connection = self.decoder.connection
+        read_once = self.decoder.read_once
+        replies = len(self.axes)
+        samples = len(self.chunks)
+        period = 1.0 / self.rate
+        send_times = np.full(samples, np.nan)
+        self.errors = 0
+        self.played = 0
+        self._stop.clear()
+
+        # first deadline slightly ahead, the sleep/spin is settled then
+        start = time.perf_counter() + max(self.spin, period)
+        self.targets = start + np.arange(samples) * period
+        deadlines = self.targets.tolist()
+        for i, chunk in enumerate(self.chunks):
+            if self._stop.is_set():
+                break
+            self.wait_until(deadlines[i])
+            send_times[i] = time.perf_counter()
+            connection.write(chunk)
+            for _ in range(replies):
+                if read_once(self.reply_length)[:2] != b'\x00;':
+                    self.errors += 1
+            self.played = i + 1
+        self.send_times = send_times[:self.played]
+        self.targets = self.targets[:self.played]
+        return self.report()
+
+    def stop(self):
+        """Stop a playback running on another thread after the current sample."""
+        self._stop.set()
+
+    def report(self) -> dict:
+        """Achieved rate and timing of the last playback.
+
+        return dict of
+            samples         -- number of sent samples
+            rate            -- requested samples/s
+            achieved_rate   -- samples/s between the first and the last send
+            jitter_s        -- standard deviation of the send intervals
+            lateness_p50_s  -- median delay of the sends behind their deadlines
+            lateness_p99_s  -- 99th percentile of the delay
+            lateness_max_s  -- maximum delay
+            late            -- sends delayed by more than half a period
+            errors          -- SDA commands answered with an error
+        """
+        if self.send_times is None or len(self.send_times) == 0:
+            return {'samples': 0, 'rate': self.rate, 'errors': self.errors}
+        times = self.send_times
+        lateness = times - self.targets
+        intervals = np.diff(times)
+        duration = times[-1] - times[0]
+        return {
+            'samples': len(times),
+            'rate': self.rate,
+            'achieved_rate': float((len(times) - 1) / duration) if duration > 0 else None,
+            'jitter_s': float(intervals.std()) if len(intervals) else 0.0,
+            'lateness_p50_s': float(np.percentile(lateness, 50)),
+            'lateness_p99_s': float(np.percentile(lateness, 99)),
+            'lateness_max_s': float(lateness.max()),
+            'late': int((lateness > 0.5 / self.rate).sum()),
+            'errors': self.errors,
+        }
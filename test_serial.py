@@ -1,9 +1,8 @@
-from connections import TCPConnection
-from connections.serial import SerialConnection
+from connections import connection_from_url
 from protocol import ProtocolDecoder  
 import time
 
-with SerialConnection('COM5') as conn:
+with connection_from_url('serial://COM5') as conn:
     decoder = ProtocolDecoder(conn)
     enable = True
 
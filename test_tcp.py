@@ -1,8 +1,8 @@
-from connections import TCPConnection
+from connections import connection_from_url
 from protocol import ProtocolDecoder  
 import time
 
-with TCPConnection('192.168.1.106') as conn:
+with connection_from_url('tcp://192.168.1.106:2000') as conn:
 
     decoder = ProtocolDecoder(conn)
     print(decoder.start_one_shot())
@@ -0,0 +1,24 @@
+# tests/conftest.py
+
+# behaviour tests against the local stand-in controller, the scripts test_tcp.py
+# and test_serial.py in the repository root need the hardware and are not collected
+
+import pytest
+from connections import connection_from_url
+from protocol import ProtocolDecoder
+from protocol.emulator import ControllerEmulator
+
+@pytest.fixture
+def emulator():
+    with ControllerEmulator() as emulator:
+        yield emulator
+
+@pytest.fixture
+def connection(emulator):
+    host, port = emulator.serve_tcp()
+    with connection_from_url(f'tcp://{host}:{port}') as connection:
+        yield connection
+
+@pytest.fixture
+def decoder(connection):
+    return ProtocolDecoder(connection)
@@ -0,0 +1,91 @@
+# tests/test_baudrate.py
+
+import pytest
+from connections.serial import SerialConnection
+from protocol import ProtocolDecoder, negotiate_baudrate
+from protocol.emulator import ControllerEmulator
+
+class SerialLink:
+    '''serial connection stand-in, the emulator only understands bytes sent at its own baudrate'''
+
+    def __init__(self, emulator: ControllerEmulator, baudrate: int = 115200):
+        self.emulator = emulator
+        self.baudrate = baudrate
+        self.timeout = 0.1
+        self.is_open = True
+        self.reopened = []
+        self.silent_reads = 0
+        self.buffer = bytearray()
+        emulator._write = self.buffer.extend
+
+    def set_timeout(self, timeout: float):
+        self.timeout = timeout
+
+    def reopen(self, baudrate: int):
+        self.reopened.append(baudrate)
+        self.baudrate = baudrate
+        self.buffer.clear()
+
+    def reset_input_buffer(self):
+        self.buffer.clear()
+
+    def write(self, data: bytes):
+        if self.baudrate == self.emulator.baudrate:
+            self.emulator.receive(data)
+
+    def read(self, size: int) -> bytes:
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        if not data:
+            self.silent_reads += 1
+        return data
+
+def test_negotiate_up_to_target():
+    emulator = ControllerEmulator()
+    link = SerialLink(emulator)
+    report = ProtocolDecoder(link).negotiate_baudrate(921600, n_verify=5)
+    assert report[-1]['ok'] and report[-1]['baudrate'] == 921600
+    assert link.baudrate == emulator.baudrate == 921600
+
+def test_controller_found_at_previous_rate():
+    emulator = ControllerEmulator()
+    emulator.baudrate = 460800
+    link = SerialLink(emulator)
+    report = ProtocolDecoder(link).negotiate_baudrate(460800, n_verify=5)
+    # the failed first verification ends after one round trip
+    assert report[0]['round_trips'] == 1 and not report[0]['ok']
+    assert report[-1]['note'] == 'Controller found at 460800 bit/s'
+    assert 921600 not in link.reopened and link.baudrate == 460800
+
+def test_ethernet_note_appended_silently(capsys):
+    emulator = ControllerEmulator(ethernet=True)
+    emulator.baudrate = 460800
+    link = SerialLink(emulator)
+    report = ProtocolDecoder(link).negotiate_baudrate(921600, n_verify=5)
+    assert report[-1]['note'] == 'Controller found at 460800 bit/s; Baudrate not changeable'
+    assert link.baudrate == 460800
+    # GER is decoded without printing the raw and decoded reply
+    assert 'Baudrate not changeable' not in capsys.readouterr().out
+
+def test_silent_controller_fails_fast():
+    emulator = ControllerEmulator()
+    emulator.baudrate = 921600
+    link = SerialLink(emulator)
+    with pytest.raises(ConnectionError):
+        ProtocolDecoder(link).negotiate_baudrate(460800, n_verify=20)
+    # rates above the target are not probed, one round trip per probed rate
+    assert 921600 not in link.reopened
+    assert link.baudrate == 115200
+
+class Silent(ControllerEmulator):
+    def handle(self, command, params):
+        return b''
+
+def test_serial_open_closes_port_after_failed_negotiation():
+    with Silent() as emulator:
+        connection = SerialConnection(
+            emulator.serve_pty(), timeout=0.1, negotiate_baudrate=460800, negotiator=negotiate_baudrate
+        )
+        with pytest.raises((ConnectionError, TimeoutError)):
+            connection.open()
+        assert not connection.is_open
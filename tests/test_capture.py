@@ -0,0 +1,70 @@
+# tests/test_capture.py
+
+import numpy as np
+import pytest
+from contextlib import ExitStack
+from connections import connection_from_url
+from mrc_beamstab.capture import (
+    MultiCapture, NpyWriter, RECORD_DTYPE, cross_correlation, messages_to_records,
+)
+from protocol import ProtocolDecoder
+from protocol.emulator import ControllerEmulator
+
+def decoders(stack: ExitStack, n: int) -> list:
+    result = []
+    for _ in range(n):
+        emulator = stack.enter_context(ControllerEmulator(ethernet=True))
+        host, port = emulator.serve_tcp()
+        result.append(ProtocolDecoder(stack.enter_context(connection_from_url(f'tcp://{host}:{port}'))))
+    return result
+
+def test_messages_to_records():
+    emulator = ControllerEmulator()
+    messages = [emulator.frame(), emulator.frame()]
+    records = messages_to_records([1.0, 2.0], messages)
+    assert records.dtype == RECORD_DTYPE and records['arrival'].tolist() == [1.0, 2.0]
+
+def test_npy_writer_round_trip(tmp_path):
+    records = np.zeros(5, dtype=RECORD_DTYPE)
+    records['arrival'] = np.arange(5)
+    records['DX2'] = np.arange(-2, 3)
+    path = str(tmp_path / 'records.npy')
+    with NpyWriter(path) as writer:
+        writer.write(records[:2])
+        writer.write(records[2:])
+    assert np.array_equal(np.load(path), records)
+    with NpyWriter(str(tmp_path / 'empty.npy')):
+        pass
+    assert np.load(str(tmp_path / 'empty.npy')).shape == (0,)
+
+def test_cross_correlation_lag():
+    rng = np.random.default_rng(0)
+    a = rng.normal(size=400)
+    b = np.roll(a, 3)
+    b[:5] = np.nan
+    lags, correlation = cross_correlation(a, b, 10)
+    assert lags[correlation.argmax()] == 3 and correlation.max() > 0.9
+
+def test_rate_validated():
+    with pytest.raises(ValueError):
+        MultiCapture([], rate=0)
+
+def test_merge_needs_messages_of_every_device():
+    with ExitStack() as stack:
+        capture = MultiCapture(decoders(stack, 2), rate=100)
+        emulator = ControllerEmulator()
+        for i in range(10):
+            capture.arrivals[0].append(i / 100)
+            capture.messages[0].extend(emulator.frame())
+        with pytest.raises(ValueError):
+            capture.merge()
+
+def test_capture_two_devices(tmp_path):
+    with ExitStack() as stack:
+        capture = MultiCapture(decoders(stack, 2), rate=200, names=['a', 'b']).run(0.5)
+        dataset = capture.save(str(tmp_path / 'sync.npz'))
+    assert dataset['devices'].tolist() == ['a', 'b']
+    assert len(dataset['time']) > 50 and dataset['DX2'].shape == (2, len(dataset['time']))
+    assert dataset['start_skew_s'].min() == 0.0 and (dataset['period_s'] > 0).all()
+    saved = np.load(str(tmp_path / 'sync.npz'))
+    assert np.array_equal(saved['time'], dataset['time'])
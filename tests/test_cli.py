@@ -0,0 +1,64 @@
+# tests/test_cli.py
+
+import json
+import numpy as np
+import pytest
+from mrc_beamstab.cli import main, resolve_command
+
+@pytest.fixture
+def url(emulator):
+    host, port = emulator.serve_tcp()
+    return f'tcp://{host}:{port}'
+
+def output(capsys) -> list:
+    return [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+
+def test_resolve_command():
+    assert resolve_command('GPF') == 'GPFs'
+    assert resolve_command('sai') == 'SAIsao'
+    assert resolve_command('S1S') == 'S1S'
+    with pytest.raises(ValueError):
+        resolve_command('XYZ')
+
+def test_query(url, emulator, capsys):
+    assert main(['--url', url, 'query', 'SPF', '2', '1500']) == 0
+    assert main(['--url', url, 'query', 'GPF', '2']) == 0
+    written, read = output(capsys)
+    assert written['ok'] and read['response']['p'] == 1500 and emulator.p_factor[2] == 1500
+
+def test_query_error_decoded(url, capsys):
+    assert main(['--url', url, 'query', 'GPF', '3']) == 1
+    result = output(capsys)[0]
+    assert not result['ok'] and result['error']['CMD'] == 'GPF'
+
+def test_query_usage_errors(url, capsys):
+    assert main(['--url', url, 'query', 'SLS', '0', '500']) == 2
+    assert main(['--url', url, 'query', 'SPF', '2']) == 2
+    errors = [json.loads(line) for line in capsys.readouterr().err.splitlines()]
+    assert [error['error'] for error in errors] == ['ValueError', 'ValueError']
+
+def test_url_required(monkeypatch):
+    monkeypatch.delenv('MRC_BEAMSTAB_URL', raising=False)
+    with pytest.raises(SystemExit):
+        main(['query', 'S1S'])
+
+def test_stream_npy(url, tmp_path, capsys):
+    path = str(tmp_path / 'stream.npy')
+    assert main(['--url', url, 'stream', '--count', '50', '--rate', '500', '--format', 'npy',
+                 '--output', path, '--block', '16']) == 0
+    records = np.load(path)
+    assert len(records) == 50 and (np.diff(records['arrival']) >= 0).all()
+    assert json.loads(capsys.readouterr().err)['messages'] == 50
+
+def test_stream_jsonl(url, capsys):
+    assert main(['--url', url, 'stream', '--count', '5', '--rate', '200', '--format', 'jsonl']) == 0
+    records = output(capsys)
+    assert len(records) == 5 and 'DX2' in records[0] and 'semi_end' not in records[0]
+
+def test_stats_and_bench(url, capsys):
+    assert main(['--url', url, 'stats', '--rate', '200', '--interval', '0.2', '--duration', '0.5']) == 0
+    reports = output(capsys)
+    assert reports and reports[-1]['messages_per_s'] > 100
+    assert main(['--url', url, 'bench', '--count', '10']) == 0
+    bench = output(capsys)[0]
+    assert bench['failures'] == 0 and bench['latency_s']['count'] == 10
@@ -0,0 +1,65 @@
+# tests/test_config.py
+
+import pytest
+from protocol.config import ControllerConfig, plan_restore, restore, snapshot
+
+def config(**changes) -> ControllerConfig:
+    settings = {
+        'p_factor': {1: 1000, 2: 1000},
+        'offset': {1: {'x': 0, 'y': 0}, 2: {'x': 0, 'y': 0}},
+        'sensitivity': {1: 2500, 2: 2500},
+        'enabled': {1: False, 2: True},
+        'label': '[bench]',
+    }
+    settings.update(changes)
+    return ControllerConfig(**settings)
+
+def test_plan_skips_matching_settings():
+    assert plan_restore(config(), config()) == []
+
+def test_plan_disables_stage_for_offset_change():
+    target = config(offset={1: {'x': 0, 'y': 0}, 2: {'x': 250, 'y': 0}}, label='[new]')
+    assert plan_restore(config(), target) == [
+        ('disable_stabilization', (2,)),
+        ('set_reference_axis', (2, 'x', 250)),
+        ('set_label', ('[new]',)),
+        ('enable_stabilization', (2,)),
+    ]
+
+def test_plan_keeps_disabled_stage_disabled():
+    current = config(enabled={1: True, 2: True})
+    target = config(enabled={1: False, 2: True}, p_factor={1: 1200, 2: 1000})
+    assert plan_restore(current, target) == [('disable_stabilization', (1,)), ('set_p_factor', (1, 1200))]
+
+def test_round_trip_file(tmp_path):
+    path = str(tmp_path / 'config.json')
+    original = config()
+    original.save(path)
+    assert ControllerConfig.load(path) == original
+
+def test_restore_diff(emulator, decoder):
+    decoder.enable_stabilization(2)
+    target = snapshot(decoder)
+    target.p_factor[1] = 1500
+    target.offset[2]['x'] = 250
+
+    planned = restore(decoder, target, dry_run=True)
+    assert emulator.p_factor[1] == 1000
+    expected = [
+        ('disable_stabilization', [2]),
+        ('set_p_factor', [1, 1500]),
+        ('set_reference_axis', [2, 'x', 250]),
+        ('enable_stabilization', [2]),
+    ]
+    assert planned['commands'] == expected
+    assert restore(decoder, target)['commands'] == expected
+    assert emulator.p_factor[1] == 1500 and emulator.offset[(2, 'x')] == 250 and emulator.enabled[2]
+    # a restored configuration needs no writes
+    again = restore(decoder, target)
+    assert again['commands'] == [] and snapshot(decoder) == target
+
+def test_restore_refuses_other_device(decoder):
+    target = snapshot(decoder)
+    target.device_id = 'MRC DIG-AD-DA OTHER'
+    with pytest.raises(ValueError):
+        restore(decoder, target)
@@ -0,0 +1,60 @@
+# tests/test_connections.py
+
+import pytest
+from connections import connection_from_url, register_transport
+from connections import registry
+from connections.base import BaseConnection
+from connections.registry import get_transport, parse_url
+from connections.serial import SerialConnection
+from protocol import negotiate_baudrate
+
+class NotAConnection:
+    @classmethod
+    def from_url(cls, path, options):
+        return cls()
+
+def test_parse_url():
+    assert parse_url('tcp://192.168.1.106:2000') == ('tcp', '192.168.1.106:2000', {})
+    assert parse_url('SERIAL:///dev/ttyUSB0?baud=921600&rtscts') == (
+        'serial', '/dev/ttyUSB0', {'baud': '921600', 'rtscts': ''}
+    )
+    assert parse_url('serial://COM5') == ('serial', 'COM5', {})
+    for url in ('192.168.1.106:2000', '://COM5'):
+        with pytest.raises(ValueError):
+            parse_url(url)
+
+def test_from_url_is_abstract():
+    class NoURL(BaseConnection):
+        def open(self): pass
+        def close(self): pass
+        def write(self, data): pass
+        def read(self, size): return b''
+        def set_timeout(self, timeout): pass
+    with pytest.raises(TypeError):
+        NoURL()
+
+def test_register_rejects_non_connections(monkeypatch):
+    monkeypatch.setattr(registry, '_transports', dict(registry._transports))
+    with pytest.raises(ValueError):
+        register_transport('fake', NotAConnection)
+    # lazily imported entries are validated on first use
+    register_transport('fake', 'tests.test_connections:NotAConnection')
+    with pytest.raises(ValueError):
+        get_transport('fake')
+    with pytest.raises(ValueError):
+        connection_from_url('unknown://somewhere')
+
+def test_url_options():
+    connection = connection_from_url('serial:///dev/ttyUSB0?baud=921600&low_latency=yes', timeout=0.5)
+    assert isinstance(connection, SerialConnection)
+    assert (connection.baudrate, connection.low_latency, connection.timeout) == (921600, True, 0.5)
+    with pytest.raises(ValueError):
+        connection_from_url('serial:///dev/ttyUSB0?parity=E')
+    with pytest.raises(ValueError):
+        connection_from_url('tcp://192.168.1.106:2000?baud=921600')
+
+def test_serial_negotiation_needs_negotiator():
+    with pytest.raises(ValueError):
+        connection_from_url('serial:///dev/ttyUSB0?negotiate=921600')
+    connection = connection_from_url('serial:///dev/ttyUSB0?negotiate=921600', negotiator=negotiate_baudrate)
+    assert connection.negotiate_baudrate == 921600 and connection.negotiator is negotiate_baudrate
@@ -0,0 +1,85 @@
+# tests/test_executor.py
+
+import threading
+import pytest
+from protocol.executor import CommandExecutor, PRIORITY_SAFETY, PRIORITY_NORMAL, PRIORITY_POLL
+
+def test_priority_order_and_coalescing(emulator, decoder):
+    executor = CommandExecutor(decoder)
+    release = threading.Event()
+    order = []
+    # the I/O thread is held while the requests queue up
+    blocker = executor.submit(lambda decoder: release.wait(5))
+    poll = executor.submit(lambda decoder: order.append('poll'), priority=PRIORITY_POLL)
+    normal = executor.submit(lambda decoder: order.append('normal'), priority=PRIORITY_NORMAL)
+    safety = executor.submit(lambda decoder: order.append('safety'), priority=PRIORITY_SAFETY)
+    first = executor.submit('start_one_shot')
+    second = executor.submit('start_one_shot')
+    other = executor.submit('get_p_factor', 1)
+    release.set()
+    for future in (blocker, poll, normal, safety, other):
+        future.result(5)
+    assert order == ['safety', 'normal', 'poll']
+    assert first is second and executor.coalesced == 1
+    assert 'DX2' in first.result(5)
+    assert other.result(5)['p'] == emulator.p_factor[1]
+    # a finished read is not coalesced with a new request
+    assert executor.submit('start_one_shot') is not first
+    executor.shutdown()
+
+def test_coalesced_read_raised_to_higher_priority(decoder):
+    executor = CommandExecutor(decoder)
+    release = threading.Event()
+    done_before = []
+    executor.submit(lambda decoder: release.wait(5))
+    read = executor.submit('get_p_factor', 1, priority=PRIORITY_POLL)
+    normal = executor.submit(lambda decoder: done_before.append(read.done()), priority=PRIORITY_NORMAL)
+    assert executor.submit('get_p_factor', 1, priority=PRIORITY_SAFETY) is read
+    release.set()
+    normal.result(5)
+    assert done_before == [True]
+    assert read.result(5)['p'] == 1000
+    executor.shutdown()
+
+class Recorder:
+    '''stand-in decoder counting its calls'''
+
+    def __init__(self):
+        self.calls = 0
+
+    def get_values(self, values):
+        self.calls += 1
+        return len(values)
+
+def test_unhashable_read_is_not_coalesced():
+    recorder = Recorder()
+    with CommandExecutor(recorder) as executor:
+        first = executor.submit('get_values', [1, 2])
+        second = executor.submit('get_values', [1, 2])
+        assert first.result(5) == second.result(5) == 2
+    assert first is not second and recorder.calls == 2 and executor.coalesced == 0
+
+def test_shutdown_cancels_pending(decoder):
+    executor = CommandExecutor(decoder)
+    started, release = threading.Event(), threading.Event()
+
+    def block(decoder):
+        started.set()
+        return release.wait(5)
+
+    blocker = executor.submit(block)
+    started.wait(5)
+    pending = executor.submit('get_p_factor', 1)
+    # the raised duplicate entry of the read is cancelled as well
+    executor.submit('get_p_factor', 1, priority=PRIORITY_SAFETY)
+    executor.shutdown(wait=False, cancel_pending=True)
+    release.set()
+    assert blocker.result(5) is True
+    assert pending.cancelled()
+    with pytest.raises(RuntimeError):
+        executor.submit('get_p_factor', 1)
+
+def test_unknown_command(decoder):
+    with CommandExecutor(decoder) as executor:
+        with pytest.raises(ValueError):
+            executor.submit('no_such_method')
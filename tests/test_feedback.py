@@ -0,0 +1,43 @@
+# tests/test_feedback.py
+
+import pytest
+from protocol.feedback import OuterLoopController
+
+def controller(**kwargs) -> OuterLoopController:
+    return OuterLoopController(None, lambda message: None, **kwargs)
+
+def test_update_step_limited():
+    loop = controller(kp=1.0, max_step=100)
+    assert loop.update((250, -250), 0.1)
+    assert loop.offset == [100, -100]
+    loop.update((250, -250), 0.1)
+    loop.update((250, -250), 0.1)
+    assert loop.offset == [250, -250]
+    assert not loop.update((250, -250), 0.1)
+
+def test_update_clamped_without_windup():
+    loop = controller(kp=1.0, ki=10.0, max_step=10000, initial=(0, 0))
+    for _ in range(10):
+        loop.update((8000, 0), 0.1)
+    assert loop.offset[0] == OuterLoopController.limit
+    # the integrator is held while the output saturates
+    assert loop.integral[0] == 0.0
+
+def test_stage_validated():
+    with pytest.raises(ValueError):
+        controller(stage=3)
+
+def test_loop_writes_offsets(emulator, decoder):
+    messages = []
+
+    def error_fn(message):
+        messages.append(message)
+        return (200, -200)
+
+    loop = OuterLoopController(decoder, error_fn, kp=1.0, rate=50, max_step=100, latency_budget=1.0)
+    loop.run(iterations=4, duration=5.0)
+    assert loop.offset == [200, -200]
+    assert (emulator.offset[(2, 'x')], emulator.offset[(2, 'y')]) == (200, -200)
+    stats = loop.stats()
+    assert stats['iterations'] >= 4 and stats['violations'] == 0
+    assert stats['latency_max'] is not None and 'DX2' in messages[0]
@@ -0,0 +1,52 @@
+# tests/test_liveplot.py
+
+import numpy as np
+import pytest
+import time
+from mrc_beamstab.liveplot import CHANNELS, RingBuffer, minmax_decimate
+from protocol.emulator import ControllerEmulator
+
+def test_ring_buffer_wraps_in_order():
+    ring = RingBuffer(4, channels=['DX2'])
+    for i in range(3):
+        ring.append(float(i), [i * 10])
+    t, data = ring.snapshot()
+    assert t.tolist() == [0.0, 1.0, 2.0] and data.shape == (1, 3)
+    for i in range(3, 10):
+        ring.append(float(i), [i * 10])
+    t, data = ring.snapshot()
+    assert t.tolist() == [6.0, 7.0, 8.0, 9.0]
+    assert data[0].tolist() == [60.0, 70.0, 80.0, 90.0]
+
+def test_minmax_decimate_passthrough():
+    x = np.arange(10.0)
+    assert minmax_decimate(x, x, 5)[0] is x
+
+def test_minmax_decimate_keeps_peaks():
+    x = np.arange(10000.0)
+    y = np.zeros((2, 10000))
+    y[0, 1234] = 4000
+    y[1, 8765] = -4000
+    x_out, y_out = minmax_decimate(x, y, 100)
+    assert len(x_out) == 200 and y_out.shape == (2, 200)
+    assert y_out[0].max() == 4000 and y_out[1].min() == -4000
+    assert (np.diff(x_out) >= 0).all()
+
+def test_liveplot_update():
+    matplotlib = pytest.importorskip('matplotlib')
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from mrc_beamstab.liveplot import LivePlot
+    plot = LivePlot(rate=500, span=2.0)
+    try:
+        emulator = ControllerEmulator()
+        now = time.perf_counter()
+        for i in range(3000):
+            plot.feed(now - 3.0 + i / 1000, emulator.frame())
+        plot.figure.canvas.draw()
+        plot.update()
+        columns = int(plot.axes[0].get_window_extent().width)
+        assert plot.frames == 1 and len(plot.lines) == len(CHANNELS)
+        assert 0 < len(plot.lines[0].get_xdata()) <= 2 * columns
+    finally:
+        plt.close(plot.figure)
@@ -0,0 +1,91 @@
+# tests/test_scheduler.py
+
+import struct
+import pytest
+from protocol import ProtocolDecoder
+from protocol.scheduler import StreamScheduler
+
+def frame(index: int) -> bytes:
+    """25 byte stream message carrying its index in DX1/DY1."""
+    return b'\x00;\x00\x00' + struct.pack('>I', index) + bytes(16) + b';'
+
+class ChunkedStream:
+    '''stand-in connection delivering three stream messages per read'''
+
+    def __init__(self):
+        self.timeout = 1.0
+        self.pending = bytearray()
+        self.streaming = False
+        self.sent = 0
+
+    def set_timeout(self, timeout):
+        self.timeout = timeout
+
+    def write(self, data):
+        if data.startswith(b'SLS'):
+            self.streaming = True
+        elif data == b'CLS;':
+            self.streaming = False
+            # messages in flight before the stream stops, then the CLS reply
+            self.pending += frame(self.sent) + frame(self.sent + 1) + b'\x00;'
+            self.sent += 2
+
+    def read(self, size):
+        if not self.pending and self.streaming:
+            for _ in range(3):
+                self.pending += frame(self.sent)
+                self.sent += 1
+        if not self.pending:
+            raise TimeoutError('quiet')
+        data = bytes(self.pending)
+        self.pending.clear()
+        return data
+
+def index(message: bytes) -> int:
+    return struct.unpack('>I', message[4:8])[0]
+
+def test_pause_keeps_messages_of_the_same_chunk():
+    scheduler = StreamScheduler(ProtocolDecoder(ChunkedStream()))
+    received = []
+    for _, message in scheduler.stream(0, 500):
+        received.append(index(message))
+        if received[-1] in (0, 7):
+            scheduler.submit(lambda decoder: None)
+        if len(received) == 20:
+            break
+    assert received == list(range(20))
+    assert len(scheduler.gaps) == 2
+
+def test_pause_resume_exact_block_count(emulator, decoder):
+    m = 300
+    scheduler = StreamScheduler(decoder)
+    futures = []
+    messages = []
+    for _, message in scheduler.stream(m, 500):
+        messages.append(message)
+        if len(messages) % 50 == 0:
+            futures.append(scheduler.submit('set_p_factor', 2, 1000 + len(messages)))
+    # every pause restarts with the remaining blocks, none is lost or counted twice
+    assert len(messages) == m
+    assert messages[-1][2] & 0x80 and not any(message[2] & 0x80 for message in messages[:-1])
+    assert all(future.result(1) is not None for future in futures)
+    # the command submitted on the last message runs after the stream ended
+    assert sum(gap['commands'] for gap in scheduler.gaps) == len(futures) - 1
+    assert emulator.p_factor[2] == 1000 + m
+    # the controller accepts commands again
+    assert decoder.get_p_factor(2)['p'] == 1000 + m
+
+def test_stop_ends_the_stream(decoder):
+    scheduler = StreamScheduler(decoder)
+    count = 0
+    for _ in scheduler.stream(0, 500):
+        count += 1
+        if count == 10:
+            scheduler.stop()
+    assert count >= 10
+    assert decoder.get_p_factor(1) is not None
+
+def test_tcp_read_timeout(connection):
+    connection.set_timeout(0.05)
+    with pytest.raises(TimeoutError):
+        connection.read(25)
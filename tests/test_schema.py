@@ -0,0 +1,100 @@
+# tests/test_schema.py
+
+import json
+import pytest
+from connections import connection_from_url
+from protocol import ProtocolDecoder
+from protocol.emulator import ControllerEmulator
+from protocol.schema import load_layout, observed_fields, firmware_key, CACHE_VERSION
+
+class ShortS1S(ControllerEmulator):
+    '''emulator truncating S1S replies to 21 byte, every reply or only every `every`-th'''
+
+    def __init__(self, every: int = 1):
+        super().__init__()
+        self.every = every
+        self.replies = 0
+
+    def handle(self, command, params):
+        reply = super().handle(command, params)
+        if command == 'S1S' and reply[:2] == b'\x00;':
+            self.replies += 1
+            if self.replies % self.every == 0:
+                return reply[:20] + b';'
+        return reply
+
+def session(emulator, cache_path):
+    host, port = emulator.serve_tcp()
+    connection = connection_from_url(f'tcp://{host}:{port}')
+    connection.open()
+    decoder = ProtocolDecoder(connection)
+    return decoder, load_layout(decoder, cache_path=cache_path)
+
+def test_observed_fields_short_reply():
+    decoder = ProtocolDecoder(None)
+    fields, fmt = observed_fields(decoder, decoder.command_response_map['S1S'], 21)
+    assert fields[-3:] == ['RX1', 'RY1', 'semi_end'] and 'RX2' not in fields
+    assert fmt == '>BBBBhhHhhHHHB'
+
+def test_observed_fields_padding():
+    decoder = ProtocolDecoder(None)
+    fields, fmt = observed_fields(decoder, decoder.command_response_map['GPFs'], 7)
+    assert fields == ['fe', 'semi_fe', 'p', 'semi_end'] and fmt == '>BBH2xB'
+    # replies without a terminating field keep all fitting fields
+    assert observed_fields(decoder, ['fe', 'semi_fe'], 2) == (['fe', 'semi_fe'], '>BB')
+
+def test_firmware_key():
+    assert firmware_key('MRC DIG-AD-DA D0941BA1281 E2-Digital-V031-10256') == 'E2-Digital-V031'
+    assert firmware_key(' custom ') == 'custom'
+
+def test_matching_layout_cached(tmp_path):
+    cache_path = str(tmp_path / 'layouts.json')
+    with ControllerEmulator() as emulator:
+        decoder, layout = session(emulator, cache_path)
+        assert layout.confirmed and not layout.cached
+        decoder.connection.close()
+        decoder, layout = session(emulator, cache_path)
+        assert layout.cached and layout.confirmed
+        assert decoder.reply_length('S1S') == 25 and decoder.start_one_shot() is not None
+        decoder.connection.close()
+
+def test_consistent_short_layout_applied_to_s1s_only(tmp_path):
+    cache_path = str(tmp_path / 'layouts.json')
+    with ShortS1S() as emulator:
+        decoder, layout = session(emulator, cache_path)
+        assert not layout.confirmed and list(layout.mismatches) == ['S1S']
+        assert decoder.reply_length('S1S') == 21
+        # stream framing does not inherit the S1S layout
+        assert decoder.reply_length('SLSmr') == 25
+        reply = decoder.start_one_shot()
+        assert 'RY1' in reply and 'RX2' not in reply
+        decoder.connection.close()
+        decoder, layout = session(emulator, cache_path)
+        assert layout.cached and decoder.reply_length('S1S') == 21
+        decoder.connection.close()
+
+def test_strict_refuses_mismatch(tmp_path):
+    with ShortS1S() as emulator:
+        host, port = emulator.serve_tcp()
+        with connection_from_url(f'tcp://{host}:{port}') as connection:
+            with pytest.raises(ValueError):
+                load_layout(ProtocolDecoder(connection), cache_path=str(tmp_path / 'layouts.json'), strict=True)
+
+def test_intermittent_short_reply_not_cached(tmp_path):
+    cache_path = str(tmp_path / 'layouts.json')
+    with ShortS1S(every=3) as emulator:
+        decoder, layout = session(emulator, cache_path)
+        assert not layout.consistent and not layout.checks['S1S']['consistent']
+        # the schema is kept and nothing is cached
+        assert decoder.reply_length('S1S') == 25
+        assert not (tmp_path / 'layouts.json').exists()
+        decoder.connection.close()
+
+def test_cache_of_other_version_probed_again(tmp_path):
+    cache_path = tmp_path / 'layouts.json'
+    cache_path.write_text(json.dumps({'E2-Digital-V031': {'device_id': 'x', 'probed': 0, 'checks': {}}}))
+    with ControllerEmulator() as emulator:
+        decoder, layout = session(emulator, str(cache_path))
+        assert not layout.cached and layout.confirmed
+        assert json.loads(cache_path.read_text())['E2-Digital-V031']['version'] == CACHE_VERSION
+        decoder.connection.close()
@@ -0,0 +1,35 @@
+# tests/test_serial_read.py
+
+import time
+import pytest
+from connections.serial import SerialConnection
+from protocol import ProtocolDecoder
+from protocol.emulator import ControllerEmulator
+
+@pytest.fixture
+def pty():
+    with ControllerEmulator() as emulator:
+        yield emulator.serve_pty()
+
+def test_low_latency_read_ends_after_reply(pty):
+    with SerialConnection(pty, timeout=2.0, low_latency=True, inter_byte_timeout=0.01) as connection:
+        connection.write(b'S1S;')
+        start = time.perf_counter()
+        # more bytes requested than the reply has, the read ends at the byte gap
+        reply = connection.read(100)
+        assert len(reply) == 25 and reply[:2] == b'\x00;'
+        assert time.perf_counter() - start < 1.0
+
+def test_low_latency_read_times_out_without_reply(pty):
+    with SerialConnection(pty, timeout=0.1, low_latency=True) as connection:
+        start = time.perf_counter()
+        assert connection.read(25) == b''
+        assert 0.09 < time.perf_counter() - start < 1.0
+
+def test_latency_stats(pty):
+    with SerialConnection(pty, timeout=1.0, low_latency=True) as connection:
+        decoder = ProtocolDecoder(connection)
+        for _ in range(5):
+            assert decoder.start_one_shot() is not None
+        stats = decoder.latency_stats()['S1S']
+        assert stats['count'] == 5 and 0 < stats['p50'] <= stats['max'] < 1.0
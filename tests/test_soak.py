@@ -0,0 +1,64 @@
+# tests/test_soak.py
+
+import json
+import tracemalloc
+from mrc_beamstab.cli import main
+from mrc_beamstab.soak import SoakTest, compare_reports, percentiles, slope
+from protocol.emulator import serve_process
+
+def soak(decoder, **kwargs):
+    options = dict(duration=1.0, interval=0.25, stream_seconds=0.1, budgets={'p99_s': None, 'p99_drift': None})
+    options.update(kwargs)
+    return SoakTest(decoder, **options)
+
+def test_percentiles_and_slope():
+    assert percentiles([]) == {'count': 0, 'p50': None, 'p90': None, 'p99': None, 'max': None}
+    stats = percentiles([float(value) for value in range(101, 0, -1)])
+    assert (stats['count'], stats['p50'], stats['p99'], stats['max']) == (101, 51.0, 100.0, 101.0)
+    assert slope([0, 1, 2, 3], [1, 3, 5, 7]) == 2.0
+    assert slope([1, 1], [0, 5]) == 0.0
+
+def test_setters_restored(emulator, decoder):
+    report = soak(decoder, mix={'setters': 1}, trace=False).run()
+    assert report['summary']['operations'] > 0 and report['summary']['restored_commands'] > 0
+    assert emulator.p_factor == {1: 1000, 2: 1000}
+    assert set(emulator.offset.values()) == {0}
+
+def test_trace_of_caller_kept(decoder):
+    report = soak(decoder, mix={'S1S': 1, 'GDA': 1}).run()
+    assert report['summary']['restored_commands'] is None
+    assert not tracemalloc.is_tracing()
+    tracemalloc.start()
+    try:
+        soak(decoder, mix={'S1S': 1}).run()
+        assert tracemalloc.is_tracing()
+    finally:
+        tracemalloc.stop()
+
+def test_compare_reports(decoder):
+    old = soak(decoder, mix={'S1S': 1}, trace=False, label='old').run()
+    new = soak(decoder, mix={'S1S': 1}, trace=False, label='new').run()
+    comparison = compare_reports(old, new)
+    assert (comparison['old'], comparison['new']) == ('old', 'new')
+    assert set(comparison['delta']['latency']) == {'S1S'}
+
+def test_cli_refuses_setters_on_url(capsys):
+    process, (host, port) = serve_process()
+    try:
+        url = f'tcp://{host}:{port}'
+        assert main(['--url', url, 'soak', '--duration', '0.2']) == 2
+        assert 'allow-writes' in json.loads(capsys.readouterr().err)['message']
+        rc = main(['--url', url, 'soak', '--duration', '0.5', '--interval', '0.25', '--allow-writes',
+                   '--mix', 'setters=1', '--no-trace', '--max-p99', '1', '--max-p99-drift', '100'])
+        report = json.loads(capsys.readouterr().out)
+        assert rc == 0 and report['summary']['restored_commands'] > 0
+    finally:
+        process.terminate()
+        process.join()
+
+def test_cli_default_soak_uses_emulator_process(capsys):
+    rc = main(['soak', '--duration', '0.5', '--interval', '0.25', '--mix', 'S1S=1,setters=1',
+               '--max-p99', '1', '--max-p99-drift', '100'])
+    report = json.loads(capsys.readouterr().out)
+    assert rc == 0 and report['passed']
+    assert not tracemalloc.is_tracing()
@@ -0,0 +1,58 @@
+# tests/test_stepresponse.py
+
+import numpy as np
+import pytest
+import warnings
+from mrc_beamstab.stepresponse import StepResponse, analyse, distribution, resample
+
+def test_distribution():
+    assert distribution([np.nan])['n'] == 0
+    result = distribution([1.0, np.nan, 3.0])
+    assert (result['n'], result['mean'], result['p50']) == (2, 2.0, 2.0)
+
+def test_resample_gap_is_nan():
+    grid = np.arange(0.0, 1.0, 0.1)
+    t = np.array([0.0, 0.1, 0.2, 0.7, 0.8, 0.9])
+    out = resample([t, t[:1]], [t * 10, t[:1]], grid, max_gap=0.06)
+    assert np.allclose(out[0, [0, 1, 2, 7, 8, 9]], [0, 1, 2, 7, 8, 9])
+    assert np.isnan(out[0, [4, 5]]).all()
+    # trials with less than two samples cannot be interpolated
+    assert np.isnan(out[1]).all()
+
+def test_analyse_first_order_step():
+    grid = np.arange(-0.05, 0.3, 0.0001)
+    delay, tau = 0.01, 0.02
+    step = np.where(grid >= delay, 100 * (1 - np.exp(-(grid - delay) / tau)), 0.0)
+    overshoot = step * (1 + 0.2 * np.exp(-((grid - 0.2) / 0.01) ** 2))
+    flat = np.zeros_like(grid)
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        metrics = analyse(grid, np.stack((step, overshoot, flat)))
+    assert metrics['delay_s'][0] == pytest.approx(delay + tau * np.log(1 / 0.9), abs=2e-4)
+    assert metrics['rise_s'][0] == pytest.approx(tau * np.log(9), abs=2e-4)
+    assert metrics['overshoot_pct'][0] == pytest.approx(0.0, abs=0.1)
+    assert metrics['settling_s'][0] == pytest.approx(delay + tau * np.log(20), abs=2e-4)
+    assert metrics['overshoot_pct'][1] == pytest.approx(20.0, abs=1.0)
+    # no step above the noise
+    assert np.isnan([metrics[key][2] for key in ('delay_s', 'rise_s', 'overshoot_pct', 'settling_s')]).all()
+
+def test_arguments_validated(decoder):
+    with pytest.raises(ValueError):
+        StepResponse(decoder, mode='ramp')
+    with pytest.raises(ValueError):
+        StepResponse(decoder, stage=3)
+    # offset steps need the closed loop
+    with pytest.raises(ValueError):
+        StepResponse(decoder, trials=1).run()
+
+@pytest.mark.parametrize('poll', [True, False])
+def test_offset_steps(emulator, decoder, poll):
+    decoder.enable_stabilization(2)
+    report = StepResponse(decoder, step=(500, -300), trials=4, post=0.1, poll=poll).run()
+    assert report['trials'] == 4 and report['gap_s']['n'] == (0 if poll else 4)
+    dx, dy = report['axes']['DX2'], report['axes']['DY2']
+    assert dx['amplitude']['p50'] == pytest.approx(500, rel=0.05)
+    assert dy['amplitude']['p50'] == pytest.approx(300, rel=0.05)
+    assert dx['delay_s']['n'] == 4 and 0 < dx['delay_s']['p50'] < 0.05
+    # offsets and enable state are restored
+    assert emulator.offset[(2, 'x')] == emulator.offset[(2, 'y')] == 0 and emulator.enabled[2]
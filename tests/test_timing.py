@@ -0,0 +1,43 @@
+# tests/test_timing.py
+
+import numpy as np
+import pytest
+from protocol.timing import StreamClock, reconstruct_times, FIT_MIN_SPAN
+
+def arrivals(seconds: float, rate: int, drift: float = 0.0, latency: float = 2e-4, seed: int = 0) -> np.ndarray:
+    """Synthetic arrival times, late by an exponential transport latency."""
+    rng = np.random.default_rng(seed)
+    n = int(seconds * rate)
+    return np.arange(n) / rate * (1 + drift) + rng.exponential(latency, n)
+
+def test_recorded_stream_gap(decoder):
+    rate = 100
+    recorded = [arrival for arrival, _ in decoder.start_live_stream_raw(300, rate)]
+    assert len(recorded) == 300
+    # messages 150 - 154 lost on the way
+    times = reconstruct_times(recorded[:150] + recorded[155:], rate)
+    assert times['index'][150] == 155
+    assert list(times['index'][times['gap']]) == [155]
+    assert len(reconstruct_times(recorded, rate)['index']) == 300
+
+def test_no_false_gaps():
+    times = reconstruct_times(arrivals(10, 500), 500)
+    assert not times['gap'].any()
+    assert list(times['index']) == list(range(5000))
+
+def test_drift_unknown_before_min_span():
+    clock = StreamClock(500)
+    for arrival in arrivals(1.5, 500, drift=100e-6):
+        clock.add(float(arrival))
+    assert clock.drift is None
+    assert clock.period == clock.nominal_period
+
+def test_drift_estimate():
+    clock = StreamClock(500)
+    for arrival in arrivals(3 * FIT_MIN_SPAN, 500, drift=100e-6):
+        clock.add(float(arrival))
+    assert clock.drift == pytest.approx(100e-6, abs=10e-6)
+
+def test_rate_validation():
+    with pytest.raises(ValueError):
+        StreamClock(0)
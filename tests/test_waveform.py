@@ -0,0 +1,40 @@
+# tests/test_waveform.py
+
+import numpy as np
+import pytest
+import struct
+from protocol import ProtocolDecoder
+from protocol.waveform import WaveformPlayer
+
+def test_encode():
+    chunks = WaveformPlayer.encode(np.array([[100, -200], [0, 5000]], dtype=np.int16), 2, ('x', 'y'))
+    assert chunks[0] == b'SDA\x02x' + struct.pack('>h', 100) + b';SDA\x02y' + struct.pack('>h', -200) + b';'
+    assert len(chunks) == 2 and len(chunks[1]) == 16
+
+@pytest.mark.parametrize('waveform, options', [
+    (np.zeros(4), {'stage': 3}),
+    (np.zeros(4), {'axis': 'z'}),
+    (np.zeros(4), {'rate': 0}),
+    (np.zeros((4, 3)), {}),
+    (np.array([0, 5001]), {}),
+])
+def test_validation(waveform, options):
+    kwargs = {'rate': 100}
+    kwargs.update(options)
+    with pytest.raises(ValueError):
+        WaveformPlayer(ProtocolDecoder(None), waveform, **kwargs)
+
+def test_play_drives_stage(emulator, decoder):
+    waveform = np.stack((np.linspace(0, 1000, 50), np.linspace(0, -1000, 50)), axis=1)
+    player = WaveformPlayer(decoder, waveform, rate=500)
+    report = player.play()
+    assert report['samples'] == 50 and report['errors'] == 0
+    assert 400 < report['achieved_rate'] < 600
+    assert (emulator.drive[(2, 'x')], emulator.drive[(2, 'y')]) == (1000, -1000)
+
+def test_play_refuses_enabled_stage(decoder):
+    decoder.enable_stabilization(2)
+    player = WaveformPlayer(decoder, [0, 100], rate=100)
+    with pytest.raises(ValueError):
+        player.play()
+    assert player.report()['samples'] == 0